@@ -0,0 +1,50 @@
+'''Headless core of the four-way stop simulation.
+
+The main classes can be imported from the package itself, each module
+being imported on first use only, so that `import mas` is immediate and
+a run only loads what it needs. The core never imports the web server,
+`mas.server`, nor the `vis` package, and only loads NumPy for the
+`numpy` backend and the modules built on arrays. See
+`python -m mas.benchmark imports` for the import time of the headless
+modules.
+'''
+import importlib
+from typing import Any, List
+
+
+# Module defining each name exported by the package
+_exports = {
+   'FourWayStop':         'mas.model',
+   'RoadNetwork':         'mas.network',
+   'ParallelRoadNetwork': 'mas.parallel',
+   'Ensemble':            'mas.ensemble',
+   'PoissonArrivals':     'mas.arrivals',
+   'TraceArrivals':       'mas.arrivals',
+   'ConvergenceMonitor':  'mas.convergence',
+   'MetricsSink':         'mas.metrics',
+   'CSVSink':             'mas.metrics',
+   'MemorySink':          'mas.metrics',
+   'RecentSink':          'mas.metrics',
+   'ParquetSink':         'mas.metrics',
+   'ResultCache':         'mas.cache',
+   'Profiler':            'mas.profiling',
+   'SamplingProfiler':    'mas.profiling',
+   'TrajectoryRecorder':  'mas.trajectories',
+   'Trajectories':        'mas.trajectories',
+   'spawn_seeds':         'mas.seeding',
+   'replicate_seed':      'mas.seeding'
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name: str) -> Any:
+   if name not in _exports:
+      raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+   value = getattr(importlib.import_module(_exports[name]), name)
+   globals()[name] = value
+   return value
+
+
+def __dir__() -> List[str]:
+   return sorted([*globals(), *_exports])
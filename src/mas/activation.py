@@ -1,8 +1,18 @@
-from typing import List
+from typing import Callable, Dict, List, Optional
 
-from mesa import Model
+from mesa import Agent, Model
 from mesa.time import BaseScheduler
 
+from mas.profiling import Profiler
+
+
+def noop(method: Callable) -> Callable:
+   '''Marks a stage method as doing nothing, so that the scheduler does
+   not call it.
+   '''
+   method.noop = True
+   return method
+
 
 class SimultaneousStagedActivation(BaseScheduler):
    '''Scheduler which allows agent activation to be divided in multiple
@@ -12,6 +22,16 @@ class SimultaneousStagedActivation(BaseScheduler):
    stage: `<stage_name>_step()` and `<stage_name>_advance()`.
    The `step()` method computes the necessary changes, while `advance()`
    applies them.
+
+   The model can take part in a stage too, by defining the same methods,
+   which are called before those of the agents.
+
+   Methods are looked up once for each type of agent, and those marked
+   with `noop` are skipped. The bound methods to call in each stage are
+   cached until agents are added or removed.
+
+   If `profiler` is set, the time spent in each stage and substep is
+   recorded, along with the number of agents called.
    '''
 
    def __init__(
@@ -22,14 +42,98 @@ class SimultaneousStagedActivation(BaseScheduler):
       super().__init__(model)
       self.stage_list = stage_list
       self.stage_time = 1 / len(self.stage_list)
+      self.method_names = [
+         stage + substep
+         for stage in stage_list
+         for substep in ['_step', '_advance']
+      ]
+
+      # Agents of each type, in the order they were added
+      self.agents_by_type: Dict[type, List[Agent]] = {}
+
+      # Stage methods of each type, `None` for the no-ops
+      self.methods: Dict[type, List[Optional[Callable]]] = {}
+
+      # Bound methods to call for each stage and substep
+      self.plan: Optional[List[List[Callable]]] = None
+      self.profiler: Optional[Profiler] = None
+
+   def add(self, agent: Agent) -> None:
+      super().add(agent)
+      agent_type = type(agent)
+      if agent_type not in self.methods:
+         self.methods[agent_type] = [self.resolve(agent_type, name) for name in self.method_names]
+      self.agents_by_type.setdefault(agent_type, []).append(agent)
+      self.plan = None
+
+   def remove(self, agent: Agent) -> None:
+      super().remove(agent)
+      self.agents_by_type[type(agent)].remove(agent)
+      self.plan = None
+
+   def __getstate__(self) -> dict:
+      # Bound methods are cheaper to look up again than to save
+      state = self.__dict__.copy()
+      state['plan'] = None
+      return state
+
+   @staticmethod
+   def resolve(agent_type: type, name: str) -> Optional[Callable]:
+      method = getattr(agent_type, name)
+      return None if getattr(method, 'noop', False) else method
+
+   def make_plan(self) -> List[List[Callable]]:
+      '''Returns the bound methods to call for each stage and substep,
+      in the order the agents were added.
+      '''
+      plan = [[] for _ in self.method_names]
+      for i, name in enumerate(self.method_names):
+         method = getattr(self.model, name, None)
+         if method is not None:
+            plan[i].append(method)
+      for agent in self._agents.values():
+         for i, method in enumerate(self.methods[type(agent)]):
+            if method is not None:
+               plan[i].append(method.__get__(agent))
+      return plan
 
    def step(self) -> None:
-      agent_keys = list(self._agents.keys())
+      if self.plan is None:
+         self.plan = self.make_plan()
+      if self.profiler is not None:
+         self.profiled_step()
+         return
+      plan = self.plan
+
+      i = 0
+      for _ in self.stage_list:
+         for _ in range(2):
+            for method in plan[i]:
+               method()
+            i += 1
+         self.time += self.stage_time
+
+      self.steps += 1
+
+   def profiled_step(self) -> None:
+      '''Same as `step()`, recording each stage and substep.
+      '''
+      plan = self.plan
+      profiler = self.profiler
+      clock = profiler.clock
 
+      i = 0
       for stage in self.stage_list:
-         for substep in ['_step', '_advance']:
-            for ak in agent_keys:
-               getattr(self._agents[ak], stage + substep)()
+         stage_start = clock()
+         calls = 0
+         for _ in range(2):
+            start = clock()
+            for method in plan[i]:
+               method()
+            profiler.record(self.method_names[i], start, clock(), len(plan[i]))
+            calls += len(plan[i])
+            i += 1
+         profiler.record(stage, stage_start, clock(), calls)
          self.time += self.stage_time
 
       self.steps += 1
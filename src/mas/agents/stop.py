@@ -6,6 +6,7 @@ from mesa import Model
 
 from mas.agents.traffic import Traffic
 from mas.agents.vehicle import Vehicle
+from mas.intersection import Intersection
 
 
 class Status(Enum):
@@ -18,19 +19,41 @@ class Status(Enum):
 
 class Stop(Traffic):
 
+   __slots__ = (
+      'stop_group',
+      'turn',
+      'status',
+      'last_vehicle',
+      'wait_time',
+      'avoid_deadlocks',
+      'intersection',
+      'bit',
+      'blocked_version',
+      'deadlock_blocked_version',
+      'check_empty',
+      'check_not_clearing',
+      'check_empty_mask',
+      'check_not_clearing_mask',
+      'higher_priority_mask',
+      'lower_priority_mask'
+   )
+
    def __init__(
       self,
       unique_id:       int,
       model:           Model,
       stop_group:      int,
       turn:            bool,
-      avoid_deadlocks: bool
+      avoid_deadlocks: bool,
+      intersection:    Intersection
    ) -> None:
       '''
       stop_group:
          One group for each cardinal point.
       turn:
          Whether this stop is on the lane to turn left.
+      intersection:
+         Intersection the stop belongs to.
       '''
       super().__init__(unique_id, model)
       self.stop_group = stop_group
@@ -39,15 +62,25 @@ class Stop(Traffic):
       self.last_vehicle = None
       self.wait_time = 0
       self.avoid_deadlocks = avoid_deadlocks
+      self.intersection = intersection
+      self.bit = intersection.bit(self)
+
+      # Version of the intersection when the stop was last denied right
+      # of way, in each stage
+      self.blocked_version = -1
+      self.deadlock_blocked_version = -1
 
    def compute_stops_to_check(self) -> None:
       '''Each stop has to communicate with other stops in order to check
       if the vehicle has the right of way. Some need to be `EMPTY`, some
       not in the `CLEARING` status.
+      The same stops are also precomputed as bitmasks, as well as the
+      stop groups with higher and lower priority to avoid deadlocks.
       '''
-      sgs = self.model.stop_groups
+      intersection = self.intersection
+      sgs = intersection.stop_groups
       sg  = self.stop_group
-      ns  = 4  # number of stop groups
+      ns  = intersection.n_stop_groups
 
       self.check_empty  = [*sgs[(sg + 3) % ns]]
       self.check_empty += [*sgs[(sg + 2) % ns]] if self.turn else []
@@ -55,62 +88,82 @@ class Stop(Traffic):
       self.check_not_clearing  = [*sgs[(sg + 1) % ns]]
       self.check_not_clearing += [sgs[(sg + 2) % ns][1]] if not self.turn else []
 
+      self.check_empty_mask = intersection.mask(self.check_empty)
+      self.check_not_clearing_mask = intersection.mask(self.check_not_clearing)
+      self.higher_priority_mask = intersection.group_mask(range(sg))
+      self.lower_priority_mask = intersection.group_mask(range(sg + 1, ns))
+
+   def set_status(self, status: Status) -> None:
+      self.status = status
+      self.intersection.update(
+         self,
+         waiting=status == Status.WAITING,
+         clearing=status == Status.CLEARING
+      )
+
    def approaching_intersection(self, vehicle: Vehicle) -> None:
       '''Acknowledge the vehicle that is waiting at the stop.
       '''
       if self.status == Status.EMPTY:
-         self.status = Status.WAITING
+         self.set_status(Status.WAITING)
          self.last_vehicle = vehicle
       elif self.status == Status.WAITING:
          self.wait_time += 1
+         self.model.stats.waited(self)
+
+   def proceed(self) -> None:
+      '''Give right of way to the vehicle waiting at the stop.
+      '''
+      self.last_vehicle.proceed_into_intersection()
+      self.set_status(Status.CLEARING)
+      self.model.stats.proceeded(self)
 
    def right_of_way_step(self) -> None:
       '''Decide whether or not the vehicle waiting at the stop has right
       of way or not.
       '''
       if self.status == Status.WAITING:
+         intersection = self.intersection
 
-         # Check that all stops on the right are empty
-         for other_stop in self.check_empty:
-            if other_stop.status == Status.WAITING or \
-               other_stop.status == Status.CLEARING:
-               return
+         # Nothing changed since the last time the vehicle was denied
+         # right of way
+         if self.blocked_version == intersection.version:
+            return
 
-         # Also check that no vehicle coming from the left is already
-         # in the intersection
-         for other_stop in self.check_not_clearing:
-            if other_stop.status == Status.CLEARING:
-               return
+         # Check that all stops on the right are empty, and that no
+         # vehicle coming from the left is already in the intersection
+         if (intersection.waiting | intersection.clearing) & self.check_empty_mask or \
+            intersection.clearing & self.check_not_clearing_mask:
+            self.blocked_version = intersection.version
+            return
 
          # Vehicle has the right of way
-         self.last_vehicle.proceed_into_intersection()
-         self.status = Status.CLEARING
+         self.proceed()
 
       # Check if the vehicle has cleared the intersection
       elif self.status == Status.CLEARING:
          if self.last_vehicle.has_cleared_intersection():
-            self.status = Status.EMPTY
+            self.model.stats.cleared_intersection(self)
+            self.set_status(Status.EMPTY)
             self.wait_time = 0
 
-   def avoid_deadlocks_step(self) -> None:
+   def resolve_deadlock(self) -> None:
       '''To avoid deadlocks the stop group is used as priority level
       with 0 as the highest priority.
       In case of a deadlock, the stop group for which all stop groups
       with a higher priority are empty, and all stops with lower
       priority are not clearing the intersection, moves.
+      Only called by the model at intersections where
+      `Intersection.deadlocked()`.
       '''
-      if self.avoid_deadlocks:
-
-         if self.status == Status.WAITING:
+      if self.status == Status.WAITING:
+         intersection = self.intersection
+         if self.deadlock_blocked_version == intersection.version:
+            return
 
-            for i in range(4):  # number of stop groups
-               for other_stop in self.model.stop_groups[i]:
-                  if i < self.stop_group and \
-                     other_stop.status != Status.EMPTY:
-                     return
-                  elif i > self.stop_group and \
-                     other_stop.status == Status.CLEARING:
-                     return
+         if (intersection.waiting | intersection.clearing) & self.higher_priority_mask or \
+            intersection.clearing & self.lower_priority_mask:
+            self.deadlock_blocked_version = intersection.version
+            return
 
-            self.last_vehicle.proceed_into_intersection()
-            self.status = Status.CLEARING
+         self.proceed()
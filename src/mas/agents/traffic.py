@@ -1,27 +1,38 @@
 from mesa import Agent, Model
 
+from mas.activation import noop
+
 
 class Traffic(Agent):
-   '''Generic traffic agent. Contains abstract steps for all stages
+   '''Generic traffic agent. Contains abstract steps for all stages,
+   which the scheduler skips unless they are overridden.
    '''
 
+   __slots__ = ('unique_id', 'model', 'pos')
+
    def __init__(self, unique_id: int, model: Model) -> None:
       super().__init__(unique_id, model)
 
+   @noop
    def move_vehicles_step(self) -> None:
       pass
 
+   @noop
    def move_vehicles_advance(self) -> None:
       pass
 
+   @noop
    def right_of_way_step(self) -> None:
       pass
 
+   @noop
    def right_of_way_advance(self) -> None:
       pass
 
+   @noop
    def avoid_deadlocks_step(self) -> None:
       pass
 
+   @noop
    def avoid_deadlocks_advance(self) -> None:
       pass
@@ -1,9 +1,9 @@
-from itertools import product
-from typing import Generator, Tuple
+from typing import Tuple
 
 from mesa import Model
 
 from mas.direction import Direction
+from mas.seeding import counter_uniform
 from mas.agents.traffic import Traffic
 
 
@@ -13,6 +13,16 @@ class Vehicle(Traffic):
    right of way correctly.
    '''
 
+   __slots__ = (
+      'direction',
+      'turn',
+      'velocity',
+      'max_velocity',
+      'intersection_step',
+      'blocks_entered',
+      'new_pos'
+   )
+
    def __init__(
       self,
       unique_id:      int,
@@ -35,70 +45,55 @@ class Vehicle(Traffic):
       self.velocity = 0
       self.max_velocity = max_velocity
       self.intersection_step = -1
+      self.blocks_entered = 0
 
-   def possible_neighbors(
-      self,
-      x:    int,
-      y:    int,
-      xmod: int,
-      ymod: int
-   ) -> Generator[int, None, None]:
-      '''Generates all possible coordinates towards the current
-      direction where another vehicle with distance `velocity` at most
-      can be.
-      '''
-      def range_args(idx):
-         step = 1 if idx >= 0 else -1
-         start = 0 if idx == 0 else step
-         return start, idx + step, step
-      for t_xmod, t_ymod in product(
-         range(*range_args(xmod)),
-         range(*range_args(ymod))
-      ):
-         yield x + t_xmod, y + t_ymod
-
-   def put_in_correct_lane(
-      self,
-      new_pos:       Tuple[int, int],
-      new_pos_torus: Tuple[int, int]
-   ) -> Tuple[int, int]:
+   def put_in_correct_lane(self, new_pos: Tuple[int, int]) -> Tuple[int, int]:
       '''Vehicles that turn left find themselves in the right lane after
-      the intersection. When going off screen and then back, they should
-      be put back in the left lane.
+      the intersection. When entering the next block, they should be put
+      back in the left lane, which is one cell to the left of the
+      current direction.
+      '''
+      xmod, ymod = self.direction.modifiers(1)
+      return new_pos[0] + ymod, new_pos[1] - xmod
+
+   def choose_route(self) -> None:
+      '''Decide whether to turn left at the next intersection. Only done
+      if the model has a turn probability, otherwise vehicles keep
+      doing the same at every intersection.
+
+      The decision only depends on the vehicle and the number of blocks
+      it has entered, so that it does not depend on the order in which
+      vehicles are updated.
       '''
-      new_pos_torus = list(new_pos_torus)
-      if new_pos[0] > new_pos_torus[0]:
-         new_pos_torus[1] -= 1
-      elif new_pos[0] < new_pos_torus[0]:
-         new_pos_torus[1] += 1
-      elif new_pos[1] > new_pos_torus[1]:
-         new_pos_torus[0] += 1
-      else: # if new_pos[1] < new_pos_torus[1]:
-         new_pos_torus[0] -= 1
-      return tuple(new_pos_torus)
+      if self.model.turn_probability is not None:
+         draw = counter_uniform(self.model.route_key, self.unique_id, self.blocks_entered)
+         self.turn = draw < self.model.turn_probability
+         self.blocks_entered += 1
 
    def move_vehicles_step(self) -> None:
-      '''Search neighbors and compute new position accordingly.
+      '''Search neighbors and compute new position accordingly. Vehicles
+      that have left an open grid have no position, and wait in the
+      pool of the model.
       '''
-      if self.intersection_step == -1:
+      if self.intersection_step == -1 and self.pos is not None:
          x, y = self.pos
-         xmod, ymod = self.direction.modifiers(self.velocity + 1)
-
-         # Find closest agent
-         distance_to_next = 1
-         neighbor = None
-         for neighbor_pos in self.possible_neighbors(x, y, xmod, ymod):
-            torus_pos = self.model.grid.torus_adj(neighbor_pos)
-            if not self.model.grid.is_cell_empty(torus_pos):
-               neighbor = self.model.grid[torus_pos][0]
-               break
-            distance_to_next += 1
-         else:
+
+         # Find closest agent, the road past the edge of an open grid
+         # being empty
+         modifiers = self.direction.modifiers(1)
+         max_distance = self.velocity + 1
+         if self.model.arrivals is not None:
+            max_distance = min(max_distance, self.model.cells_to_edge(self.pos, modifiers))
+         distance_to_next, neighbor = self.model.lanes.find_ahead(
+            self.pos,
+            modifiers,
+            max_distance
+         )
+         if neighbor is None:
             # No close agent, accelerate
             self.velocity += 1 if self.velocity != self.max_velocity else 0
-
-         # Slow down due to closeness to other agents
-         if neighbor != None:
+         else:
+            # Slow down due to closeness to other agents
             self.velocity = distance_to_next - 1
 
             # If at the stop sign
@@ -109,17 +104,27 @@ class Vehicle(Traffic):
          # Find new position
          xmod, ymod = self.direction.modifiers(self.velocity)
          new_pos = (x + xmod, y + ymod)
-         new_pos_torus = self.model.grid.torus_adj(new_pos)
-         if new_pos != new_pos_torus and self.turn:
-            new_pos_torus = self.put_in_correct_lane(new_pos, new_pos_torus)
+         new_pos_torus = self.model.lanes.torus_adj(new_pos)
+         if self.model.crosses_block(self.pos, new_pos):
+            self.choose_route()
+            if self.turn:
+               new_pos_torus = self.put_in_correct_lane(new_pos_torus)
+
+         # Leaving an open grid
+         if self.model.arrivals is not None and not self.model.in_grid(new_pos):
+            new_pos_torus = None
 
          self.new_pos = new_pos_torus
 
    def move_vehicles_advance(self) -> None:
       '''Move to the new position previously computed in
-      `move_vehicles_step`.
+      `move_vehicles_step`, or leave the grid.
       '''
-      self.model.grid.move_agent(self, self.new_pos)
+      if self.new_pos != self.pos:
+         if self.new_pos is None:
+            self.model.remove_vehicle(self)
+         else:
+            self.model.move_agent(self, self.new_pos)
 
    def proceed_into_intersection(self) -> None:
       '''The vehicle has right of way, so it now prepares itself to
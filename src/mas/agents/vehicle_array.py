@@ -0,0 +1,319 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+from mesa import Model
+
+from mas.direction import Direction
+from mas.seeding import counter_uniforms
+from mas.agents.traffic import Traffic
+
+
+# Lookup tables of `Direction`, indexed by its integer direction
+_modifiers = np.array(Direction.unit_modifiers)
+_angles = np.array(Direction.angles)
+
+
+class VehicleHandle:
+   '''Stand-in for a `Vehicle` agent stored in a `VehicleArray`. Stops
+   use it exactly as they would use the agent.
+   '''
+
+   def __init__(self, vehicles: 'VehicleArray', index: int) -> None:
+      self.vehicles = vehicles
+      self.index = index
+
+   def proceed_into_intersection(self) -> None:
+      self.vehicles.intersection_step[self.index] = 0
+
+   def has_cleared_intersection(self) -> bool:
+      return self.vehicles.intersection_step[self.index] == -1
+
+
+class VehicleArray(Traffic):
+   '''All the vehicles of the model, kept in NumPy arrays and updated at
+   once. It is scheduled as a single agent in place of the `Vehicle`
+   agents, and follows the very same rules, so that trajectories do not
+   change.
+
+   Vehicles are not placed on the grid: an occupancy array, counting the
+   vehicles in each cell, is used instead.
+
+   On an open grid, the slots of the vehicles that have left are kept in
+   a free list and reused for the next arrivals. The arrays only grow
+   when all slots are taken.
+   '''
+
+   def __init__(
+      self,
+      unique_id:    int,
+      model:        Model,
+      n_vehicles:   int,
+      max_velocity: int
+   ) -> None:
+      '''
+      n_vehicles:
+         Number of vehicles the arrays have room for at first.
+      max_velocity:
+         Maximum velocity of the vehicles.
+      '''
+      super().__init__(unique_id, model)
+      self.n = 0
+      self.x = np.zeros(n_vehicles, dtype=np.intp)
+      self.y = np.zeros(n_vehicles, dtype=np.intp)
+      self.new_x = np.zeros(n_vehicles, dtype=np.intp)
+      self.new_y = np.zeros(n_vehicles, dtype=np.intp)
+      self.direction = np.zeros(n_vehicles, dtype=np.intp)
+      self.turn = np.zeros(n_vehicles, dtype=bool)
+      self.velocity = np.zeros(n_vehicles, dtype=np.intp)
+      self.max_velocity = max_velocity
+      self.intersection_step = np.full(n_vehicles, -1, dtype=np.intp)
+      self.blocks_entered = np.zeros(n_vehicles, dtype=np.intp)
+      self.handles = []
+
+      # Slots of the vehicles that have left an open grid, and of those
+      # leaving in the current step
+      self.parked = np.zeros(n_vehicles, dtype=bool)
+      self.free: List[int] = []
+      self.exiting = np.empty(0, dtype=np.intp)
+      self.live_indices: Optional[np.ndarray] = None
+
+      # Indices of the vehicles to update, all of them if `None`. Set
+      # when the vehicles are split among parallel workers
+      self.owned: Optional[np.ndarray] = None
+
+      # Number of vehicles in each cell, and index of the stop in each
+      # cell, `-1` if there is none
+      shape = (model.width, model.height)
+      self.occupancy = np.zeros(shape, dtype=np.intp)
+      self.stop_index = np.full(shape, -1, dtype=np.intp)
+      self.stops = model.stops()
+      for i, stop in enumerate(self.stops):
+         self.stop_index[stop.pos] = i
+
+   def place(
+      self,
+      pos:       Tuple[int, int],
+      direction: Direction,
+      turn:      bool
+   ) -> None:
+      '''Adds a vehicle, with zero velocity, in the given position.
+      '''
+      if self.n == len(self.x):
+         self.grow()
+      i = self.n
+      self.x[i], self.y[i] = pos
+      self.new_x[i], self.new_y[i] = pos
+      self.direction[i] = direction.direction
+      self.turn[i] = turn
+      self.occupancy[pos] += 1
+      self.handles.append(VehicleHandle(self, i))
+      self.n += 1
+      self.live_indices = None
+
+   def grow(self) -> None:
+      '''Doubles the room for vehicles.
+      '''
+      size = max(2 * len(self.x), 1)
+      for name, fill in [
+         ('x', 0),
+         ('y', 0),
+         ('new_x', 0),
+         ('new_y', 0),
+         ('direction', 0),
+         ('turn', False),
+         ('velocity', 0),
+         ('intersection_step', -1),
+         ('blocks_entered', 0),
+         ('parked', False)
+      ]:
+         array = getattr(self, name)
+         grown = np.full(size, fill, dtype=array.dtype)
+         grown[:len(array)] = array
+         setattr(self, name, grown)
+
+   def spawn(
+      self,
+      pos:       Tuple[int, int],
+      direction: Direction,
+      turn:      bool
+   ) -> None:
+      '''Same as `place`, in the slot of the vehicle that left last, if
+      any. The number of blocks entered carries on, so that the reused
+      vehicle draws new routes.
+      '''
+      if not self.free:
+         self.place(pos, direction, turn)
+         return
+      i = self.free.pop()
+      self.x[i], self.y[i] = pos
+      self.new_x[i], self.new_y[i] = pos
+      self.direction[i] = direction.direction
+      self.turn[i] = turn
+      self.velocity[i] = 0
+      self.intersection_step[i] = -1
+      self.parked[i] = False
+      self.occupancy[pos] += 1
+      self.live_indices = None
+
+   def remove(self, indices: np.ndarray) -> None:
+      '''Takes the given vehicles off the road, freeing their slots.
+      '''
+      np.subtract.at(self.occupancy, (self.x[indices], self.y[indices]), 1)
+      self.parked[indices] = True
+      self.free.extend(indices.tolist())
+      self.live_indices = None
+      self.model.exited += len(indices)
+
+   def is_cell_empty(self, pos: Tuple[int, int]) -> bool:
+      return self.occupancy[pos] == 0 and self.stop_index[pos] == -1
+
+   def positions(self) -> List[Tuple[int, int]]:
+      live = self.live()
+      return list(zip(self.x[live].tolist(), self.y[live].tolist()))
+
+   def angles(self) -> np.ndarray:
+      '''Angle of each vehicle, as in `Direction.to_angle`.
+      '''
+      return _angles[self.direction[self.live()]]
+
+   def live(self) -> np.ndarray:
+      '''Indices of the vehicles on the road, in increasing order.
+      '''
+      if self.live_indices is None:
+         self.live_indices = np.flatnonzero(~self.parked[:self.n])
+      return self.live_indices
+
+   def indices(self) -> np.ndarray:
+      '''Indices of the vehicles to update, in increasing order.
+      '''
+      return self.live() if self.owned is None else self.owned
+
+   def move_vehicles_step(self) -> None:
+      '''Vectorized `Vehicle.move_vehicles_step`. The cells ahead of each
+      vehicle are probed all at once to find the distance to the closest
+      agent.
+      '''
+      indices = self.indices()
+      free = indices[self.intersection_step[indices] == -1]
+      self.exiting = free[:0]
+      if len(free) == 0:
+         return
+      x, y = self.x[free], self.y[free]
+      dx, dy = _modifiers[self.direction[free]].T
+      velocity = self.velocity[free]
+      width, height = self.occupancy.shape
+
+      # Cells from 1 up to `velocity + 1` ahead
+      ahead = np.arange(1, self.max_velocity + 2)
+      ahead_x = x[:, None] + dx[:, None] * ahead
+      ahead_y = y[:, None] + dy[:, None] * ahead
+      model = self.model
+      if model.arrivals is not None:
+         # The road past the edge of an open grid is empty
+         inside = (ahead_x >= 0) & (ahead_x < width) & (ahead_y >= 0) & (ahead_y < height)
+      ahead_x %= width
+      ahead_y %= height
+      blocked = (self.occupancy[ahead_x, ahead_y] > 0) | \
+                (self.stop_index[ahead_x, ahead_y] != -1)
+      blocked &= ahead <= velocity[:, None] + 1
+      if model.arrivals is not None:
+         blocked &= inside
+
+      # Accelerate if no agent is close, otherwise slow down
+      found = blocked.any(axis=1)
+      distance_to_next = blocked.argmax(axis=1) + 1
+      velocity = np.where(
+         found,
+         distance_to_next - 1,
+         np.minimum(velocity + 1, self.max_velocity)
+      )
+      self.velocity[free] = velocity
+
+      # Vehicles at the stop sign only notify the stop
+      rows = np.arange(len(free))
+      stop = self.stop_index[ahead_x[rows, 0], ahead_y[rows, 0]]
+      at_stop = found & (distance_to_next == 1) & (stop != -1)
+      for i, s in zip(free[at_stop].tolist(), stop[at_stop].tolist()):
+         self.stops[s].approaching_intersection(self.handles[i])
+
+      # Find new positions
+      moving = ~at_stop
+      free, x, y = free[moving], x[moving], y[moving]
+      velocity, dx, dy = velocity[moving], dx[moving], dy[moving]
+      new_x = x + dx * velocity
+      new_y = y + dy * velocity
+      self.new_x[free] = new_x % width
+      self.new_y[free] = new_y % height
+
+      # Same as `Vehicle.choose_route` and `Vehicle.put_in_correct_lane`
+      # for the vehicles entering another block
+      crossing = (x // model.block_width != new_x // model.block_width) | \
+                 (y // model.block_height != new_y // model.block_height)
+      if model.turn_probability is not None:
+         entering = free[crossing]
+         draws = counter_uniforms(
+            model.route_key,
+            entering + self.unique_id,
+            self.blocks_entered[entering]
+         )
+         self.turn[entering] = draws < model.turn_probability
+         self.blocks_entered[entering] += 1
+      shift = crossing & self.turn[free]
+      self.new_x[free[shift]] += dy[shift]
+      self.new_y[free[shift]] -= dx[shift]
+
+      # Vehicles leaving an open grid stay in place until they are
+      # removed
+      if model.arrivals is not None:
+         leaving = (new_x < 0) | (new_x >= width) | (new_y < 0) | (new_y >= height)
+         self.exiting = free[leaving]
+         self.new_x[self.exiting] = x[leaving]
+         self.new_y[self.exiting] = y[leaving]
+
+   def move(self, indices: np.ndarray) -> None:
+      '''Move the given vehicles to the new positions previously
+      computed.
+      '''
+      np.subtract.at(self.occupancy, (self.x[indices], self.y[indices]), 1)
+      np.add.at(self.occupancy, (self.new_x[indices], self.new_y[indices]), 1)
+      self.x[indices] = self.new_x[indices]
+      self.y[indices] = self.new_y[indices]
+
+   def move_vehicles_advance(self) -> None:
+      '''Move all vehicles to the new positions previously computed,
+      and remove those leaving the grid.
+      '''
+      self.move(self.indices())
+      if len(self.exiting):
+         self.remove(self.exiting)
+
+   def right_of_way_advance(self) -> None:
+      '''Vectorized `Vehicle.right_of_way_advance`: vehicles with right of
+      way move one cell into the intersection.
+      '''
+      indices = self.indices()
+      crossing = indices[self.intersection_step[indices] != -1]
+      if len(crossing) == 0:
+         return
+      step = self.intersection_step[crossing]
+
+      # Vehicles that have to turn
+      turning = crossing[self.turn[crossing] & (2 < step) & (step < 5)]
+      self.direction[turning] = (self.direction[turning] - 1) % len(Direction.all)
+
+      # Move vehicles
+      width, height = self.occupancy.shape
+      dx, dy = _modifiers[self.direction[crossing]].T
+      self.new_x[crossing] = (self.x[crossing] + dx) % width
+      self.new_y[crossing] = (self.y[crossing] + dy) % height
+      self.move(crossing)
+
+      step += 1
+      step[step == 6] = -1
+      self.intersection_step[crossing] = step
+
+   def avoid_deadlocks_advance(self) -> None:
+      '''The vehicles with priority in a deadlock advance as if they had
+      right of way.
+      '''
+      self.right_of_way_advance()
@@ -0,0 +1,140 @@
+'''Demand of an open road network: how many vehicles arrive at each entry
+at each step.
+
+Entries are the lanes starting on the boundary of the grid, see
+`FourWayStop.entries`. Arrivals are drawn from the random number
+generator of the model, so runs stay reproducible.
+'''
+import csv
+import math
+import random
+from abc import ABC, abstractmethod
+from collections import defaultdict
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+
+class Arrivals(ABC):
+   '''Base class of the arrival processes.
+   '''
+
+   @abstractmethod
+   def counts(
+      self,
+      step:      int,
+      n_entries: int,
+      rng:       random.Random
+   ) -> List[int]:
+      '''Returns the number of vehicles arriving at each entry during
+      the given step.
+      '''
+
+
+def poisson(rate: float, rng: random.Random) -> int:
+   '''Draws from a Poisson distribution. Small rates, as for a single
+   lane, are drawn by inversion, which is exact and fast, and large ones
+   with `poisson_ptrs`, as the time of inversion grows with the rate and
+   `exp(-rate)` underflows.
+   '''
+   if rate <= 0:
+      return 0
+   if rate >= 10:
+      return poisson_ptrs(rate, rng)
+   k = 0
+   p = math.exp(-rate)
+   cumulative = p
+   u = rng.random()
+   while u > cumulative:
+      k += 1
+      p *= rate / k
+      cumulative += p
+      # Guard against rounding when `u` is very close to 1
+      if p == 0:
+         break
+   return k
+
+
+def poisson_ptrs(rate: float, rng: random.Random) -> int:
+   '''Draws from a Poisson distribution of rate 10 or more, by
+   transformed rejection with squeeze, PTRS (Hörmann, 1993), in constant
+   expected time. Same constants as NumPy.
+   '''
+   sqrt_rate = math.sqrt(rate)
+   log_rate = math.log(rate)
+   b = 0.931 + 2.53 * sqrt_rate
+   a = -0.059 + 0.02483 * b
+   inv_alpha = 1.1239 + 1.1328 / (b - 3.4)
+   v_r = 0.9277 - 3.6224 / (b - 2)
+   while True:
+      u = rng.random() - 0.5
+      v = rng.random()
+      us = 0.5 - abs(u)
+      k = math.floor((2 * a / us + b) * u + rate + 0.43)
+      if us >= 0.07 and v <= v_r:
+         return k
+      if k < 0 or (us < 0.013 and v > us):
+         continue
+      if math.log(v) + math.log(inv_alpha) - math.log(a / (us * us) + b) <= \
+         -rate + k * log_rate - math.lgamma(k + 1):
+         return k
+
+
+class PoissonArrivals(Arrivals):
+   '''Vehicles arrive independently at each entry, at a constant rate.
+   '''
+
+   def __init__(self, rates: Union[float, Sequence[float]]) -> None:
+      '''
+      rates:
+         Mean number of vehicles arriving at each entry per step, either
+         the same for all entries or one for each.
+      '''
+      self.rates = rates
+
+   def counts(
+      self,
+      step:      int,
+      n_entries: int,
+      rng:       random.Random
+   ) -> List[int]:
+      if isinstance(self.rates, (int, float)):
+         rates = [self.rates] * n_entries
+      else:
+         rates = list(self.rates)
+         if len(rates) != n_entries:
+            raise ValueError(f'Expected {n_entries} arrival rates, got {len(rates)}')
+      return [poisson(rate, rng) for rate in rates]
+
+
+class TraceArrivals(Arrivals):
+   '''Vehicles arrive at the steps and entries listed in a trace, for
+   instance recorded from counts on a real road.
+   '''
+
+   def __init__(self, events: Iterable[Tuple[int, int]]) -> None:
+      '''
+      events:
+         Pairs of step and entry, one for each vehicle.
+      '''
+      self.by_step: Dict[int, List[int]] = defaultdict(list)
+      for step, entry in events:
+         self.by_step[step].append(entry)
+
+   @classmethod
+   def from_csv(cls, path: str) -> 'TraceArrivals':
+      '''Reads a trace from a CSV file with `step` and `entry` columns.
+      '''
+      with open(path, newline='') as f:
+         return cls((int(row['step']), int(row['entry'])) for row in csv.DictReader(f))
+
+   def counts(
+      self,
+      step:      int,
+      n_entries: int,
+      rng:       random.Random
+   ) -> List[int]:
+      counts = [0] * n_entries
+      for entry in self.by_step.get(step, ()):
+         if not 0 <= entry < n_entries:
+            raise ValueError(f'No entry {entry}, there are {n_entries}')
+         counts[entry] += 1
+      return counts
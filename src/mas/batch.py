@@ -0,0 +1,366 @@
+'''Headless batch runs of the four-way stop model. Every combination of
+the given parameters is run for a fixed number of steps on a pool of
+worker processes, and the results are gathered in a single table.
+
+With `--ensemble`, the seeds of each scenario are run together as one
+`Ensemble` instead, which is much faster for many replicates of small
+scenarios, and gives the same results as the `numpy` backend.
+
+Usage:
+   python -m mas.batch --n-vehicles 10 20 --max-velocity 3 5 \
+      --seeds 0 --replicates 10 --steps 1000 --output results.csv
+'''
+import argparse
+import csv
+import os
+import sys
+import time
+from functools import partial
+from itertools import product
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Sequence
+
+from mas.metrics import CSVSink, MetricsSink
+from mas.model import FourWayStop, model_reporters
+from mas.seeding import spawn_seeds
+
+if TYPE_CHECKING:
+   from mas.cache import ResultCache
+
+
+# Parameters that define a scenario, in table order
+config_keys = [
+   'n_vehicles',
+   'width',
+   'height',
+   'max_velocity',
+   'avoid_deadlocks',
+   'seed'
+]
+
+
+def make_configs(
+   n_vehicles:      Sequence[int],
+   width:           Sequence[int],
+   height:          Optional[Sequence[int]],
+   max_velocity:    Sequence[int],
+   avoid_deadlocks: Sequence[bool],
+   seeds:           Sequence[int]
+) -> List[dict]:
+   '''Returns all combinations of the given parameter values.
+
+   height:
+      If `None`, only square grids with the given widths are used.
+   '''
+   sizes = product(width, height) if height is not None else \
+           [(w, w) for w in width]
+   return [
+      dict(zip(config_keys, (n, w, h, v, ad, seed)))
+      for n, (w, h), v, ad, seed in product(
+         n_vehicles,
+         sizes,
+         max_velocity,
+         avoid_deadlocks,
+         seeds
+      )
+   ]
+
+
+def scenario_name(config: dict) -> str:
+   return '{n_vehicles}_{width}x{height}_v{max_velocity}_{avoid_deadlocks}_{seed}'.format(**config)
+
+
+def run_scenario(
+   config:      dict,
+   n_steps:     int,
+   backend:     str                     = 'agents',
+   metrics_dir: Optional[str]           = None,
+   stride:      int                     = 1,
+   window:      Optional[int]           = None,
+   precision:   Optional[float]         = None,
+   cache:       Optional['ResultCache'] = None
+) -> dict:
+   '''Runs a single scenario for `n_steps` steps and returns a row of
+   the results table.
+
+   metrics_dir:
+      If set, the metrics of each step are streamed to a CSV file in
+      this directory, named after the scenario.
+   stride, window:
+      See `MetricsSink`.
+   precision:
+      If set, the run stops as soon as it reaches a steady state where
+      the confidence intervals of the wait time and the vehicles cleared
+      per step are within this fraction of the estimates, with
+      `n_steps` as the limit. See `ConvergenceMonitor`.
+   cache:
+      If set, the results of a scenario already run with the same
+      parameters and code are read from the cache instead of simulating
+      it again, and new ones are stored there. The metrics file is
+      cached along with them.
+   '''
+   path = None
+   if metrics_dir is not None:
+      path = os.path.join(metrics_dir, scenario_name(config) + '.csv')
+
+   if cache is not None:
+      key = cache.key(
+         {k: config[k] for k in config_keys},
+         n_steps=n_steps,
+         backend=backend,
+         stride=stride,
+         window=window,
+         precision=precision
+      )
+      entry = cache.get(key)
+
+      # Entries of runs without `metrics_dir` only hold the row
+      if entry is not None and (path is None or cache.get_series(key, path)):
+         return entry['row']
+   if path is not None:
+      sink = CSVSink(path, model_reporters, stride, window)
+   else:
+      sink = MetricsSink(model_reporters, stride, window)
+   monitor = None
+   if precision is not None:
+      from mas.convergence import ConvergenceMonitor
+      monitor = ConvergenceMonitor(precision=precision)
+
+   model = FourWayStop(
+      n_vehicles=config['n_vehicles'],
+      width=config['width'],
+      height=config['height'],
+      max_velocity=config['max_velocity'],
+      avoid_deadlocks=config['avoid_deadlocks'],
+      backend=backend,
+      seed=config['seed'],
+      mirror_grid=False,
+      metrics=sink,
+      convergence=monitor
+   )
+
+   with sink:
+      start = time.perf_counter()
+      steps = 0
+      while steps < n_steps and model.running:
+         model.step()
+         steps += 1
+      elapsed = time.perf_counter() - start
+
+   summary = sink.summary()
+   row = {k: config[k] for k in config_keys}
+   row['steps'] = steps
+   row['mean_wait_time'] = summary['Average wait time mean']
+   row['max_wait_time'] = summary['Average wait time max']
+   row['final_wait_time'] = summary['Average wait time last']
+   row.update(model.stats.summary())
+   if monitor is not None:
+      row.update(monitor.summary())
+   row['elapsed'] = elapsed
+
+   if cache is not None:
+      cache.put(key, {'row': row}, series=path)
+   return row
+
+
+def run_ensemble(
+   configs: List[dict],
+   n_steps: int,
+   stride:  int = 1
+) -> List[dict]:
+   '''Runs scenarios that only differ by their seed as a single
+   `Ensemble`, and returns their rows in order, the same as those of
+   `run_scenario` with the `numpy` backend. The elapsed time is shared
+   evenly between them.
+   '''
+   from mas.ensemble import Ensemble
+
+   config = configs[0]
+   ensemble = Ensemble(
+      [c['seed'] for c in configs],
+      n_vehicles=config['n_vehicles'],
+      width=config['width'],
+      height=config['height'],
+      max_velocity=config['max_velocity'],
+      avoid_deadlocks=config['avoid_deadlocks'],
+      stride=stride
+   )
+   start = time.perf_counter()
+   ensemble.run(n_steps)
+   elapsed = time.perf_counter() - start
+
+   rows = []
+   for r, config in enumerate(configs):
+      summary = ensemble.wait_time_summary(r)
+      row = {k: config[k] for k in config_keys}
+      row['steps'] = n_steps
+      row['mean_wait_time'] = summary['Average wait time mean']
+      row['max_wait_time'] = summary['Average wait time max']
+      row['final_wait_time'] = summary['Average wait time last']
+      row.update(ensemble.summary(r))
+      row['elapsed'] = elapsed / len(configs)
+      rows.append(row)
+   return rows
+
+
+def sweep_ensembles(
+   configs:     Iterable[dict],
+   n_steps:     int,
+   max_workers: Optional[int] = None,
+   stride:      int           = 1
+) -> List[dict]:
+   '''Same as `sweep`, running the seeds of each scenario together with
+   `run_ensemble`, one scenario per task.
+   '''
+   # Only the parent needs multiprocessing, which is slow to import
+   from concurrent.futures import ProcessPoolExecutor
+
+   configs = list(configs)
+   groups: Dict[tuple, List[int]] = {}
+   for i, config in enumerate(configs):
+      scenario = tuple(config[k] for k in config_keys if k != 'seed')
+      groups.setdefault(scenario, []).append(i)
+   run = partial(run_ensemble, n_steps=n_steps, stride=stride)
+   rows: List[Optional[dict]] = [None] * len(configs)
+   with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      group_configs = [[configs[i] for i in indices] for indices in groups.values()]
+      for indices, group_rows in zip(groups.values(), executor.map(run, group_configs)):
+         for i, row in zip(indices, group_rows):
+            rows[i] = row
+   return rows
+
+
+def sweep(
+   configs:     Iterable[dict],
+   n_steps:     int,
+   backend:     str           = 'agents',
+   max_workers: Optional[int] = None,
+   **kwargs
+) -> List[dict]:
+   '''Runs all scenarios on a process pool. Rows are returned in the
+   same order as `configs`.
+
+   max_workers:
+      Number of worker processes, all available cores by default.
+   kwargs:
+      Passed to `run_scenario`.
+   '''
+   # Only the parent needs multiprocessing, which is slow to import
+   from concurrent.futures import ProcessPoolExecutor
+
+   configs = list(configs)
+   run = partial(run_scenario, n_steps=n_steps, backend=backend, **kwargs)
+   with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      # Large chunks keep the workers busy when scenarios are short
+      n_workers = max_workers or os.cpu_count() or 1
+      chunksize = max(1, len(configs) // (4 * n_workers))
+      return list(executor.map(run, configs, chunksize=chunksize))
+
+
+def write_table(rows: List[dict], file) -> None:
+   '''Writes the results as CSV.
+   '''
+   if not rows:
+      return
+   writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+   writer.writeheader()
+   writer.writerows(rows)
+
+
+def parse_bool(value: str) -> bool:
+   if value.lower() in ('1', 'true', 'yes', 'on'):
+      return True
+   if value.lower() in ('0', 'false', 'no', 'off'):
+      return False
+   raise argparse.ArgumentTypeError(f'Not a boolean: {value}')
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+   parser = argparse.ArgumentParser(
+      prog='python -m mas.batch',
+      description='Run a grid of four-way stop scenarios without the web server.'
+   )
+   parser.add_argument('--n-vehicles', type=int, nargs='+', default=[10])
+   parser.add_argument('--width', type=int, nargs='+', default=[40])
+   parser.add_argument('--height', type=int, nargs='+', default=None,
+                       help='Defaults to the same values as --width')
+   parser.add_argument('--max-velocity', type=int, nargs='+', default=[5])
+   parser.add_argument('--avoid-deadlocks', type=parse_bool, nargs='+', default=[True])
+   parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+   parser.add_argument('--replicates', type=int, default=None,
+                       help='Run this many replicates for each of --seeds, '
+                            'with independent child seeds')
+   parser.add_argument('--steps', type=int, default=1000,
+                       help='Number of steps, or the limit with --precision')
+   parser.add_argument('--precision', type=float, default=None,
+                       help='Stop each run at steady state, once the confidence intervals '
+                            'are within this fraction of the estimates')
+   parser.add_argument('--backend', choices=['agents', 'numpy'], default=None,
+                       help='agents by default, always numpy with --ensemble')
+   parser.add_argument('--ensemble', action='store_true',
+                       help='Run the seeds of each scenario together in one vectorized ensemble, '
+                            'without --precision, --metrics-dir, --window nor --cache-dir')
+   parser.add_argument('--metrics-dir', default=None,
+                       help='Stream the metrics of each scenario to a CSV file in this directory')
+   parser.add_argument('--stride', type=int, default=1,
+                       help='Collect metrics every this many steps')
+   parser.add_argument('--window', type=int, default=None,
+                       help='Write mean, minimum and maximum over windows of this many steps')
+   parser.add_argument('--cache-dir', default=None,
+                       help='Reuse the results of scenarios already run, cached in this directory')
+   parser.add_argument('--cache-size', type=float, default=1024,
+                       help='Size of the cache in MB, over which the least recently used '
+                            'results are evicted')
+   parser.add_argument('--workers', type=int, default=None,
+                       help='Number of worker processes, all cores by default')
+   parser.add_argument('--output', default=None,
+                       help='CSV file to write, standard output by default')
+   return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+   args = parse_args(argv)
+   if args.ensemble and (args.precision is not None or args.metrics_dir is not None or
+                         args.window is not None or args.cache_dir is not None):
+      sys.exit('--ensemble cannot be used with --precision, --metrics-dir, --window nor --cache-dir')
+   if args.ensemble and args.backend == 'agents':
+      sys.exit('--ensemble always runs the numpy backend')
+   seeds = args.seeds
+   if args.replicates is not None:
+      seeds = [c for seed in seeds for c in spawn_seeds(seed, args.replicates)]
+   configs = make_configs(
+      n_vehicles=args.n_vehicles,
+      width=args.width,
+      height=args.height,
+      max_velocity=args.max_velocity,
+      avoid_deadlocks=args.avoid_deadlocks,
+      seeds=seeds
+   )
+   if args.metrics_dir is not None:
+      os.makedirs(args.metrics_dir, exist_ok=True)
+   cache = None
+   if args.cache_dir is not None:
+      from mas.cache import ResultCache
+      cache = ResultCache(args.cache_dir, int(args.cache_size * 1e6))
+   if args.ensemble:
+      rows = sweep_ensembles(configs, args.steps, args.workers, args.stride)
+   else:
+      rows = sweep(
+         configs,
+         args.steps,
+         args.backend or 'agents',
+         args.workers,
+         metrics_dir=args.metrics_dir,
+         stride=args.stride,
+         window=args.window,
+         precision=args.precision,
+         cache=cache
+      )
+   if args.output is None:
+      write_table(rows, sys.stdout)
+   else:
+      with open(args.output, 'w', newline='') as f:
+         write_table(rows, f)
+
+
+if __name__ == '__main__':
+   main()
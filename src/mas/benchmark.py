@@ -0,0 +1,426 @@
+'''Benchmarks of the simulation core, to tell whether a change or a Mesa
+upgrade made it faster or slower.
+
+The suite measures the steps and vehicle updates per second of
+`FourWayStop` for several grid sizes and densities, the time spent in
+each stage of the scheduler, the cost of rendering a canvas frame, and
+the peak memory of a run, and the time to import the headless modules
+in a fresh interpreter. Each timing is the best of a few repeats on a
+fresh model, which is the least noisy estimate.
+
+Results are written as JSON, and can be compared with a saved baseline:
+the comparison lists every metric that got worse by more than a given
+fraction, and exits with a non-zero status if there is any. The import
+check does the same when a headless module takes longer than its budget
+to import, or loads NumPy, pandas or the web server stack. The tests run
+it too.
+
+Usage:
+   python -m mas.benchmark run --output baseline.json
+   python -m mas.benchmark run --output current.json
+   python -m mas.benchmark compare baseline.json current.json --threshold 0.1
+   python -m mas.benchmark imports --budget 0.1
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import mesa
+import numpy as np
+
+from mas.model import FourWayStop
+from mas.profiling import Profiler
+
+
+# Version of the results format
+results_version = 1
+
+# Grid sizes and numbers of vehicles of the stepping benchmarks
+step_cases = [
+   (40, 10),
+   (40, 40),
+   (80, 20),
+   (80, 80)
+]
+
+# Modules that short-lived workers import, the seconds an import of
+# each may take at most, and the modules they must not load
+headless_modules = ['mas', 'mas.model', 'mas.batch']
+import_budget = 0.1
+heavy_modules = [
+   'numpy',
+   'pandas',
+   'tornado',
+   'mesa.space',
+   'mesa.datacollection',
+   'mesa.visualization',
+   'mas.server',
+   'vis'
+]
+
+# Metrics where a larger value is better, all others are costs
+higher_is_better = {'steps_per_sec', 'vehicle_updates_per_sec'}
+
+# Benchmark, metric, baseline value, current value, relative change
+Row = Tuple[str, str, float, float, float]
+
+
+def make_model(
+   n_vehicles: int,
+   size:       int,
+   backend:    str,
+   seed:       int = 0
+) -> FourWayStop:
+   return FourWayStop(
+      n_vehicles=n_vehicles,
+      width=size,
+      height=size,
+      max_velocity=5,
+      avoid_deadlocks=True,
+      backend=backend,
+      seed=seed,
+      mirror_grid=False
+   )
+
+
+def best_of(
+   setup:  Callable[[], FourWayStop],
+   run:    Callable[[FourWayStop], None],
+   repeat: int
+) -> float:
+   '''Returns the shortest time of `run` over `repeat` fresh models.
+   '''
+   best = float('inf')
+   for _ in range(repeat):
+      model = setup()
+      start = time.perf_counter()
+      run(model)
+      best = min(best, time.perf_counter() - start)
+   return best
+
+
+def run_steps(model: FourWayStop, n_steps: int) -> None:
+   for _ in range(n_steps):
+      model.step()
+
+
+def bench_steps(
+   n_vehicles: int,
+   size:       int,
+   backend:    str,
+   n_steps:    int,
+   repeat:     int
+) -> Dict[str, float]:
+   '''Steps and vehicle updates per second, data collection included.
+   '''
+   elapsed = best_of(
+      lambda: make_model(n_vehicles, size, backend),
+      lambda model: run_steps(model, n_steps),
+      repeat
+   )
+   return {
+      'steps_per_sec': n_steps / elapsed,
+      'vehicle_updates_per_sec': n_steps * n_vehicles / elapsed
+   }
+
+
+def bench_stages(
+   n_vehicles: int,
+   size:       int,
+   backend:    str,
+   n_steps:    int,
+   repeat:     int
+) -> Dict[str, float]:
+   '''Seconds per step spent in data collection and in each stage
+   method, the best of `repeat` runs for each.
+   '''
+   best: Dict[str, float] = {}
+   for _ in range(repeat):
+      model = make_model(n_vehicles, size, backend)
+      model.set_profiler(Profiler(max_spans=0))
+      run_steps(model, n_steps)
+      for name in ['collect', *model.schedule.method_names]:
+         t = model.profiler.totals[name] / n_steps
+         best[name] = min(best.get(name, float('inf')), t)
+   return best
+
+
+def bench_render(
+   n_vehicles: int,
+   size:       int,
+   backend:    str,
+   n_steps:    int,
+   repeat:     int
+) -> Dict[str, float]:
+   '''Cost of rendering the canvas for a single connection, a keyframe
+   followed by one delta each step, and the average size of the frames.
+   '''
+   from vis.canvas.grid_visualization import CanvasGridVisualization
+
+   best = float('inf')
+   n_bytes = 0
+   for _ in range(repeat):
+      model = make_model(n_vehicles, size, backend)
+      canvas = CanvasGridVisualization(500, 500, size, size)
+      elapsed = 0.0
+      n_bytes = 0
+      sent = None
+      for _ in range(n_steps):
+         start = time.perf_counter()
+         frame, sent = canvas.render_for(model, sent)
+         elapsed += time.perf_counter() - start
+         n_bytes += len(frame)
+         model.step()
+      best = min(best, elapsed)
+   return {
+      'seconds_per_frame': best / n_steps,
+      'bytes_per_frame': n_bytes / n_steps
+   }
+
+
+def bench_memory(
+   n_vehicles: int,
+   size:       int,
+   backend:    str,
+   n_steps:    int
+) -> Dict[str, float]:
+   '''Peak memory allocated by Python while building and running a
+   model. Traced separately, as tracing slows everything down.
+   '''
+   tracemalloc.start()
+   try:
+      run_steps(make_model(n_vehicles, size, backend), n_steps)
+      _, peak = tracemalloc.get_traced_memory()
+   finally:
+      tracemalloc.stop()
+   return {'peak_bytes': peak}
+
+
+def time_import(module: str) -> Tuple[float, List[str]]:
+   '''Returns the time to import `module` in a fresh interpreter, and
+   the names of the modules it loaded.
+   '''
+   code = '\n'.join([
+      'import sys, time',
+      'loaded = set(sys.modules)',
+      'start = time.perf_counter()',
+      f'import {module}',
+      'print(time.perf_counter() - start)',
+      'print(*sorted(set(sys.modules) - loaded))'
+   ])
+   root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+   result = subprocess.run(
+      [sys.executable, '-c', code],
+      cwd=root,
+      capture_output=True,
+      text=True,
+      check=True
+   )
+   seconds, modules = result.stdout.split('\n')[:2]
+   return float(seconds), modules.split()
+
+
+def bench_import(module: str, repeat: int) -> Dict[str, float]:
+   '''Best time to import `module` in a fresh interpreter.
+   '''
+   return {'import_seconds': min(time_import(module)[0] for _ in range(repeat))}
+
+
+def check_imports(
+   modules: Sequence[str] = headless_modules,
+   budget:  float         = import_budget,
+   repeat:  int           = 5
+) -> List[str]:
+   '''Returns a description of each module that takes longer than
+   `budget` seconds to import, at best, or loads a heavy module.
+   '''
+   problems = []
+   for module in modules:
+      seconds, loaded = min(time_import(module) for _ in range(repeat))
+      if seconds > budget:
+         problems.append(f'{module} takes {seconds:.3f} s to import, over {budget:.3f} s')
+      heavy = [
+         m for m in loaded
+         if m != module and any(m == h or m.startswith(h + '.') for h in heavy_modules)
+      ]
+      if heavy:
+         top = sorted({m for m in heavy if m in heavy_modules} or heavy)
+         problems.append(f'{module} loads {", ".join(top)}')
+   return problems
+
+
+def environment() -> Dict[str, str]:
+   return {
+      'python': platform.python_version(),
+      'mesa': mesa.__version__,
+      'numpy': np.__version__,
+      'platform': platform.platform(),
+      'processor': platform.processor() or platform.machine()
+   }
+
+
+def run_suite(
+   backends: Sequence[str]                   = ('agents', 'numpy'),
+   n_steps:  int                             = 200,
+   repeat:   int                             = 3,
+   log:      Optional[Callable[[str], None]] = None
+) -> dict:
+   '''Runs all benchmarks and returns the results, by benchmark name
+   then by metric.
+
+   n_steps:
+      Steps of each timed run.
+   log:
+      Called with the name of each benchmark before it runs.
+   '''
+   benchmarks = {}
+
+   def add(name: str, bench: Callable[[], Dict[str, float]]) -> None:
+      if log is not None:
+         log(name)
+      benchmarks[name] = bench()
+
+   for module in headless_modules:
+      add(f'import/{module}', lambda: bench_import(module, repeat))
+
+   largest = max(step_cases, key=lambda c: c[0] * c[0] * c[1])
+   for backend in backends:
+      for size, n_vehicles in step_cases:
+         add(
+            f'step/{backend}/{size}x{size}/n={n_vehicles}',
+            lambda: bench_steps(n_vehicles, size, backend, n_steps, repeat)
+         )
+      size, n_vehicles = step_cases[1]
+      add(
+         f'stages/{backend}/{size}x{size}/n={n_vehicles}',
+         lambda: bench_stages(n_vehicles, size, backend, n_steps, repeat)
+      )
+      add(
+         f'render/{backend}/{size}x{size}/n={n_vehicles}',
+         lambda: bench_render(n_vehicles, size, backend, n_steps, repeat)
+      )
+      size, n_vehicles = largest
+      add(
+         f'memory/{backend}/{size}x{size}/n={n_vehicles}',
+         lambda: bench_memory(n_vehicles, size, backend, n_steps)
+      )
+
+   return {
+      'version': results_version,
+      'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'environment': environment(),
+      'n_steps': n_steps,
+      'repeat': repeat,
+      'benchmarks': benchmarks
+   }
+
+
+def compare(baseline: dict, current: dict) -> List[Row]:
+   '''Returns the metrics found in both results, as tuples of benchmark
+   name, metric, baseline value, current value and relative change,
+   where a positive change is an improvement.
+   '''
+   rows = []
+   for name, metrics in baseline['benchmarks'].items():
+      for metric, old in metrics.items():
+         new = current['benchmarks'].get(name, {}).get(metric)
+         if new is None or old == 0:
+            continue
+         change = (new - old) / old
+         if metric not in higher_is_better:
+            change = -change
+         rows.append((name, metric, old, new, change))
+   return rows
+
+
+def regressions(rows: List[Row], threshold: float = 0.1) -> List[Row]:
+   '''Rows of the metrics that got worse by more than `threshold`.
+   '''
+   return [row for row in rows if row[4] < -threshold]
+
+
+def format_rows(rows: List[Row], threshold: float) -> str:
+   lines = []
+   for name, metric, old, new, change in rows:
+      flag = 'REGRESSION' if change < -threshold else ''
+      lines.append(f'{name:<32} {metric:<26} {old:>14.6g} {new:>14.6g} {change:>+8.1%} {flag}')
+   return '\n'.join(lines)
+
+
+def load(path: str) -> dict:
+   with open(path) as f:
+      results = json.load(f)
+   if results.get('version') != results_version:
+      raise ValueError(f'Unsupported benchmark results version in {path}')
+   return results
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+   parser = argparse.ArgumentParser(
+      prog='python -m mas.benchmark',
+      description='Benchmark the simulation core, or compare two sets of results.'
+   )
+   commands = parser.add_subparsers(dest='command', required=True)
+
+   run = commands.add_parser('run', help='Run the benchmarks')
+   run.add_argument('--backend', choices=['agents', 'numpy'], nargs='+',
+                    default=['agents', 'numpy'])
+   run.add_argument('--steps', type=int, default=200,
+                    help='Steps of each timed run')
+   run.add_argument('--repeat', type=int, default=3,
+                    help='Keep the best of this many runs')
+   run.add_argument('--output', default=None,
+                    help='JSON file to write, standard output by default')
+
+   cmp = commands.add_parser('compare', help='Flag regressions against a baseline')
+   cmp.add_argument('baseline')
+   cmp.add_argument('current')
+   cmp.add_argument('--threshold', type=float, default=0.1,
+                    help='Fraction by which a metric has to get worse to be flagged')
+
+   imports = commands.add_parser('imports', help='Check the import time of the headless modules')
+   imports.add_argument('--budget', type=float, default=import_budget,
+                        help='Seconds an import may take at most')
+   imports.add_argument('--repeat', type=int, default=5,
+                        help='Keep the best of this many imports')
+   return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+   args = parse_args(argv)
+   if args.command == 'run':
+      results = run_suite(
+         args.backend,
+         args.steps,
+         args.repeat,
+         log=lambda name: print(name, file=sys.stderr)
+      )
+      if args.output is None:
+         json.dump(results, sys.stdout, indent=2)
+         print()
+      else:
+         with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+   elif args.command == 'imports':
+      problems = check_imports(headless_modules, args.budget, args.repeat)
+      for problem in problems:
+         print(problem, file=sys.stderr)
+      if problems:
+         sys.exit(1)
+   else:
+      rows = compare(load(args.baseline), load(args.current))
+      print(format_rows(rows, args.threshold))
+      regressed = regressions(rows, args.threshold)
+      if regressed:
+         print(f'{len(regressed)} regression(s) over {args.threshold:.0%}', file=sys.stderr)
+         sys.exit(1)
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,214 @@
+'''On-disk cache of scenario results, so that sweeps only simulate the
+configurations they have not run before.
+
+Entries are content-addressed: the key is a hash of the configuration,
+the run parameters and the source code of the model, so that a change
+to any of them is a miss. Each entry is a JSON file holding the row of
+the results table, along with a copy of the CSV file the metrics were
+streamed to, if any.
+
+Files are written to a temporary file and renamed into place, which is
+atomic, so that any number of processes can share a cache: readers never
+see a partial entry, and concurrent writers of the same key write the
+same content. The least recently used entries are evicted once the cache
+grows over its size limit.
+'''
+import functools
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+
+# Size of each cache directory as estimated by this process, from a
+# single walk plus what it wrote since, see `ResultCache.put()`
+_sizes: Dict[str, int] = {}
+
+# Age in seconds after which metrics without their entry are taken as
+# left over by an interrupted eviction, rather than being written by a
+# `put()` in progress
+orphan_age = 60.0
+
+
+@functools.lru_cache(maxsize=None)
+def code_version() -> str:
+   '''Hash of the source files of the `mas` package.
+   '''
+   root = os.path.dirname(os.path.abspath(__file__))
+   digest = hashlib.sha256()
+   for directory, subdirectories, files in os.walk(root):
+      subdirectories.sort()
+      for name in sorted(files):
+         if name.endswith('.py'):
+            path = os.path.join(directory, name)
+            digest.update(os.path.relpath(path, root).replace(os.sep, '/').encode())
+            with open(path, 'rb') as f:
+               digest.update(f.read())
+   return digest.hexdigest()
+
+
+class ResultCache:
+   '''Directory of cached results, bounded in size.
+   '''
+
+   def __init__(
+      self,
+      directory: str,
+      max_bytes: Optional[int] = 1 << 30
+   ) -> None:
+      '''
+      directory:
+         Where entries are stored, created if needed.
+      max_bytes:
+         Total size of the entries over which the least recently used
+         ones are evicted. Unbounded if `None`. Processes sharing the
+         cache only see each other's writes when they evict, so it can
+         briefly grow over this limit.
+      '''
+      self.directory = directory
+      self.max_bytes = max_bytes
+      os.makedirs(directory, exist_ok=True)
+
+   def key(self, config: dict, **params) -> str:
+      '''Returns the key of a run of `config`, with the other parameters
+      that change its results.
+      '''
+      description = {'config': config, 'params': params, 'code': code_version()}
+      encoded = json.dumps(description, sort_keys=True, default=str)
+      return hashlib.sha256(encoded.encode()).hexdigest()
+
+   def path(self, key: str) -> str:
+      return os.path.join(self.directory, key[:2], key + '.json')
+
+   def series_path(self, key: str) -> str:
+      return os.path.join(self.directory, key[:2], key + '.csv')
+
+   def get(self, key: str) -> Optional[dict]:
+      '''Returns the entry, or `None` on a miss. A hit counts as a use
+      for eviction.
+      '''
+      path = self.path(key)
+      try:
+         with open(path) as f:
+            entry = json.load(f)
+         os.utime(path)
+      except (FileNotFoundError, json.JSONDecodeError):
+         # Missing, or evicted in the meantime
+         return None
+      return entry
+
+   def get_series(self, key: str, path: str) -> bool:
+      '''Copies the metrics of an entry to `path`, and returns whether
+      the entry had them.
+      '''
+      try:
+         shutil.copyfile(self.series_path(key), path)
+      except FileNotFoundError:
+         return False
+      return True
+
+   def put(
+      self,
+      key:    str,
+      entry:  dict,
+      series: Optional[str] = None
+   ) -> None:
+      '''Stores an entry atomically, with a copy of the metrics file
+      `series` if given, then evicts entries if the cache is too large.
+      '''
+      directory = os.path.dirname(self.path(key))
+      os.makedirs(directory, exist_ok=True)
+      written = 0
+      if series is not None:
+         with open(series, 'rb') as f:
+            written += self.replace(self.series_path(key), f)
+      written += self.replace(self.path(key), io.BytesIO(json.dumps(entry).encode()))
+
+      if self.max_bytes is None:
+         return
+      root = os.path.abspath(self.directory)
+      if root not in _sizes:
+         _sizes[root] = self.size()
+      else:
+         _sizes[root] += written
+
+      # A little more than needed is evicted, so that the cache is only
+      # walked once every few writes
+      if _sizes[root] > self.max_bytes:
+         _sizes[root] = self.evict(self.max_bytes - self.max_bytes // 10)
+
+   def replace(self, path: str, source: BinaryIO) -> int:
+      '''Writes the content of `source` to `path` atomically, and returns
+      its size.
+      '''
+      fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+      try:
+         with os.fdopen(fd, 'wb') as f:
+            shutil.copyfileobj(source, f)
+            size = f.tell()
+         os.replace(temporary, path)
+      except BaseException:
+         os.unlink(temporary)
+         raise
+      return size
+
+   def entries(self) -> List[Tuple[float, int, str]]:
+      '''Returns the time of last use, total size and key of every entry.
+      Metrics left without their entry by an interrupted eviction come
+      first. Those written less than `orphan_age` seconds ago are left
+      out, as their entry may be on its way.
+      '''
+      sizes: Dict[str, int] = defaultdict(int)
+      used: Dict[str, float] = {}
+      written: Dict[str, float] = {}
+      for directory, _, files in os.walk(self.directory):
+         for name in files:
+            key, extension = os.path.splitext(name)
+            if extension not in ('.json', '.csv'):
+               continue
+            try:
+               stat = os.stat(os.path.join(directory, name))
+            except FileNotFoundError:
+               continue
+            sizes[key] += stat.st_size
+            if extension == '.json':
+               used[key] = stat.st_mtime
+            else:
+               written[key] = stat.st_mtime
+      recent = time.time() - orphan_age
+      return [
+         (used.get(key, 0.0), size, key)
+         for key, size in sizes.items()
+         if key in used or written[key] < recent
+      ]
+
+   def size(self) -> int:
+      return sum(size for _, size, _ in self.entries())
+
+   def evict(self, max_bytes: int) -> int:
+      '''Removes the least recently used entries until the cache holds at
+      most `max_bytes`, and returns its size. Another process may be
+      evicting at the same time, so entries can vanish at any point.
+      '''
+      entries = sorted(self.entries())
+      total = sum(size for _, size, _ in entries)
+      for _, size, key in entries:
+         if total <= max_bytes:
+            break
+         # The entry goes first, so that readers never find it without
+         # its metrics
+         for path in (self.path(key), self.series_path(key)):
+            try:
+               os.unlink(path)
+            except FileNotFoundError:
+               pass
+         total -= size
+      return total
+
+   def clear(self) -> None:
+      self.evict(0)
@@ -0,0 +1,100 @@
+'''Checkpoints of the complete state of a model, to pause and resume runs
+or to simulate a warm-up once and fork many runs from it.
+
+A checkpoint holds the whole object graph of the model in a binary
+pickle, with agents, the grid and lane index, the cross-references
+among stops and vehicles, the state of the random number generator, the
+statistics and the `DataCollector`. Restoring it continues exactly as
+the original run would have. Metrics sinks are not pickled, as they own
+open files: only their running totals are saved, see `MetricsSink`.
+Trajectory recorders are left out altogether.
+
+Usage:
+   data = checkpoint.dumps(model)
+   forks = [checkpoint.loads(data, reseed=seed) for seed in seeds]
+'''
+import pickle
+import random
+import struct
+from typing import Optional
+
+from mas.metrics import MetricsSink
+from mas.model import FourWayStop
+
+
+magic = b'MASCKPT'
+version = 1
+header = struct.Struct('<7sH')
+
+
+def dumps(model: FourWayStop) -> bytes:
+   '''Returns a checkpoint of the model.
+   '''
+   sink = model.metrics
+   sink_state = None
+   if sink is not None:
+      sink_state = (sink.reporters, sink.stride, sink.window, sink.get_state())
+   trajectories = model.trajectories
+   model.metrics = None
+   model.trajectories = None
+   try:
+      payload = pickle.dumps((model, sink_state), protocol=5)
+   finally:
+      model.metrics = sink
+      model.trajectories = trajectories
+   return header.pack(magic, version) + payload
+
+
+def loads(
+   data:    bytes,
+   metrics: Optional[MetricsSink] = None,
+   reseed:  Optional[int]         = None
+) -> FourWayStop:
+   '''Restores a model from a checkpoint.
+
+   metrics:
+      Sink the restored model streams its metrics to, continuing the
+      running totals saved in the checkpoint. If `None` and the model had
+      a sink, a `MetricsSink` that writes nothing is used instead.
+   reseed:
+      If set, the random number generator of the model and the route
+      decisions are reseeded, so that runs forked from the same
+      checkpoint are independent. Otherwise the run continues exactly
+      as the original.
+   '''
+   tag, v = header.unpack_from(data)
+   if tag != magic:
+      raise ValueError('Not a checkpoint')
+   if v != version:
+      raise ValueError(f'Unsupported checkpoint version: {v}')
+   model, sink_state = pickle.loads(data[header.size:])
+
+   if sink_state is not None:
+      reporters, stride, window, state = sink_state
+      if metrics is None:
+         metrics = MetricsSink(reporters, stride, window)
+      metrics.set_state(state)
+   model.metrics = metrics
+
+   if reseed is not None:
+      model.seed = reseed
+      model.random = random.Random(reseed)
+      if model.turn_probability is not None:
+         model.route_key = model.random.getrandbits(64)
+   return model
+
+
+def save(model: FourWayStop, path: str) -> None:
+   with open(path, 'wb') as f:
+      f.write(dumps(model))
+
+
+def load(
+   path:    str,
+   metrics: Optional[MetricsSink] = None,
+   reseed:  Optional[int]         = None
+) -> FourWayStop:
+   '''Restores a model from a checkpoint file, see `loads`.
+   '''
+   with open(path, 'rb') as f:
+      return loads(f.read(), metrics, reseed)
@@ -0,0 +1,193 @@
+'''Detection of the steady state of a run, to stop it as soon as its
+metrics are known precisely enough instead of after a fixed number of
+steps.
+
+The warm-up is truncated with MSER-5 (White, 1997): the series is
+averaged in batches of 5 steps, and the number of batches to drop is the
+one minimizing the standard error of the mean of the rest. The steady
+state is then estimated with non-overlapping batch means, with a
+confidence interval from Student's t distribution. Once the series holds
+`max_batches` batches, adjacent batches are merged two by two, so that
+memory and the cost of a check stay bounded however long the run is.
+'''
+from statistics import NormalDist
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from mesa import Model
+
+
+Reporter = Callable[[Model], float]
+
+
+def wait_time(model: Model) -> float:
+   return model.stats.average_wait_time()
+
+
+def cleared(model: Model) -> float:
+   return model.stats.cleared_this_step
+
+
+# Series tracked by default
+default_reporters = {
+   'wait_time': wait_time,
+   'cleared':   cleared
+}
+
+
+def t_quantile(p: float, df: int) -> float:
+   '''Quantile of Student's t distribution, with the Cornish-Fisher
+   expansion of Abramowitz and Stegun 26.7.5, accurate to a few digits
+   for 10 degrees of freedom or more.
+   '''
+   z = NormalDist().inv_cdf(p)
+   g = [
+      (z ** 3 + z) / 4,
+      (5 * z ** 5 + 16 * z ** 3 + 3 * z) / 96,
+      (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / 384,
+      (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3 - 945 * z) / 92160
+   ]
+   return z + sum(gi / df ** (i + 1) for i, gi in enumerate(g))
+
+
+def mser(y: np.ndarray) -> int:
+   '''Number of leading values to drop according to MSER, searched in
+   the first half of the series.
+   '''
+   n = len(y)
+   suffix = np.cumsum(y[::-1])[::-1]
+   suffix_squares = np.cumsum((y ** 2)[::-1])[::-1]
+   remaining = n - np.arange(n)
+   squared_errors = suffix_squares - suffix ** 2 / remaining
+   statistic = squared_errors / remaining ** 2
+   return int(np.argmin(statistic[:n // 2 + 1]))
+
+
+class ConvergenceMonitor:
+   '''Tracks some series of a model after each step, and tells when
+   all of them have reached a steady state with a confidence interval
+   narrow enough. `FourWayStop` then sets `running` to `False`.
+   '''
+
+   def __init__(
+      self,
+      reporters:   Optional[Dict[str, Reporter]] = None,
+      precision:   float = 0.05,
+      tolerance:   float = 0.0,
+      confidence:  float = 0.95,
+      n_batches:   int   = 20,
+      min_steps:   int   = 1000,
+      check_every: int   = 100,
+      max_batches: int   = 1000
+   ) -> None:
+      '''
+      reporters:
+         Series to track, by name. By default, the average wait time and
+         the number of vehicles clearing the intersections in each step.
+      precision:
+         Largest half-width of the confidence interval, relative to the
+         estimate.
+      tolerance:
+         Largest absolute half-width, for estimates close to 0. With
+         none, a series stuck at 0 never converges.
+      confidence:
+         Level of the confidence intervals.
+      n_batches:
+         Number of batches of the batch means.
+      min_steps:
+         Steps before convergence is first checked.
+      check_every:
+         Steps between checks, each costing time linear in the length of
+         the series.
+      max_batches:
+         Length of the series over which batches are merged, even.
+      '''
+      if max_batches % 2 != 0 or max_batches < 4 * n_batches:
+         raise ValueError(f'max_batches must be even and at least {4 * n_batches}')
+      self.reporters = reporters if reporters is not None else default_reporters
+      self.precision = precision
+      self.tolerance = tolerance
+      self.confidence = confidence
+      self.n_batches = n_batches
+      self.min_steps = min_steps
+      self.check_every = check_every
+      self.max_batches = max_batches
+
+      # Series averaged in batches of 5 steps, as in MSER-5, then of 10,
+      # 20 and so on once merged
+      self.batch_size = 5
+      self.steps = 0
+      self.partial = {k: 0.0 for k in self.reporters}
+      self.series: Dict[str, List[float]] = {k: [] for k in self.reporters}
+
+      # Results of the last check
+      self.converged = False
+      self.warmup = 0
+      self.estimates: Dict[str, Tuple[float, float]] = {}
+
+   def update(self, model: Model) -> bool:
+      '''Records the series after a step, and returns whether the run
+      has converged.
+      '''
+      for k, reporter in self.reporters.items():
+         self.partial[k] += reporter(model)
+      self.steps += 1
+      if self.steps % self.batch_size == 0:
+         for k in self.reporters:
+            self.series[k].append(self.partial[k] / self.batch_size)
+            self.partial[k] = 0.0
+         if self.steps // self.batch_size == self.max_batches:
+            self.merge()
+
+      if not self.converged and self.steps >= self.min_steps and \
+         self.steps % self.check_every == 0:
+         self.converged = self.check()
+      return self.converged
+
+   def merge(self) -> None:
+      '''Merges adjacent batches two by two, doubling the batch size.
+      '''
+      for k, y in self.series.items():
+         self.series[k] = [(a + b) / 2 for a, b in zip(y[::2], y[1::2])]
+      self.batch_size *= 2
+
+   def check(self) -> bool:
+      '''Truncates the warm-up and estimates each series. The warm-up
+      is the longest among the series, and is not over if it reaches
+      half of the run.
+      '''
+      series = {k: np.array(v) for k, v in self.series.items()}
+      n = len(next(iter(series.values())))
+      warmup = max(mser(y) for y in series.values())
+      self.warmup = warmup * self.batch_size
+      if warmup >= n // 2 or (n - warmup) < 2 * self.n_batches:
+         return False
+
+      t = t_quantile((1 + self.confidence) / 2, self.n_batches - 1)
+      converged = True
+      for k, y in series.items():
+         # The remainder is dropped from the start, with the warm-up
+         y = y[warmup:]
+         size = len(y) // self.n_batches
+         means = y[len(y) - size * self.n_batches:].reshape(self.n_batches, size).mean(axis=1)
+         estimate = float(means.mean())
+         half_width = float(t * means.std(ddof=1) / np.sqrt(self.n_batches))
+         self.estimates[k] = (estimate, half_width)
+
+         # Without a tolerance, a series stuck at 0 has no precision to
+         # reach, as when no vehicle ever gets through
+         bound = max(self.precision * abs(estimate), self.tolerance)
+         if half_width > bound or bound == 0:
+            converged = False
+      return converged
+
+   def summary(self) -> Dict[str, float]:
+      '''Estimate and half-width of the confidence interval of each
+      series, as of the last check.
+      '''
+      summary = {'converged': self.converged, 'warmup': self.warmup}
+      for k in self.reporters:
+         estimate, half_width = self.estimates.get(k, (float('nan'), float('nan')))
+         summary[k + '_estimate'] = estimate
+         summary[k + '_half_width'] = half_width
+      return summary
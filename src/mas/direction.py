@@ -1,42 +1,54 @@
-from typing import Tuple
-
-import numpy as np
+import math
+from typing import List, Tuple, Union
 
 
 class Direction:
    '''Auxiliary class to handle the direction and angle of the vehicles.
+
+   A direction is only an integer index into `all`, going clockwise from
+   north. Modifiers and angles are looked up in tables shared by all
+   instances.
    '''
 
-   def __init__(self, direction: str) -> None:
+   __slots__ = ('direction',)
+
+   all: List[str] = [
+      'N', 'NE', 'E', 'SE',
+      'S', 'SW', 'W', 'NW'
+   ]
+
+   # Change of the `x` and `y` coordinates for a velocity of 1
+   unit_modifiers: List[Tuple[int, int]] = [
+      (0, -1), (1, -1), (1, 0), (1, 1),
+      (0, 1), (-1, 1), (-1, 0), (-1, -1)
+   ]
+
+   # Angle in radians, 0 radians facing north
+   angles: List[float] = [2 * math.pi * i / 8 for i in range(8)]
+
+   def __init__(self, direction: Union[str, int]) -> None:
       '''
       direction:
-         Possible values are the four main compass directions.
+         Possible values are the four main compass directions, or their
+         index in `all`.
       '''
-      self.all = [
-         'N', 'NE', 'E', 'SE',
-         'S', 'SW', 'W', 'NW'
-      ]
-      self.direction = self.all.index(direction)
+      self.direction = direction if isinstance(direction, int) else \
+                       self.all.index(direction)
 
    def to_angle(self) -> float:
       '''Returns the angle in radians, assuming that 0 radians equals
       facing north.
       '''
-      return 2 * np.pi * self.direction / len(self.all)
+      return self.angles[self.direction]
 
    def turn_left(self) -> None:
       '''Turn vehicle 45° to the left.
       '''
-      self.direction = self.direction - 1 if self.direction != 0 else len(self.all) - 1
+      self.direction = (self.direction - 1) % 8
 
    def modifiers(self, velocity: int) -> Tuple[int, int]:
       '''Returns how much `x` and `y` coordinates change according to
       the given the current velocity.
       '''
-      das = self.all[self.direction]  # direction as string
-      xmod = +velocity if das[-1] == 'E' else \
-             -velocity if das[-1] == 'W' else 0
-      ymod = +velocity if das[0]  == 'S' else \
-             -velocity if das[0]  == 'N' else 0
-      return xmod, ymod
-
+      xmod, ymod = self.unit_modifiers[self.direction]
+      return xmod * velocity, ymod * velocity
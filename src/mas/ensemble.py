@@ -0,0 +1,448 @@
+'''Ensembles of independent replicates of the same configuration, stepped
+together. The state of every replicate is stacked along a leading
+dimension, so that the vehicles of all replicates move in a single
+vectorized update, and each stop rule is applied to all replicates at
+once.
+
+The rules are those of `VehicleArray` and `Stop`, in the same order, and
+routes are drawn from counters, so that each replicate follows exactly
+the same trajectory as a `FourWayStop` with its seed run on its own.
+Only closed grids are supported.
+
+Example:
+   ensemble = Ensemble(spawn_seeds(0, 200), n_vehicles=10, width=40,
+                       height=40, max_velocity=5, avoid_deadlocks=True)
+   ensemble.run(1000)
+   ensemble.summary(0)
+'''
+import random
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from mas.agents.stop import Status
+from mas.direction import Direction
+from mas.metrics import MetricsSink
+from mas.model import FourWayStop
+from mas.seeding import counter_uniforms
+from mas.statistics import P2Quantile
+
+
+# Lookup table of `Direction`, indexed by its integer direction
+_modifiers = np.array(Direction.unit_modifiers)
+
+_empty = Status.EMPTY.value
+_waiting = Status.WAITING.value
+_clearing = Status.CLEARING.value
+
+# Stop group of the lowest bit set in the bitfield of an intersection,
+# `-1` if none is set
+_lowest_group = np.array([((v & -v).bit_length() - 1) // 2 for v in range(256)])
+
+
+class Ensemble:
+   '''Replicates of a `FourWayStop` configuration, differing only by
+   their seed.
+
+   Vehicles are stored as `(R, n_vehicles)` arrays, the occupancy of the
+   grid as `(R, width, height)`, the statuses, last vehicles and wait
+   times of the stops as `(R, n_stops)`, the bitfields of the
+   intersections as `(R, n_intersections)`, and the statistics as one
+   value for each replicate.
+   '''
+
+   def __init__(
+      self,
+      seeds:            Sequence[int],
+      n_vehicles:       int,
+      width:            int,
+      height:           int,
+      max_velocity:     int,
+      avoid_deadlocks:  bool,
+      blocks:           Tuple[int, int] = (1, 1),
+      turn_probability: Optional[float] = None,
+      stride:           int             = 1
+   ) -> None:
+      '''
+      seeds:
+         Seed of each replicate, as for `FourWayStop`.
+      stride:
+         Collect the average wait time every `stride` steps, as the
+         `MetricsSink` of a model would.
+
+      The other parameters are those of `FourWayStop`.
+      '''
+      if not seeds:
+         raise ValueError('An ensemble needs at least one seed')
+
+      # A model without vehicles is only built for the geometry, which
+      # is the same in all replicates
+      model = FourWayStop(
+         n_vehicles=0,
+         width=width,
+         height=height,
+         max_velocity=max_velocity,
+         avoid_deadlocks=avoid_deadlocks,
+         backend='numpy',
+         seed=seeds[0],
+         mirror_grid=False,
+         metrics=MetricsSink({}),
+         blocks=blocks,
+         turn_probability=turn_probability
+      )
+      self.seeds = list(seeds)
+      self.n_replicates = len(self.seeds)
+      self.n_vehicles = n_vehicles
+      self.width = width
+      self.height = height
+      self.max_velocity = max_velocity
+      self.avoid_deadlocks = avoid_deadlocks
+      self.block_width = model.block_width
+      self.block_height = model.block_height
+      self.turn_probability = turn_probability
+      self.stride = stride
+      self.steps = 0
+
+      # Vehicles, and the key of the route draws of each replicate
+      shape = (self.n_replicates, n_vehicles)
+      self.x = np.zeros(shape, dtype=np.intp)
+      self.y = np.zeros_like(self.x)
+      self.direction = np.zeros_like(self.x)
+      self.turn = np.zeros(shape, dtype=bool)
+      self.velocity = np.zeros_like(self.x)
+      self.intersection_step = np.full(shape, -1, dtype=np.intp)
+      self.blocks_entered = np.zeros_like(self.x)
+      self.occupancy = np.zeros((self.n_replicates, width, height), dtype=np.intp)
+      self.stop_index = model.vehicles.stop_index
+      self.first_id = model.vehicles.unique_id
+      self.route_key = np.zeros(self.n_replicates, dtype=np.uint64)
+      for r, seed in enumerate(self.seeds):
+         self.place_vehicles(model, r, seed)
+      self.new_x = self.x.copy()
+      self.new_y = self.y.copy()
+
+      # Indices of all vehicles of all replicates
+      self.rows = np.arange(self.n_replicates)[:, None]
+      self.columns = np.arange(n_vehicles)[None, :]
+
+      # Geometry of the stops, in the order of the schedule, which is
+      # the same in all replicates
+      stops = model.stops()
+      self.n_stops = len(stops)
+      self.n_intersections = len(model.intersections)
+      self.stop_intersection = np.array([model.intersections.index(s.intersection) for s in stops])
+      self.stop_bit = np.array([s.bit for s in stops])
+      self.check_empty_mask = np.array([s.check_empty_mask for s in stops])
+      self.check_not_clearing_mask = np.array([s.check_not_clearing_mask for s in stops])
+      self.higher_priority_mask = np.array([s.higher_priority_mask for s in stops])
+      self.lower_priority_mask = np.array([s.lower_priority_mask for s in stops])
+
+      # Stops and intersections
+      shape = (self.n_replicates, self.n_stops)
+      self.status = np.full(shape, _empty, dtype=np.int8)
+      self.last_vehicle = np.full(shape, -1, dtype=np.intp)
+      self.wait_time = np.zeros(shape, dtype=np.intp)
+      self.waiting = np.zeros((self.n_replicates, self.n_intersections), dtype=np.int64)
+      self.clearing = np.zeros_like(self.waiting)
+
+      # Same as `StopStatistics`, for each replicate
+      self.total_wait_time = np.zeros(self.n_replicates, dtype=np.intp)
+      self.stops_waiting = np.zeros_like(self.total_wait_time)
+      self.throughput = np.zeros(shape, dtype=np.intp)
+      self.cleared = np.zeros_like(self.total_wait_time)
+      self.cleared_this_step = np.zeros_like(self.total_wait_time)
+      self.deadlocks = np.zeros_like(self.total_wait_time)
+      self.quantiles: List[Dict[float, P2Quantile]] = [
+         {p: P2Quantile(p) for p in model.stats.quantiles} for _ in self.seeds
+      ]
+
+      # Running totals of the average wait time, as in `MetricsSink`
+      self.count = 0
+      self.wait_totals = np.zeros(self.n_replicates)
+      self.wait_maxima = np.full(self.n_replicates, float('-inf'))
+      self.wait_last = np.zeros(self.n_replicates)
+
+   def place_vehicles(self, model: FourWayStop, r: int, seed: int) -> None:
+      '''Places the vehicles of replicate `r`, drawing from a generator
+      seeded with `seed` exactly as `FourWayStop.make_vehicles` does,
+      then draws its route key.
+      '''
+      rng = random.Random(seed)
+      n_blocks = len(model.centers)
+      occupancy = self.occupancy[r]
+      for i in range(self.n_vehicles):
+         lane = rng.randrange(8)
+         block = rng.randrange(n_blocks) if n_blocks > 1 else 0
+         (x, y), direction = model.lane_start(lane, block)
+
+         # Move forward while on top of a stop or a placed vehicle
+         dx, dy = direction.modifiers(1)
+         while occupancy[x, y] > 0 or self.stop_index[x, y] >= 0:
+            x, y = x + dx, y + dy
+         self.x[r, i], self.y[r, i] = x, y
+         self.direction[r, i] = direction.direction
+         self.turn[r, i] = lane % 2
+         occupancy[x, y] += 1
+      if self.turn_probability is not None:
+         self.route_key[r] = rng.getrandbits(64)
+
+   def average_wait_time(self) -> np.ndarray:
+      '''Same as `StopStatistics.average_wait_time`, for each replicate.
+      '''
+      return self.total_wait_time / np.where(self.stops_waiting > 0, self.stops_waiting, 1)
+
+   def collect(self) -> None:
+      if self.steps % self.stride != 0:
+         return
+      values = self.average_wait_time()
+      self.count += 1
+      self.wait_totals += values
+      self.wait_maxima = np.maximum(self.wait_maxima, values)
+      self.wait_last = values
+
+   def run(self, n_steps: int) -> None:
+      for _ in range(n_steps):
+         self.step()
+
+   def step(self) -> None:
+      '''Same as `FourWayStop.step`, stage by stage.
+      '''
+      self.collect()
+      self.cleared_this_step[:] = 0
+
+      self.move_vehicles()
+      self.move(self.rows, self.columns)
+
+      self.right_of_way()
+      self.advance_crossing()
+
+      if self.avoid_deadlocks:
+         self.resolve_deadlocks()
+      self.advance_crossing()
+
+      self.steps += 1
+
+   def set_status(
+      self,
+      r:      np.ndarray,
+      s:      np.ndarray,
+      status: int
+   ) -> None:
+      '''Vectorized `Stop.set_status`, for the stops `s` of the
+      replicates `r`.
+      '''
+      self.status[r, s] = status
+      k = self.stop_intersection[s]
+      bit = self.stop_bit[s]
+      for bitfield, value in [(self.waiting, _waiting), (self.clearing, _clearing)]:
+         # Several stops may share a bitfield
+         if status == value:
+            np.bitwise_or.at(bitfield, (r, k), bit)
+         else:
+            np.bitwise_and.at(bitfield, (r, k), ~bit)
+
+   def move_vehicles(self) -> None:
+      '''`VehicleArray.move_vehicles_step`, for the free vehicles of all
+      replicates at once.
+      '''
+      r, i = np.nonzero(self.intersection_step == -1)
+      if len(r) == 0:
+         return
+      x, y = self.x[r, i], self.y[r, i]
+      dx, dy = _modifiers[self.direction[r, i]].T
+      velocity = self.velocity[r, i]
+
+      # Cells from 1 up to `velocity + 1` ahead
+      ahead = np.arange(1, self.max_velocity + 2)
+      ahead_x = (x[:, None] + dx[:, None] * ahead) % self.width
+      ahead_y = (y[:, None] + dy[:, None] * ahead) % self.height
+      blocked = (self.occupancy[r[:, None], ahead_x, ahead_y] > 0) | \
+                (self.stop_index[ahead_x, ahead_y] != -1)
+      blocked &= ahead <= velocity[:, None] + 1
+
+      # Accelerate if no agent is close, otherwise slow down
+      found = blocked.any(axis=1)
+      distance_to_next = blocked.argmax(axis=1) + 1
+      velocity = np.where(
+         found,
+         distance_to_next - 1,
+         np.minimum(velocity + 1, self.max_velocity)
+      )
+      self.velocity[r, i] = velocity
+
+      # Vehicles at the stop sign only notify the stop
+      stop = self.stop_index[ahead_x[:, 0], ahead_y[:, 0]]
+      at_stop = found & (distance_to_next == 1) & (stop != -1)
+      if at_stop.any():
+         self.approach(r[at_stop], i[at_stop], stop[at_stop])
+
+      # Find new positions
+      moving = ~at_stop
+      r, i, x, y = r[moving], i[moving], x[moving], y[moving]
+      velocity, dx, dy = velocity[moving], dx[moving], dy[moving]
+      new_x = x + dx * velocity
+      new_y = y + dy * velocity
+      self.new_x[r, i] = new_x % self.width
+      self.new_y[r, i] = new_y % self.height
+
+      crossing = (x // self.block_width != new_x // self.block_width) | \
+                 (y // self.block_height != new_y // self.block_height)
+      if self.turn_probability is not None:
+         er, ei = r[crossing], i[crossing]
+         draws = counter_uniforms(
+            self.route_key[er],
+            ei + self.first_id,
+            self.blocks_entered[er, ei]
+         )
+         self.turn[er, ei] = draws < self.turn_probability
+         self.blocks_entered[er, ei] += 1
+      shift = crossing & self.turn[r, i]
+      self.new_x[r[shift], i[shift]] += dy[shift]
+      self.new_y[r[shift], i[shift]] -= dx[shift]
+
+   def approach(
+      self,
+      r: np.ndarray,
+      i: np.ndarray,
+      s: np.ndarray
+   ) -> None:
+      '''`Stop.approaching_intersection` for the vehicles `i` of the
+      replicates `r` at the stops `s`, sorted by replicate then vehicle.
+      The first vehicle at an empty stop becomes its last vehicle, and
+      every other one counts as one step of wait.
+      '''
+      _, first, count = np.unique(r * self.n_stops + s, return_index=True, return_counts=True)
+      r, i, s = r[first], i[first], s[first]
+      status = self.status[r, s]
+      empty = status == _empty
+      self.set_status(r[empty], s[empty], _waiting)
+      self.last_vehicle[r[empty], s[empty]] = i[empty]
+
+      # Same as `StopStatistics.waited`, once for each step of wait
+      waits = np.where(empty, count - 1, np.where(status == _waiting, count, 0))
+      waited = waits > 0
+      r, s, waits = r[waited], s[waited], waits[waited]
+      n = self.n_replicates
+      self.stops_waiting += np.bincount(r[self.wait_time[r, s] == 0], minlength=n)
+      self.total_wait_time += np.bincount(r, weights=waits, minlength=n).astype(np.intp)
+      self.wait_time[r, s] += waits
+
+   def proceed(self, r: np.ndarray, s: int) -> None:
+      '''`Stop.proceed` for the stop `s` of the replicates `r`.
+      '''
+      if len(r) == 0:
+         return
+      self.intersection_step[r, self.last_vehicle[r, s]] = 0
+      self.set_status(r, s, _clearing)
+      self.throughput[r, s] += 1
+      for replicate, wait_time in zip(r.tolist(), self.wait_time[r, s].tolist()):
+         for quantile in self.quantiles[replicate].values():
+            quantile.add(wait_time)
+
+   def right_of_way(self) -> None:
+      '''`Stop.right_of_way_step` for each stop in turn, in all
+      replicates at once.
+      '''
+      for s in range(self.n_stops):
+         k = self.stop_intersection[s]
+         status = self.status[:, s].copy()
+
+         waiting = np.flatnonzero(status == _waiting)
+         if len(waiting):
+            w, c = self.waiting[waiting, k], self.clearing[waiting, k]
+            blocked = (((w | c) & self.check_empty_mask[s]) != 0) | \
+                      ((c & self.check_not_clearing_mask[s]) != 0)
+            self.proceed(waiting[~blocked], s)
+
+         clearing = np.flatnonzero(status == _clearing)
+         if len(clearing):
+            vehicles = self.last_vehicle[clearing, s]
+            cleared = clearing[self.intersection_step[clearing, vehicles] == -1]
+            wait_time = self.wait_time[cleared, s]
+            self.total_wait_time[cleared] -= wait_time
+            self.stops_waiting[cleared] -= wait_time > 0
+            self.cleared[cleared] += 1
+            self.cleared_this_step[cleared] += 1
+            self.set_status(cleared, s, _empty)
+            self.wait_time[cleared, s] = 0
+
+   def resolve_deadlocks(self) -> None:
+      '''`FourWayStop.resolve_deadlocks`, with `Intersection.deadlocked`
+      computed for all replicates at once.
+      '''
+      for k in range(self.n_intersections):
+         w, c = self.waiting[:, k], self.clearing[:, k]
+         group = _lowest_group[w | c]
+         shift = 2 * np.maximum(group, 0)
+         deadlocked = np.flatnonzero(
+            (group >= 0) & ((w & (0b11 << shift)) != 0) & ((c >> (shift + 2)) == 0)
+         )
+         if len(deadlocked) == 0:
+            continue
+         self.deadlocks[deadlocked] += 1
+         for s in range(8 * k, 8 * (k + 1)):
+            r = deadlocked[self.status[deadlocked, s] == _waiting]
+            if len(r) == 0:
+               continue
+            w, c = self.waiting[r, k], self.clearing[r, k]
+            blocked = (((w | c) & self.higher_priority_mask[s]) != 0) | \
+                      ((c & self.lower_priority_mask[s]) != 0)
+            self.proceed(r[~blocked], s)
+
+   def move(self, r: np.ndarray, i: np.ndarray) -> None:
+      '''Moves the vehicles `i` of the replicates `r` to the new
+      positions previously computed.
+      '''
+      np.subtract.at(self.occupancy, (r, self.x[r, i], self.y[r, i]), 1)
+      np.add.at(self.occupancy, (r, self.new_x[r, i], self.new_y[r, i]), 1)
+      self.x[r, i] = self.new_x[r, i]
+      self.y[r, i] = self.new_y[r, i]
+
+   def advance_crossing(self) -> None:
+      '''`VehicleArray.right_of_way_advance`, for all replicates.
+      '''
+      r, i = np.nonzero(self.intersection_step != -1)
+      if len(r) == 0:
+         return
+      step = self.intersection_step[r, i]
+
+      # Vehicles that have to turn
+      turning = self.turn[r, i] & (2 < step) & (step < 5)
+      tr, ti = r[turning], i[turning]
+      self.direction[tr, ti] = (self.direction[tr, ti] - 1) % len(Direction.all)
+
+      # Move vehicles
+      dx, dy = _modifiers[self.direction[r, i]].T
+      self.new_x[r, i] = (self.x[r, i] + dx) % self.width
+      self.new_y[r, i] = (self.y[r, i] + dy) % self.height
+      self.move(r, i)
+
+      step += 1
+      step[step == 6] = -1
+      self.intersection_step[r, i] = step
+
+   def positions(self, r: int) -> List[Tuple[int, int]]:
+      return list(zip(self.x[r].tolist(), self.y[r].tolist()))
+
+   def summary(self, r: int) -> Dict[str, float]:
+      '''Same as `StopStatistics.summary` for the replicate `r`.
+      '''
+      summary = {
+         'throughput': int(self.throughput[r].sum()),
+         'cleared': int(self.cleared[r]),
+         'deadlocks': int(self.deadlocks[r])
+      }
+      for p, quantile in self.quantiles[r].items():
+         summary[f'wait_p{round(p * 100)}'] = quantile.value()
+      return summary
+
+   def wait_time_summary(self, r: int) -> Dict[str, float]:
+      '''Mean, maximum and last average wait time of the replicate `r`,
+      as in `MetricsSink.summary`.
+      '''
+      count = self.count
+      return {
+         'Average wait time mean': float(self.wait_totals[r]) / count if count else 0.0,
+         'Average wait time max': float(self.wait_maxima[r]) if count else 0.0,
+         'Average wait time last': float(self.wait_last[r]) if count else 0.0
+      }
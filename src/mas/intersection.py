@@ -0,0 +1,56 @@
+from typing import Dict, List
+
+from mesa import Agent
+
+
+class Intersection:
+   '''Statuses of the stops of a four-way stop, packed into bitfields so
+   that the right-of-way rules become a few bitwise operations.
+
+   Each stop has bit `2 * stop_group + turn`. The `version` is
+   incremented on every status change, so that a stop that was denied
+   right of way does not need to check again until something changes.
+   '''
+
+   n_stop_groups = 4
+
+   def __init__(self) -> None:
+      self.stop_groups: Dict[int, List[Agent]] = {
+         k: [] for k in range(self.n_stop_groups)
+      }
+      self.waiting = 0   # Bits of the stops with a vehicle waiting
+      self.clearing = 0  # Bits of the stops with a vehicle clearing
+      self.version = 0
+
+   @staticmethod
+   def bit(stop: Agent) -> int:
+      return 1 << (2 * stop.stop_group + stop.turn)
+
+   def mask(self, stops: List[Agent]) -> int:
+      mask = 0
+      for stop in stops:
+         mask |= self.bit(stop)
+      return mask
+
+   def group_mask(self, stop_groups: List[int]) -> int:
+      return self.mask([stop for i in stop_groups for stop in self.stop_groups[i]])
+
+   def deadlocked(self) -> bool:
+      '''Whether the rule to avoid deadlocks lets a stop proceed, in
+      constant time: the group with the highest priority among those
+      with a stop waiting or clearing must have one waiting, and no
+      other group one clearing.
+      '''
+      active = self.waiting | self.clearing
+      if not active:
+         return False
+      group = ((active & -active).bit_length() - 1) // 2
+      return bool(self.waiting & (0b11 << 2 * group)) and \
+             not self.clearing >> 2 * (group + 1)
+
+   def update(self, stop: Agent, waiting: bool, clearing: bool) -> None:
+      '''Records a status change of the stop.
+      '''
+      self.waiting = self.waiting | stop.bit if waiting else self.waiting & ~stop.bit
+      self.clearing = self.clearing | stop.bit if clearing else self.clearing & ~stop.bit
+      self.version += 1
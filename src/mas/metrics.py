@@ -0,0 +1,281 @@
+'''Streaming alternatives to Mesa's `DataCollector`, which keeps every
+collected value in memory. A sink only holds a bounded buffer of records
+and writes it to disk whenever it is full, so memory stays constant no
+matter how long the run is.
+'''
+import copy
+import csv
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+from mesa import Model
+
+
+Reporter = Callable[[Model], float]
+
+
+class MetricsSink:
+   '''Collects model-level reporters every `stride` steps. Records are
+   either written as they are, or aggregated over windows of `window`
+   steps, with the mean, minimum and maximum of each reporter.
+
+   This base class writes nothing and only keeps running totals of each
+   reporter, see `summary()`. Subclasses implement `write()`.
+   '''
+
+   def __init__(
+      self,
+      reporters:   Dict[str, Reporter],
+      stride:      int           = 1,
+      window:      Optional[int] = None,
+      buffer_size: int           = 1024
+   ) -> None:
+      '''
+      reporters:
+         Functions computing a value from the model, by name.
+      stride:
+         Collect every `stride` steps.
+      window:
+         If set, write one aggregate record every `window` steps instead
+         of every collected value.
+      buffer_size:
+         Number of records held before they are written.
+      '''
+      self.reporters = reporters
+      self.stride = stride
+      self.window = window
+      self.buffer_size = buffer_size
+      self.buffer: List[dict] = []
+
+      # Running totals over the whole run
+      self.count = 0
+      self.totals = {k: 0.0 for k in reporters}
+      self.maxima = {k: float('-inf') for k in reporters}
+      self.last = {k: 0.0 for k in reporters}
+
+      # Aggregates of the current window
+      self.window_start = None
+      self.window_count = 0
+      self.window_totals = {k: 0.0 for k in reporters}
+      self.window_minima = {k: float('inf') for k in reporters}
+      self.window_maxima = {k: float('-inf') for k in reporters}
+
+   def __enter__(self) -> 'MetricsSink':
+      return self
+
+   def __exit__(self, *exc_info) -> None:
+      self.close()
+
+   def collect(self, model: Model) -> None:
+      step = model.schedule.steps
+      if step % self.stride != 0:
+         return
+
+      values = {k: reporter(model) for k, reporter in self.reporters.items()}
+      self.count += 1
+      for k, v in values.items():
+         self.totals[k] += v
+         self.maxima[k] = max(self.maxima[k], v)
+      self.last = values
+
+      if self.window is None:
+         self.append({'step': step, **values})
+         return
+
+      if self.window_start is None:
+         self.window_start = step
+      self.window_count += 1
+      for k, v in values.items():
+         self.window_totals[k] += v
+         self.window_minima[k] = min(self.window_minima[k], v)
+         self.window_maxima[k] = max(self.window_maxima[k], v)
+      if step + self.stride - self.window_start >= self.window:
+         self.flush_window()
+
+   def flush_window(self) -> None:
+      '''Appends the aggregate record of the current window, if any
+      value was collected in it.
+      '''
+      if self.window_count == 0:
+         return
+      record = {'step': self.window_start, 'count': self.window_count}
+      for k in self.reporters:
+         record[k + ' mean'] = self.window_totals[k] / self.window_count
+         record[k + ' min'] = self.window_minima[k]
+         record[k + ' max'] = self.window_maxima[k]
+         self.window_totals[k] = 0.0
+         self.window_minima[k] = float('inf')
+         self.window_maxima[k] = float('-inf')
+      self.window_start = None
+      self.window_count = 0
+      self.append(record)
+
+   def append(self, record: dict) -> None:
+      self.buffer.append(record)
+      if len(self.buffer) >= self.buffer_size:
+         self.flush()
+
+   def flush(self) -> None:
+      '''Writes and empties the buffer.
+      '''
+      if self.buffer:
+         self.write(self.buffer)
+         self.buffer = []
+
+   def write(self, records: List[dict]) -> None:
+      pass
+
+   def close(self) -> None:
+      '''Writes the last, possibly partial, window and all buffered
+      records.
+      '''
+      if self.window is not None:
+         self.flush_window()
+      self.flush()
+
+   # Attributes with the running totals and window aggregates, saved
+   # by `mas.checkpoint`
+   state_attributes = [
+      'count',
+      'totals',
+      'maxima',
+      'last',
+      'window_start',
+      'window_count',
+      'window_totals',
+      'window_minima',
+      'window_maxima'
+   ]
+
+   def get_state(self) -> dict:
+      '''Returns a copy of the running totals and window aggregates,
+      after writing the buffered records.
+      '''
+      self.flush()
+      return copy.deepcopy({k: getattr(self, k) for k in self.state_attributes})
+
+   def set_state(self, state: dict) -> None:
+      '''Continues from the totals and aggregates of `get_state()`.
+      '''
+      for k, v in copy.deepcopy(state).items():
+         setattr(self, k, v)
+
+   def fieldnames(self) -> List[str]:
+      if self.window is None:
+         return ['step', *self.reporters]
+      names = ['step', 'count']
+      for k in self.reporters:
+         names += [k + ' mean', k + ' min', k + ' max']
+      return names
+
+   def summary(self) -> dict:
+      '''Mean, maximum and last value of each reporter over all the
+      collected steps.
+      '''
+      summary = {}
+      for k in self.reporters:
+         summary[k + ' mean'] = self.totals[k] / self.count if self.count else 0.0
+         summary[k + ' max'] = self.maxima[k] if self.count else 0.0
+         summary[k + ' last'] = self.last[k] if self.count else 0.0
+      return summary
+
+
+class CSVSink(MetricsSink):
+   '''Streams the records to a CSV file.
+   '''
+
+   def __init__(
+      self,
+      path:        str,
+      reporters:   Dict[str, Reporter],
+      stride:      int           = 1,
+      window:      Optional[int] = None,
+      buffer_size: int           = 1024
+   ) -> None:
+      super().__init__(reporters, stride, window, buffer_size)
+      self.file = open(path, 'w', newline='')
+      self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames())
+      self.writer.writeheader()
+
+   def write(self, records: List[dict]) -> None:
+      self.writer.writerows(records)
+      self.file.flush()
+
+   def close(self) -> None:
+      super().close()
+      self.file.close()
+
+
+class MemorySink(MetricsSink):
+   '''Keeps all the records in `records`. Memory is only bounded through
+   `stride` and `window`.
+   '''
+
+   def __init__(
+      self,
+      reporters:   Dict[str, Reporter],
+      stride:      int           = 1,
+      window:      Optional[int] = None,
+      buffer_size: int           = 1024
+   ) -> None:
+      super().__init__(reporters, stride, window, buffer_size)
+      self.records: List[dict] = []
+
+   def write(self, records: List[dict]) -> None:
+      self.records.extend(records)
+
+
+class RecentSink(MetricsSink):
+   '''Keeps the most recent records in `records`, at most `max_records`,
+   for live views of runs of any length. Records are kept as soon as
+   they are collected.
+   '''
+
+   def __init__(
+      self,
+      reporters:   Dict[str, Reporter],
+      max_records: int           = 10000,
+      stride:      int           = 1,
+      window:      Optional[int] = None
+   ) -> None:
+      super().__init__(reporters, stride, window, buffer_size=1)
+      self.records: Deque[dict] = deque(maxlen=max_records)
+
+   def write(self, records: List[dict]) -> None:
+      self.records.extend(records)
+
+
+class ParquetSink(MetricsSink):
+   '''Streams the records to a Parquet file, one row group per buffer.
+   Requires `pyarrow`.
+   '''
+
+   def __init__(
+      self,
+      path:        str,
+      reporters:   Dict[str, Reporter],
+      stride:      int           = 1,
+      window:      Optional[int] = None,
+      buffer_size: int           = 65536
+   ) -> None:
+      try:
+         import pyarrow as pa
+         import pyarrow.parquet as pq
+      except ImportError as e:
+         raise ImportError('ParquetSink requires pyarrow') from e
+      super().__init__(reporters, stride, window, buffer_size)
+      self.pa = pa
+      fields = [pa.field(name, pa.float64()) for name in self.fieldnames()]
+      fields[0] = pa.field('step', pa.int64())
+      if window is not None:
+         fields[1] = pa.field('count', pa.int64())
+      self.schema = pa.schema(fields)
+      self.writer = pq.ParquetWriter(path, self.schema)
+
+   def write(self, records: List[dict]) -> None:
+      table = self.pa.Table.from_pylist(records, schema=self.schema)
+      self.writer.write_table(table)
+
+   def close(self) -> None:
+      super().close()
+      self.writer.close()
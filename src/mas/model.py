@@ -1,26 +1,62 @@
 import random
-from typing import Tuple
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
 from mesa import Model
-from mesa.space import MultiGrid
-from mesa.datacollection import DataCollector
 
+from mas.agents.traffic import Traffic
 from mas.agents.vehicle import Vehicle
 from mas.agents.stop import Stop
+from mas.arrivals import Arrivals
 from mas.direction import Direction
+from mas.intersection import Intersection
+from mas.metrics import MetricsSink
+from mas.occupancy import LaneIndex
+from mas.profiling import Profiler
+from mas.statistics import StopStatistics
 from mas.activation import SimultaneousStagedActivation
 
+# Modules loading NumPy or pandas are only imported when used, so that
+# headless runs with the agents backend start fast
+if TYPE_CHECKING:
+   from mas.convergence import ConvergenceMonitor
+   from mas.trajectories import TrajectoryRecorder
+
 
 def avg_wait_time(model: Model) -> float:
-   n_stops = 8
-   total_wait_time = 0.0
-   stops_waiting = 0
-   for i in range(n_stops):
-      wait_time = model.schedule.agents[i].wait_time
-      if wait_time > 0:
-         total_wait_time += model.schedule.agents[i].wait_time
-         stops_waiting += 1
-   return total_wait_time / (stops_waiting if stops_waiting else 1)
+   return model.stats.average_wait_time()
+
+
+def throughput(model: Model) -> int:
+   return sum(model.stats.throughput)
+
+
+def cleared_per_step(model: Model) -> int:
+   # Metrics are collected at the start of a step, before the counter is
+   # reset, so this is the number cleared during the previous step
+   return model.stats.cleared_this_step
+
+
+def wait_time_p50(model: Model) -> float:
+   return model.stats.wait_time_quantile(0.5)
+
+
+def wait_time_p95(model: Model) -> float:
+   return model.stats.wait_time_quantile(0.95)
+
+
+def wait_time_p99(model: Model) -> float:
+   return model.stats.wait_time_quantile(0.99)
+
+
+# Reporters collected every step
+model_reporters = {
+   'Average wait time': avg_wait_time,
+   'Throughput':        throughput,
+   'Cleared':           cleared_per_step,
+   'Wait time p50':     wait_time_p50,
+   'Wait time p95':     wait_time_p95,
+   'Wait time p99':     wait_time_p99
+}
 
 
 class FourWayStop(Model):
@@ -30,49 +66,138 @@ class FourWayStop(Model):
 
    def __init__(
       self,
-      n_vehicles:      int,
-      width:           int,
-      height:          int,
-      max_velocity:    int,
-      avoid_deadlocks: bool
+      n_vehicles:       int,
+      width:            int,
+      height:           int,
+      max_velocity:     int,
+      avoid_deadlocks:  bool,
+      backend:          str                            = 'agents',
+      seed:             Optional[int]                  = None,
+      mirror_grid:      bool                           = True,
+      metrics:          Optional[MetricsSink]          = None,
+      blocks:           Tuple[int, int]                = (1, 1),
+      turn_probability: Optional[float]                = None,
+      convergence:      Optional['ConvergenceMonitor'] = None,
+      profiler:         Optional[Profiler]             = None,
+      arrivals:         Optional[Arrivals]             = None,
+      trajectories:     Optional['TrajectoryRecorder'] = None
    ) -> None:
       '''
       n_vehicles:
          Number of vehicles.
       width, height:
          Size of the grid.
+      backend:
+         Either `'agents'`, with one `Vehicle` agent per vehicle, or
+         `'numpy'`, with all vehicles in a single `VehicleArray`.
+      seed:
+         Seed of the random number generator owned by the model. Runs
+         with the same seed are identical. See `mas.seeding` to derive
+         seeds for independent replicates.
+      mirror_grid:
+         Whether to also keep the agents on a Mesa `MultiGrid`, in
+         `grid`. The model itself only uses the `LaneIndex` in `lanes`.
+      metrics:
+         Sink streaming the collected metrics, in place of the in-memory
+         `DataCollector`. The caller is responsible for closing it.
+      blocks:
+         Number of blocks along `x` and `y`. The grid is divided in
+         blocks of equal size, each with a four-way stop at its center.
+         See `RoadNetwork`.
+      turn_probability:
+         Probability that a vehicle turns left at the next intersection,
+         drawn each time it enters a block. If `None`, vehicles keep
+         turning or going straight as in the lane they were spawned in.
+      convergence:
+         If set, the run stops, with `running` set to `False`, as soon as
+         the monitor detects a steady state.
+      profiler:
+         If set, the time spent in each stage is recorded. See
+         `set_profiler()`.
+      arrivals:
+         If set, the grid has open boundaries instead of being a torus:
+         vehicles arrive at the `entries` as drawn from `arrivals`, on
+         top of the `n_vehicles` placed at the start, and are removed
+         when they leave the grid. Vehicles that cannot enter yet wait
+         in `entry_queues`. Removed vehicles are kept in a pool and
+         reused for the next arrivals.
+      trajectories:
+         If set, the state of the vehicles is recorded along with the
+         metrics. The caller is responsible for closing it.
       '''
+      if backend not in ('agents', 'numpy'):
+         raise ValueError(f'Unknown backend: {backend}')
+      self.seed = seed
+      self.random = random.Random(seed)
       self.n_vehicles = n_vehicles
       self.width = width
       self.height = height
-      self.center = (self.width // 2, self.height // 2)
+      self.blocks = blocks
+      self.block_width = width // blocks[0]
+      self.block_height = height // blocks[1]
+      self.turn_probability = turn_probability
+
+      # Intersections at the center of each block, row by row
+      self.centers = [
+         (bx * self.block_width + self.block_width // 2,
+          by * self.block_height + self.block_height // 2)
+         for by in range(blocks[1]) for bx in range(blocks[0])
+      ]
+      self.center = self.centers[0]
       self.schedule = SimultaneousStagedActivation(self, [
          'move_vehicles',
          'right_of_way',
          'avoid_deadlocks'
       ])
-      self.grid = MultiGrid(
-         width=self.width,
-         height=self.height,
-         torus=True
-      )
-      self.stop_groups = {k: [] for k in range(4)}
+      self.lanes = LaneIndex(self.width, self.height, self.centers)
+      self.grid = None
+      if mirror_grid:
+         from mesa.space import MultiGrid
+         self.grid = MultiGrid(
+            width=self.width,
+            height=self.height,
+            torus=True
+         )
+      self.backend = backend
+      self.vehicles = None
+      self.intersections = [Intersection() for _ in self.centers]
+      self.intersection = self.intersections[0]
+      self.stop_groups = self.intersection.stop_groups
+      self.n_stops = 8 * len(self.intersections)
+      self.stats = StopStatistics(n_stops=self.n_stops)
+      self.avoid_deadlocks = avoid_deadlocks
       self.make_stops(avoid_deadlocks)
+      self.max_velocity = max_velocity
+      self.arrivals = arrivals
+      self.entries = self.boundary_entries() if arrivals is not None else []
+      self.entry_queues = [0] * len(self.entries)
+      self.arrived = 0
+      self.exited = 0
+      self.vehicle_pool: List[Vehicle] = []
       self.make_vehicles(n_vehicles, max_velocity)
-      self.datacollector = DataCollector(
-         model_reporters={'Average wait time': avg_wait_time}
-      )
+      self.n_created = n_vehicles
+      self.route_key = self.random.getrandbits(64) if turn_probability is not None else 0
+      self.metrics = metrics
+      self.trajectories = trajectories
+      self.datacollector = None
+      if metrics is None:
+         # Mesa's data collector loads pandas
+         from mesa.datacollection import DataCollector
+         self.datacollector = DataCollector(model_reporters=model_reporters)
+      self.convergence = convergence
+      self.set_profiler(profiler)
       self.running = True
 
-   def get_coords(
+   def lane_start(
       self,
-      lane: int
+      lane:  int,
+      block: int = 0
    ) -> Tuple[Tuple[int, int], Direction]:
       '''Given a lane, returns the starting coordinates and the
-      direction.
+      direction, at the edge of the given block.
 
       Visualization of the intersection and the lanes. The `•` marks the
-      center of the grid.
+      center of the block.
        ┃0 1  ┃
       ━┛     ┗━
               2
@@ -81,34 +206,127 @@ class FourWayStop(Model):
       ━┓     ┏━
        ┃  5 4┃
       '''
-      coords = (self.center[0] - 1, 0)               if lane == 0 else \
-               (self.center[0], 0)                   if lane == 1 else \
-               (self.width - 1, self.center[1] - 1)  if lane == 2 else \
-               (self.width - 1, self.center[1])      if lane == 3 else \
-               (self.center[0] + 1, self.height - 1) if lane == 4 else \
-               (self.center[0], self.height - 1)     if lane == 5 else \
-               (0, self.center[1] + 1)               if lane == 6 else \
-               (0, self.center[1])                 # if lane == 7
+      cx, cy = self.centers[block]
+      left = cx - self.block_width // 2
+      top = cy - self.block_height // 2
+      right = left + self.block_width - 1
+      bottom = top + self.block_height - 1
+      coords = (cx - 1, top)     if lane == 0 else \
+               (cx, top)         if lane == 1 else \
+               (right, cy - 1)   if lane == 2 else \
+               (right, cy)       if lane == 3 else \
+               (cx + 1, bottom)  if lane == 4 else \
+               (cx, bottom)      if lane == 5 else \
+               (left, cy + 1)    if lane == 6 else \
+               (left, cy)      # if lane == 7
 
       direction_as_str = 'S'   if lane < 2 else \
                          'W'   if lane < 4 else \
                          'N'   if lane < 6 else \
                          'E' # if lane < 8
-      direction = Direction(direction_as_str)
+      return coords, Direction(direction_as_str)
+
+   def get_coords(
+      self,
+      lane:  int,
+      block: int = 0
+   ) -> Tuple[Tuple[int, int], Direction]:
+      '''Same as `lane_start`, moving forward to the first free cell of
+      the lane.
+      '''
+      coords, direction = self.lane_start(lane, block)
 
       # Move vehicles while on top of an already spawned vehicle
       modifiers = direction.modifiers(1)
-      while self.grid[coords] != []:
+      while not self.is_cell_empty(coords):
          coords = tuple(map(sum, zip(coords, modifiers)))
 
       return coords, direction
 
+   def is_cell_empty(self, coords: Tuple[int, int]) -> bool:
+      '''Whether there is no stop nor vehicle in the given cell.
+      '''
+      if self.vehicles is not None and not self.vehicles.is_cell_empty(coords):
+         return False
+      return self.lanes.is_cell_empty(coords)
+
+   def place_agent(self, agent: Traffic, pos: Tuple[int, int]) -> None:
+      '''Places an agent, either a vehicle or a stop, on the road.
+      '''
+      if isinstance(agent, Stop):
+         self.lanes.place_stop(agent, pos)
+      else:
+         self.lanes.place(agent, pos)
+      if self.grid is not None:
+         self.grid.place_agent(agent, pos)
+      agent.pos = pos
+
+   def move_agent(self, agent: Traffic, pos: Tuple[int, int]) -> None:
+      '''Moves a vehicle to a new position, wrapping around the grid.
+      '''
+      pos = self.lanes.torus_adj(pos)
+      self.lanes.move(agent, agent.pos, pos)
+      if self.grid is not None:
+         self.grid.move_agent(agent, pos)
+      agent.pos = pos
+
+   def queue_lengths(self) -> List[int]:
+      '''Number of vehicles lined up behind each stop. Computed on
+      demand, walking the lanes backwards from the stops.
+      '''
+      # Opposite of the direction of the vehicles approaching each
+      # stop group
+      backwards = [(0, -1), (1, 0), (0, 1), (-1, 0)]
+      lengths = []
+      for stop in sorted(self.stops(), key=lambda s: s.unique_id):
+         xmod, ymod = backwards[stop.stop_group]
+         x, y = stop.pos
+         length = 0
+         while length < max(self.width, self.height):
+            x, y = self.lanes.torus_adj((x + xmod, y + ymod))
+            if self.is_cell_empty((x, y)):
+               break
+            length += 1
+         lengths.append(length)
+      return lengths
+
+   def crosses_block(
+      self,
+      pos:     Tuple[int, int],
+      new_pos: Tuple[int, int]
+   ) -> bool:
+      '''Whether moving from `pos` to `new_pos`, before wrapping around
+      the grid, enters another block.
+      '''
+      return pos[0] // self.block_width != new_pos[0] // self.block_width or \
+             pos[1] // self.block_height != new_pos[1] // self.block_height
+
+   def stops(self) -> List[Stop]:
+      return [
+         stop
+         for intersection in self.intersections
+         for sg in intersection.stop_groups.values()
+         for stop in sg
+      ]
+
    def make_stops(self, avoid_deadlocks) -> None:
-      '''Creates all stops.
+      '''Creates all stops, eight for each intersection.
+      '''
+      for k, (center, intersection) in enumerate(zip(self.centers, self.intersections)):
+         self.make_intersection_stops(8 * k, center, intersection, avoid_deadlocks)
+
+   def make_intersection_stops(
+      self,
+      first_id:        int,
+      center:          Tuple[int, int],
+      intersection:    Intersection,
+      avoid_deadlocks: bool
+   ) -> None:
+      '''Creates the stops of the intersection at `center`.
       '''
 
       # Modifiers to obtain stop coordinates starting from the center
-      # of the grid
+      # of the intersection
       stop_modifiers = [
       #  right lane | left lane |  side
          (-1, -2),    ( 0, -2),  # top
@@ -118,19 +336,19 @@ class FourWayStop(Model):
       ]
 
       # Compute stop coordinates
-      stop_coords = [tuple(map(sum, zip(self.center, sm))) for sm in stop_modifiers]
+      stop_coords = [tuple(map(sum, zip(center, sm))) for sm in stop_modifiers]
 
       # Create the agents
       for i, sc in enumerate(stop_coords):
          stop_group = i // 2
-         agent = Stop(i, self, stop_group, i % 2, avoid_deadlocks)
-         self.stop_groups[stop_group].append(agent)
+         agent = Stop(first_id + i, self, stop_group, i % 2, avoid_deadlocks, intersection)
+         intersection.stop_groups[stop_group].append(agent)
          self.schedule.add(agent)
-         self.grid.place_agent(agent, sc)
+         self.place_agent(agent, sc)
 
       # Have the stops compute which other stops they need to
       # communicate with
-      for _, stop_group in self.stop_groups.items():
+      for _, stop_group in intersection.stop_groups.items():
          for stop in stop_group:
             stop.compute_stops_to_check()
 
@@ -140,22 +358,189 @@ class FourWayStop(Model):
       max_velocity:   int
    ) -> None:
       '''Spawns `n_vehicles` vehicles at the start of randomly chosen
-      lanes.
+      lanes, in randomly chosen blocks.
       '''
       n_lanes = 8
+      n_blocks = len(self.centers)
+      if self.backend == 'numpy':
+         from mas.agents.vehicle_array import VehicleArray
+         self.vehicles = VehicleArray(self.n_stops, self, n_vehicles, max_velocity)
+         self.schedule.add(self.vehicles)
       for i in range(n_vehicles):
-         lane = random.randrange(n_lanes)
-         coords, direction = self.get_coords(lane)
+         lane = self.random.randrange(n_lanes)
+         block = self.random.randrange(n_blocks) if n_blocks > 1 else 0
+         coords, direction = self.get_coords(lane, block)
+         if self.vehicles is not None:
+            self.vehicles.place(coords, direction, turn=lane % 2)
+         else:
+            agent = Vehicle(
+               self.n_stops + i,
+               self,
+               direction,
+               turn=lane % 2,
+               max_velocity=max_velocity
+            )
+            self.schedule.add(agent)
+            self.place_agent(agent, coords)
+            agent.new_pos = coords
+
+   def boundary_entries(self) -> List[Tuple[Tuple[int, int], Direction, bool]]:
+      '''Returns the lanes starting on the boundary of the grid, block
+      by block, as their first cell, direction and whether vehicles
+      there turn left.
+      '''
+      bx_max, by_max = self.blocks[0] - 1, self.blocks[1] - 1
+      entries = []
+      for block in range(len(self.centers)):
+         bx, by = block % self.blocks[0], block // self.blocks[0]
+         edges = [by == 0, bx == bx_max, by == by_max, bx == 0]
+         for lane in range(8):
+            if edges[lane // 2]:
+               coords, direction = self.lane_start(lane, block)
+               entries.append((coords, direction, bool(lane % 2)))
+      return entries
+
+   def in_grid(self, pos: Tuple[int, int]) -> bool:
+      return 0 <= pos[0] < self.width and 0 <= pos[1] < self.height
+
+   def cells_to_edge(
+      self,
+      pos:       Tuple[int, int],
+      modifiers: Tuple[int, int]
+   ) -> int:
+      '''Number of cells from `pos` to the edge of the grid, going
+      towards `modifiers`, a compass direction with velocity 1.
+      '''
+      xmod, ymod = modifiers
+      return self.width - 1 - pos[0]  if xmod > 0 else \
+             pos[0]                   if xmod < 0 else \
+             self.height - 1 - pos[1] if ymod > 0 else \
+             pos[1]
+
+   def spawn_vehicle(
+      self,
+      coords:    Tuple[int, int],
+      direction: Direction,
+      turn:      bool
+   ) -> None:
+      '''Adds a vehicle at rest, reusing one that has left the grid if
+      any, so that the scheduler and the `Vehicle` objects do not grow
+      with the number of arrivals.
+      '''
+      if self.vehicles is not None:
+         self.vehicles.spawn(coords, direction, turn)
+         return
+      if self.vehicle_pool:
+         agent = self.vehicle_pool.pop()
+         agent.direction.direction = direction.direction
+         agent.turn = turn
+         agent.velocity = 0
+         agent.intersection_step = -1
+      else:
          agent = Vehicle(
-            n_lanes + i,
+            self.n_stops + self.n_created,
             self,
-            direction,
-            turn=lane % 2,
-            max_velocity=max_velocity
+            Direction(direction.direction),
+            turn=turn,
+            max_velocity=self.max_velocity
          )
+         self.n_created += 1
          self.schedule.add(agent)
-         self.grid.place_agent(agent, coords)
+      self.place_agent(agent, coords)
+      agent.new_pos = coords
+
+   def n_live_vehicles(self) -> int:
+      '''Number of vehicles on the road, which changes every step with
+      open boundaries.
+      '''
+      if self.vehicles is not None:
+         return len(self.vehicles.live())
+      return self.n_created - len(self.vehicle_pool)
+
+   def remove_vehicle(self, agent: Vehicle) -> None:
+      '''Takes a vehicle that has left the grid off the road, and keeps
+      it for the next arrival. It stays in the schedule, doing nothing.
+      '''
+      self.lanes.remove(agent, agent.pos)
+      if self.grid is not None:
+         self.grid.remove_agent(agent)
+      agent.pos = None
+      agent.new_pos = None
+      self.vehicle_pool.append(agent)
+      self.exited += 1
+
+   def arrive(self) -> None:
+      '''Queues the vehicles arriving at each entry during this step,
+      and lets the first of each queue in if the entry is free.
+      '''
+      counts = self.arrivals.counts(self.schedule.steps, len(self.entries), self.random)
+      for i, (count, (coords, direction, turn)) in enumerate(zip(counts, self.entries)):
+         self.entry_queues[i] += count
+         if self.entry_queues[i] and self.is_cell_empty(coords):
+            self.spawn_vehicle(coords, direction, turn)
+            self.entry_queues[i] -= 1
+            self.arrived += 1
+
+   def resolve_deadlocks(self, intersections: List[Intersection]) -> None:
+      '''Runs the rule to avoid deadlocks, stop by stop, only at the
+      intersections where it lets one proceed.
+      '''
+      for intersection in intersections:
+         if intersection.deadlocked():
+            self.stats.resolved_deadlock()
+            for stop_group in intersection.stop_groups.values():
+               for stop in stop_group:
+                  stop.resolve_deadlock()
+
+   def avoid_deadlocks_step(self) -> None:
+      '''Called by the scheduler before the agents.
+      '''
+      if self.avoid_deadlocks:
+         self.resolve_deadlocks(self.intersections)
+
+   def set_profiler(self, profiler: Optional[Profiler]) -> None:
+      '''Starts recording the wall time of data collection, of each
+      stage of the scheduler and of each substep, or stops if
+      `profiler` is `None`.
+      '''
+      self.profiler = profiler
+      self.schedule.profiler = profiler
+
+   def collect(self) -> None:
+      if self.metrics is not None:
+         self.metrics.collect(self)
+      else:
+         self.datacollector.collect(self)
+      if self.trajectories is not None:
+         self.trajectories.record(self)
 
    def step(self) -> None:
-      self.datacollector.collect(self)
+      if self.profiler is not None:
+         self.profiled_step()
+         return
+      self.collect()
+      self.stats.start_step()
+      if self.arrivals is not None:
+         self.arrive()
       self.schedule.step()
+      if self.convergence is not None and self.convergence.update(self):
+         self.running = False
+
+   def profiled_step(self) -> None:
+      '''Same as `step()`, recording the whole step, data collection and
+      the convergence check. The scheduler records the stages.
+      '''
+      profiler = self.profiler
+      with profiler.span('step', self.n_live_vehicles()):
+         with profiler.span('collect'):
+            self.collect()
+         self.stats.start_step()
+         if self.arrivals is not None:
+            with profiler.span('arrivals', len(self.entries)):
+               self.arrive()
+         self.schedule.step()
+         if self.convergence is not None:
+            with profiler.span('convergence'):
+               converged = self.convergence.update(self)
+            if converged:
+               self.running = False
@@ -0,0 +1,49 @@
+from typing import Optional
+
+from mas.model import FourWayStop
+
+
+class RoadNetwork(FourWayStop):
+   '''Manhattan lattice of four-way stops. The grid is tiled with
+   `n_columns` by `n_rows` blocks, each one laid out as the single
+   intersection of `FourWayStop`, so that the roads of neighboring
+   blocks connect.
+
+   Vehicles follow the same rules as in `FourWayStop`, going through
+   one intersection after the other. Each time a vehicle enters a
+   block it decides whether it will turn left at its intersection, and
+   moves to the left lane if so.
+   '''
+
+   def __init__(
+      self,
+      n_vehicles:       int,
+      n_columns:        int,
+      n_rows:           int,
+      block_width:      int,
+      block_height:     int,
+      max_velocity:     int,
+      avoid_deadlocks:  bool,
+      turn_probability: Optional[float] = 0.25,
+      **kwargs
+   ) -> None:
+      '''
+      n_columns, n_rows:
+         Number of blocks, and so of intersections, along `x` and `y`.
+      block_width, block_height:
+         Size of each block, in cells.
+      turn_probability:
+         Probability that a vehicle turns left at each intersection.
+      kwargs:
+         Other parameters of `FourWayStop`.
+      '''
+      super().__init__(
+         n_vehicles,
+         width=n_columns * block_width,
+         height=n_rows * block_height,
+         max_velocity=max_velocity,
+         avoid_deadlocks=avoid_deadlocks,
+         blocks=(n_columns, n_rows),
+         turn_probability=turn_probability,
+         **kwargs
+      )
@@ -0,0 +1,168 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+from mesa import Agent
+
+
+class Lane:
+   '''Ring buffer with one slot per cell of a road line, wrapping around
+   the torus like the grid does.
+   '''
+
+   def __init__(self, length: int) -> None:
+      self.length = length
+      self.counts = [0] * length       # Number of vehicles in each cell
+      self.vehicles = [None] * length  # One of the vehicles in each cell
+      self.stops = [None] * length     # Stop in each cell, if any
+
+   def add(self, i: int, agent: Agent) -> None:
+      self.counts[i] += 1
+      self.vehicles[i] = agent
+
+   def remove(self, i: int, agent: Agent) -> None:
+      self.counts[i] -= 1
+      if self.counts[i] == 0:
+         self.vehicles[i] = None
+
+
+class LaneIndex:
+   '''Occupancy of the road, replacing the generic `MultiGrid` lookups.
+
+   Vehicles can only be on the three columns and the three rows of the
+   roads crossing at each intersection, so there is one `Lane` for each
+   of them. The cells of the intersections are in both a column and a
+   row, which are kept in sync through a small table. Cells off the road are only
+   stored in a dictionary, should a vehicle ever end up there.
+
+   As in `MultiGrid`, stops come before vehicles in a cell.
+   '''
+
+   def __init__(
+      self,
+      width:   int,
+      height:  int,
+      centers: Iterable[Tuple[int, int]]
+   ) -> None:
+      '''
+      centers:
+         Centers of the intersections.
+      '''
+      self.width = width
+      self.height = height
+      self.columns: Dict[int, Lane] = {}
+      self.rows: Dict[int, Lane] = {}
+      for cx, cy in centers:
+         for x in (cx - 1, cx, cx + 1):
+            self.columns.setdefault(x, Lane(height))
+         for y in (cy - 1, cy, cy + 1):
+            self.rows.setdefault(y, Lane(width))
+
+      # Intersection cells, with the row they also belong to
+      self.intersection = {
+         (x, y): self.rows[y] for x in self.columns for y in self.rows
+      }
+      self.off_road: Dict[Tuple[int, int], Lane] = {}
+
+   def torus_adj(self, pos: Tuple[int, int]) -> Tuple[int, int]:
+      return pos[0] % self.width, pos[1] % self.height
+
+   def _lane(
+      self,
+      pos:    Tuple[int, int],
+      create: bool = False
+   ) -> Tuple[Optional[Lane], int]:
+      '''Returns the lane the cell is stored in, and its index there.
+      Cells off the road have a lane of their own, only created when
+      `create` is set.
+      '''
+      x, y = pos
+      lane = self.columns.get(x)
+      if lane is not None:
+         return lane, y
+      lane = self.rows.get(y)
+      if lane is not None:
+         return lane, x
+      lane = self.off_road.get(pos)
+      if lane is None and create:
+         lane = self.off_road[pos] = Lane(1)
+      return lane, 0
+
+   def place_stop(self, stop: Agent, pos: Tuple[int, int]) -> None:
+      lane, i = self._lane(pos, create=True)
+      lane.stops[i] = stop
+      row = self.intersection.get(pos)
+      if row is not None:
+         row.stops[pos[0]] = stop
+
+   def place(self, agent: Agent, pos: Tuple[int, int]) -> None:
+      lane, i = self._lane(pos, create=True)
+      lane.add(i, agent)
+      row = self.intersection.get(pos)
+      if row is not None:
+         row.add(pos[0], agent)
+
+   def remove(self, agent: Agent, pos: Tuple[int, int]) -> None:
+      lane, i = self._lane(pos)
+      lane.remove(i, agent)
+      row = self.intersection.get(pos)
+      if row is not None:
+         row.remove(pos[0], agent)
+
+   def move(
+      self,
+      agent:   Agent,
+      old_pos: Tuple[int, int],
+      new_pos: Tuple[int, int]
+   ) -> None:
+      self.remove(agent, old_pos)
+      self.place(agent, new_pos)
+
+   def get(self, pos: Tuple[int, int]) -> Optional[Agent]:
+      '''Returns the agent `MultiGrid` would list first in the cell, if
+      any.
+      '''
+      lane, i = self._lane(pos)
+      if lane is None:
+         return None
+      stop = lane.stops[i]
+      return stop if stop is not None else lane.vehicles[i]
+
+   def is_cell_empty(self, pos: Tuple[int, int]) -> bool:
+      return self.get(pos) is None
+
+   def find_ahead(
+      self,
+      pos:          Tuple[int, int],
+      modifiers:    Tuple[int, int],
+      max_distance: int
+   ) -> Tuple[int, Optional[Agent]]:
+      '''Returns the distance to the closest agent towards `modifiers`,
+      which has to be a compass direction with velocity 1, and the agent
+      itself. If there is none up to `max_distance` cells away, returns
+      `max_distance + 1` and `None`.
+      '''
+      x, y = pos
+      xmod, ymod = modifiers
+      if xmod == 0 and x in self.columns:
+         lane, i, step = self.columns[x], y, ymod
+      elif ymod == 0 and y in self.rows:
+         lane, i, step = self.rows[y], x, xmod
+      else:
+         lane = None
+
+      # Off the road, or moving diagonally
+      if lane is None:
+         for distance in range(1, max_distance + 1):
+            agent = self.get(self.torus_adj((x + distance * xmod, y + distance * ymod)))
+            if agent is not None:
+               return distance, agent
+         return max_distance + 1, None
+
+      stops, counts, vehicles, length = \
+         lane.stops, lane.counts, lane.vehicles, lane.length
+      for distance in range(1, max_distance + 1):
+         i = (i + step) % length
+         if stops[i] is not None:
+            return distance, stops[i]
+         if counts[i]:
+            return distance, vehicles[i]
+      return max_distance + 1, None
@@ -0,0 +1,364 @@
+'''Multi-core stepping of large road networks.
+
+The blocks of a `RoadNetwork` are split into horizontal bands, one for
+each worker process. Every worker owns the stops of its blocks and the
+vehicles currently in them. Vehicle state and the occupancy of the
+cells live in shared memory, so that vehicles can look ahead across a
+boundary, and vehicles crossing one are handed off to the neighboring
+worker. Workers wait for each other at a barrier between stages.
+
+Intersections are independent of each other, and route decisions do not
+depend on the order of the vehicles, so the result is the same as the
+serial run with the NumPy backend.
+'''
+import multiprocessing as mp
+import random
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from mas.network import RoadNetwork
+from mas.statistics import StopStatistics
+
+
+# Vehicle arrays shared among the workers
+shared_arrays = [
+   'x',
+   'y',
+   'new_x',
+   'new_y',
+   'direction',
+   'turn',
+   'velocity',
+   'intersection_step',
+   'blocks_entered'
+]
+
+
+def split_bands(n_rows: int, n_workers: int) -> List[range]:
+   '''Splits the rows of blocks in `n_workers` contiguous bands of
+   nearly equal size.
+   '''
+   bounds = [round(i * n_rows / n_workers) for i in range(n_workers + 1)]
+   return [range(bounds[i], bounds[i + 1]) for i in range(n_workers)]
+
+
+class RecordingStatistics(StopStatistics):
+   '''Statistics of the stops of a worker, also recording when vehicles
+   are given right of way, so that wait time quantiles can be computed
+   in the same order as in the serial run.
+   '''
+
+   def __init__(self, n_stops: int) -> None:
+      super().__init__(n_stops, quantiles=())
+      self.step = 0
+      self.stage = 0
+      self.events: List[Tuple[int, int, int, int]] = []
+
+   def proceeded(self, stop) -> None:
+      super().proceeded(stop)
+      self.events.append((self.step, self.stage, stop.unique_id, stop.wait_time))
+
+
+class Worker:
+   '''Steps a band of blocks. Runs in its own process.
+   '''
+
+   def __init__(
+      self,
+      rank:          int,
+      bands:         List[range],
+      model_kwargs:  dict,
+      shared_names:  Dict[str, str],
+      n_vehicles:    int,
+      barrier
+   ) -> None:
+      # Same initial state as all other workers and the parent
+      self.model = RoadNetwork(**model_kwargs)
+      self.vehicles = self.model.vehicles
+      self.barrier = barrier
+      self.rank = rank
+      self.n_workers = len(bands)
+      self.model.stats = RecordingStatistics(self.model.n_stops)
+
+      # Attach to shared memory
+      self.shared_memory = []
+      occupancy_shape = self.vehicles.occupancy.shape
+      for name in shared_arrays + ['occupancy']:
+         shm = SharedMemory(name=shared_names[name])
+         self.shared_memory.append(shm)
+         template = getattr(self.vehicles, name)
+         shape = occupancy_shape if name == 'occupancy' else (n_vehicles,)
+         setattr(self.vehicles, name, np.ndarray(shape, dtype=template.dtype, buffer=shm.buf))
+      self.outbox_counts = self.attach(shared_names['outbox_counts'], (self.n_workers, self.n_workers))
+      self.outboxes = self.attach(shared_names['outboxes'], (self.n_workers, self.n_workers, n_vehicles))
+
+      # Band of each row of blocks, and region owned by this worker
+      self.band_of_row = np.zeros(self.model.blocks[1], dtype=np.intp)
+      for r, band in enumerate(bands):
+         self.band_of_row[band.start:band.stop] = r
+      blocks_x = self.model.blocks[0]
+      self.stops = [
+         stop
+         for by in bands[rank]
+         for k in range(by * blocks_x, (by + 1) * blocks_x)
+         for sg in self.model.intersections[k].stop_groups.values()
+         for stop in sg
+      ]
+      self.stops.sort(key=lambda s: s.unique_id)
+      self.intersections = [
+         self.model.intersections[k]
+         for by in bands[rank]
+         for k in range(by * blocks_x, (by + 1) * blocks_x)
+      ]
+      n = self.vehicles.n
+      self.vehicles.owned = np.flatnonzero(self.band(self.vehicles.y[:n]) == rank)
+
+   def attach(self, name: str, shape: Tuple[int, ...]) -> np.ndarray:
+      shm = SharedMemory(name=name)
+      self.shared_memory.append(shm)
+      return np.ndarray(shape, dtype=np.intp, buffer=shm.buf)
+
+   def band(self, y: np.ndarray) -> np.ndarray:
+      return self.band_of_row[y // self.model.block_height]
+
+   def step(self) -> None:
+      vehicles = self.vehicles
+      stats = self.model.stats
+      stats.start_step()
+
+      # Moving vehicles read the occupancy of neighboring bands, which
+      # must not change in the meantime
+      vehicles.move_vehicles_step()
+      self.barrier.wait()
+
+      # Hand off the vehicles leaving the band. Each worker only writes
+      # the occupancy of its own band: first leaving the old cells...
+      owned = vehicles.owned
+      np.subtract.at(vehicles.occupancy, (vehicles.x[owned], vehicles.y[owned]), 1)
+      vehicles.x[owned] = vehicles.new_x[owned]
+      vehicles.y[owned] = vehicles.new_y[owned]
+      band = self.band(vehicles.y[owned])
+      staying = owned[band == self.rank]
+      for r in range(self.n_workers):
+         if r != self.rank:
+            leaving = owned[band == r]
+            self.outboxes[self.rank, r, :len(leaving)] = leaving
+            self.outbox_counts[self.rank, r] = len(leaving)
+      self.barrier.wait()
+
+      # ...then entering the new ones
+      incoming = [staying] + [
+         self.outboxes[r, self.rank, :self.outbox_counts[r, self.rank]].copy()
+         for r in range(self.n_workers) if r != self.rank
+      ]
+      owned = np.sort(np.concatenate(incoming))
+      np.add.at(vehicles.occupancy, (vehicles.x[owned], vehicles.y[owned]), 1)
+      vehicles.owned = owned
+
+      # Intersections only involve their own stops and vehicles
+      stats.stage = 0
+      for stop in self.stops:
+         stop.right_of_way_step()
+
+      # A vehicle crossing an intersection next to the boundary may have
+      # been handed off to the neighboring worker, so all stops check
+      # their vehicle before any vehicle moves, as in the serial run
+      self.barrier.wait()
+      vehicles.right_of_way_advance()
+      stats.stage = 1
+      if self.model.avoid_deadlocks:
+         self.model.resolve_deadlocks(self.intersections)
+      vehicles.avoid_deadlocks_advance()
+
+      stats.step += 1
+      self.model.schedule.steps += 1
+      self.barrier.wait()
+
+   def report(self) -> dict:
+      '''Statistics collected since the last report, and the current
+      status of the stops.
+      '''
+      stats = self.model.stats
+      report = {
+         'events': stats.events,
+         'total_wait_time': stats.total_wait_time,
+         'stops_waiting': stats.stops_waiting,
+         'cleared': stats.cleared,
+         'deadlocks': stats.deadlocks,
+         'cleared_this_step': stats.cleared_this_step,
+         'statuses': [(s.unique_id, s.status, s.wait_time) for s in self.stops]
+      }
+      stats.events = []
+      return report
+
+   def close(self) -> None:
+      for shm in self.shared_memory:
+         shm.close()
+
+
+def worker_main(conn, *args) -> None:
+   worker = Worker(*args)
+   try:
+      while True:
+         command, arg = conn.recv()
+         if command == 'run':
+            for _ in range(arg):
+               worker.step()
+            conn.send(worker.report())
+         elif command == 'close':
+            break
+   finally:
+      worker.close()
+      conn.close()
+
+
+class ParallelRoadNetwork:
+   '''Runs a `RoadNetwork` with the NumPy backend on `n_workers`
+   processes. Vehicle positions can be read at any time from
+   `vehicles`, statistics and stop statuses are gathered after each
+   call to `run()`.
+   '''
+
+   def __init__(
+      self,
+      n_workers:  int,
+      seed:       Optional[int] = None,
+      start_method: Optional[str] = None,
+      **kwargs
+   ) -> None:
+      '''
+      n_workers:
+         Number of worker processes, at most the number of rows of
+         blocks.
+      seed:
+         Seed of the model. All workers build the same initial state from
+         it, so one is drawn if not given.
+      start_method:
+         `multiprocessing` start method, the platform default if `None`.
+      kwargs:
+         Parameters of `RoadNetwork`, except the backend, the arrivals,
+         as the grid is always a torus, and the trajectories, which can
+         be recorded from `model` between runs. Blocks must be at least
+         7 cells high to be split among several workers.
+      '''
+      if kwargs.get('arrivals') is not None:
+         raise ValueError('Open boundaries are not supported by parallel runs')
+      if kwargs.get('trajectories') is not None:
+         raise ValueError('Trajectories are not recorded by parallel runs')
+      if seed is None:
+         seed = random.SystemRandom().getrandbits(63)
+      model_kwargs = dict(kwargs, seed=seed, backend='numpy', mirror_grid=False)
+      self.model = RoadNetwork(**model_kwargs)
+      n_rows = self.model.blocks[1]
+      if not 1 <= n_workers <= n_rows:
+         raise ValueError(f'Number of workers must be between 1 and {n_rows}')
+
+      # Vehicles are owned by the band of their row, and those about to
+      # reach a stop must be owned by the worker of its intersection, so
+      # the rows from the cell before the top stops to the cell before
+      # the bottom ones, three on each side of the center, must be in
+      # the block
+      block_height = self.model.block_height
+      if n_workers > 1 and block_height // 2 + 3 >= block_height:
+         raise ValueError(f'Blocks must be at least 7 cells high for parallel runs, not {block_height}')
+      self.n_workers = n_workers
+      self.bands = split_bands(n_rows, n_workers)
+      self.stats = self.model.stats
+      self.steps = 0
+
+      # Move the state to shared memory
+      vehicles = self.model.vehicles
+      n = vehicles.n
+      self.shared_memory = []
+      shared_names = {}
+      for name in shared_arrays + ['occupancy']:
+         array = getattr(vehicles, name)
+         array = array if name == 'occupancy' else array[:n]
+         shared = self.share(name, array.shape, array.dtype, shared_names)
+         shared[...] = array
+         setattr(vehicles, name, shared)
+      self.share('outbox_counts', (n_workers, n_workers), np.intp, shared_names)
+      self.share('outboxes', (n_workers, n_workers, max(n, 1)), np.intp, shared_names)
+      self.vehicles = vehicles
+
+      ctx = mp.get_context(start_method)
+      barrier = ctx.Barrier(n_workers)
+      self.connections = []
+      self.processes = []
+      for rank in range(n_workers):
+         parent_conn, child_conn = ctx.Pipe()
+         process = ctx.Process(
+            target=worker_main,
+            args=(child_conn, rank, self.bands, model_kwargs, shared_names, max(n, 1), barrier),
+            daemon=True
+         )
+         process.start()
+         self.connections.append(parent_conn)
+         self.processes.append(process)
+
+   def share(
+      self,
+      name:         str,
+      shape:        Tuple[int, ...],
+      dtype:        np.dtype,
+      shared_names: Dict[str, str]
+   ) -> np.ndarray:
+      size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+      shm = SharedMemory(create=True, size=size)
+      self.shared_memory.append(shm)
+      shared_names[name] = shm.name
+      return np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+   def __enter__(self) -> 'ParallelRoadNetwork':
+      return self
+
+   def __exit__(self, *exc_info) -> None:
+      self.close()
+
+   def run(self, n_steps: int) -> None:
+      '''Advances all workers by `n_steps` steps, then gathers their
+      statistics.
+      '''
+      for conn in self.connections:
+         conn.send(('run', n_steps))
+      reports = [conn.recv() for conn in self.connections]
+      self.steps += n_steps
+      self.model.schedule.steps = self.steps
+
+      # Replay the stops giving right of way in the serial order
+      events = sorted(e for report in reports for e in report['events'])
+      for _, _, unique_id, wait_time in events:
+         self.stats.throughput[unique_id] += 1
+         for quantile in self.stats.quantiles.values():
+            quantile.add(wait_time)
+      self.stats.total_wait_time = sum(r['total_wait_time'] for r in reports)
+      self.stats.stops_waiting = sum(r['stops_waiting'] for r in reports)
+      self.stats.cleared = sum(r['cleared'] for r in reports)
+      self.stats.deadlocks = sum(r['deadlocks'] for r in reports)
+      self.stats.cleared_this_step = sum(r['cleared_this_step'] for r in reports)
+
+      # Mirror the stops on the parent model
+      stops = {stop.unique_id: stop for stop in self.model.stops()}
+      for report in reports:
+         for unique_id, status, wait_time in report['statuses']:
+            stops[unique_id].wait_time = wait_time
+            stops[unique_id].set_status(status)
+
+   def step(self) -> None:
+      self.run(1)
+
+   def close(self) -> None:
+      for conn in self.connections:
+         conn.send(('close', None))
+      for process in self.processes:
+         process.join()
+      for conn in self.connections:
+         conn.close()
+      self.connections = []
+      self.processes = []
+      for shm in self.shared_memory:
+         shm.close()
+         shm.unlink()
+      self.shared_memory = []
@@ -0,0 +1,354 @@
+'''Instrumentation of the model, to find out which stage makes a run
+slow.
+
+A `Profiler` attached to a model records the wall time, the number of
+calls and the agents touched by each stage of the scheduler and each of
+its substeps, and by data collection, see `FourWayStop.set_profiler()`.
+Without one, the model only pays for a single check per step. Totals
+are shown live by the server with `vis.profile_summary`, and the last
+spans can be exported as a Chrome trace, to open in `chrome://tracing`
+or Perfetto, or as a speedscope profile.
+
+For headless runs, a `SamplingProfiler` periodically records the call
+stack of the thread running the model, down to the Python functions
+inside each stage, and exports it for speedscope or as folded stacks
+for flame graph tools.
+
+Usage:
+   python -m mas.profiling --n-vehicles 20 --steps 2000 \
+      --trace trace.json --speedscope stages.speedscope.json \
+      --samples samples.speedscope.json
+'''
+import argparse
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+speedscope_schema = 'https://www.speedscope.app/file-format-schema.json'
+
+
+class Profiler:
+   '''Running totals of the time spent in each named span, and the most
+   recent spans for the trace exports.
+   '''
+
+   def __init__(self, max_spans: Optional[int] = 100000) -> None:
+      '''
+      max_spans:
+         Number of spans kept for the exports, the oldest being dropped
+         first. All of them if `None`.
+      '''
+      self.clock = time.perf_counter
+      self.origin = self.clock()
+      self.totals: Dict[str, float] = collections.defaultdict(float)
+      self.calls: Dict[str, int] = collections.defaultdict(int)
+      self.agents: Dict[str, int] = collections.defaultdict(int)
+      self.spans: Deque[Tuple[str, float, float]] = collections.deque(maxlen=max_spans)
+
+   def record(
+      self,
+      name:   str,
+      start:  float,
+      end:    float,
+      agents: int = 0
+   ) -> None:
+      '''Adds a span, with times given by `clock`.
+
+      agents:
+         Number of agents touched.
+      '''
+      self.totals[name] += end - start
+      self.calls[name] += 1
+      self.agents[name] += agents
+      self.spans.append((name, start, end))
+
+   @contextmanager
+   def span(self, name: str, agents: int = 0) -> Iterator[None]:
+      start = self.clock()
+      try:
+         yield
+      finally:
+         self.record(name, start, self.clock(), agents)
+
+   def reset(self) -> None:
+      self.totals.clear()
+      self.calls.clear()
+      self.agents.clear()
+      self.spans.clear()
+
+   def summary(self) -> List[dict]:
+      '''Returns one row for each span name, by decreasing total time,
+      with the share of the time of the whole step.
+      '''
+      step = self.totals.get('step') or sum(self.totals.values()) or 1.0
+      rows = []
+      for name, total in sorted(self.totals.items(), key=lambda kv: -kv[1]):
+         calls = self.calls[name]
+         rows.append({
+            'name': name,
+            'calls': calls,
+            'total': total,
+            'mean': total / calls,
+            'share': total / step,
+            'agents': self.agents[name] / calls
+         })
+      return rows
+
+   def format_summary(self) -> str:
+      lines = [f'{"span":<26} {"calls":>8} {"total s":>10} {"mean ms":>10} {"share":>7} {"agents":>8}']
+      for row in self.summary():
+         lines.append(
+            f'{row["name"]:<26} {row["calls"]:>8} {row["total"]:>10.4f} '
+            f'{1000 * row["mean"]:>10.4f} {row["share"]:>7.1%} {row["agents"]:>8.1f}'
+         )
+      return '\n'.join(lines)
+
+   def chrome_trace(self) -> dict:
+      '''Returns the spans in the Chrome trace event format, as complete
+      events in microseconds.
+      '''
+      pid = os.getpid()
+      events = [
+         {
+            'name': name,
+            'cat': 'model',
+            'ph': 'X',
+            'ts': 1e6 * (start - self.origin),
+            'dur': 1e6 * (end - start),
+            'pid': pid,
+            'tid': 0
+         }
+         for name, start, end in self.spans
+      ]
+      return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+   def speedscope(self, name: str = 'Model stages') -> dict:
+      '''Returns the spans as an evented speedscope profile. Spans are
+      nested by time, a stage inside its step, a substep inside its
+      stage.
+      '''
+      frames: Dict[str, int] = {}
+      events = []
+      open_spans: List[Tuple[int, float]] = []
+
+      def close_until(t: float) -> None:
+         while open_spans and open_spans[-1][1] <= t:
+            frame, end = open_spans.pop()
+            events.append({'type': 'C', 'frame': frame, 'at': end})
+
+      spans = sorted(self.spans, key=lambda s: (s[1], -s[2]))
+      for span_name, start, end in spans:
+         start, end = start - self.origin, end - self.origin
+         close_until(start)
+         # Spans dropped from the deque can leave a child overlapping
+         # the end of its parent, which is cut to fit
+         if open_spans:
+            end = min(end, open_spans[-1][1])
+         frame = frames.setdefault(span_name, len(frames))
+         events.append({'type': 'O', 'frame': frame, 'at': start})
+         open_spans.append((frame, end))
+      close_until(float('inf'))
+
+      return {
+         '$schema': speedscope_schema,
+         'shared': {'frames': [{'name': n} for n in frames]},
+         'profiles': [{
+            'type': 'evented',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': events[0]['at'] if events else 0.0,
+            'endValue': events[-1]['at'] if events else 0.0,
+            'events': events
+         }],
+         'exporter': 'mas.profiling'
+      }
+
+   def save_chrome_trace(self, path: str) -> None:
+      with open(path, 'w') as f:
+         json.dump(self.chrome_trace(), f)
+
+   def save_speedscope(self, path: str) -> None:
+      with open(path, 'w') as f:
+         json.dump(self.speedscope(), f)
+
+
+class SamplingProfiler:
+   '''Samples the call stack of a thread at regular intervals from a
+   background thread. Unlike `Profiler`, it sees every Python function
+   called within the stages, at the cost of the sampling itself.
+
+   Use it as a context manager around the run.
+   '''
+
+   def __init__(
+      self,
+      interval:  float         = 0.001,
+      thread_id: Optional[int] = None
+   ) -> None:
+      '''
+      interval:
+         Seconds between two samples.
+      thread_id:
+         Identifier of the thread to sample, the one creating the
+         profiler by default.
+      '''
+      self.interval = interval
+      self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+      self.counts: Dict[Tuple[Tuple[str, str, int], ...], int] = collections.Counter()
+      self.n_samples = 0
+      self.stopped = threading.Event()
+      self.thread: Optional[threading.Thread] = None
+
+   def __enter__(self) -> 'SamplingProfiler':
+      self.start()
+      return self
+
+   def __exit__(self, *exc_info) -> None:
+      self.stop()
+
+   def start(self) -> None:
+      self.stopped.clear()
+      self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+      self.thread.start()
+
+   def stop(self) -> None:
+      self.stopped.set()
+      if self.thread is not None:
+         self.thread.join()
+         self.thread = None
+
+   def run(self) -> None:
+      while not self.stopped.wait(self.interval):
+         frame = sys._current_frames().get(self.thread_id)
+         if frame is None:
+            continue
+         stack = []
+         while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+         self.counts[tuple(reversed(stack))] += 1
+         self.n_samples += 1
+
+   def folded(self) -> str:
+      '''Returns the samples as folded stacks, one line per distinct
+      stack with its count, as read by `flamegraph.pl` and speedscope.
+      '''
+      lines = []
+      for stack, count in self.counts.items():
+         names = ';'.join(f'{name} ({os.path.basename(file)}:{line})' for name, file, line in stack)
+         lines.append(f'{names} {count}')
+      return '\n'.join(lines)
+
+   def speedscope(self, name: str = 'Samples') -> dict:
+      '''Returns the samples as a sampled speedscope profile, each one
+      weighted by the sampling interval.
+      '''
+      frames: Dict[Tuple[str, str, int], int] = {}
+      samples = []
+      weights = []
+      for stack, count in self.counts.items():
+         samples.append([frames.setdefault(f, len(frames)) for f in stack])
+         weights.append(count * self.interval)
+      return {
+         '$schema': speedscope_schema,
+         'shared': {'frames': [
+            {'name': name, 'file': file, 'line': line}
+            for name, file, line in frames
+         ]},
+         'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': 0.0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights
+         }],
+         'exporter': 'mas.profiling'
+      }
+
+   def save_speedscope(self, path: str) -> None:
+      with open(path, 'w') as f:
+         json.dump(self.speedscope(), f)
+
+   def save_folded(self, path: str) -> None:
+      with open(path, 'w') as f:
+         f.write(self.folded() + '\n')
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+   parser = argparse.ArgumentParser(
+      prog='python -m mas.profiling',
+      description='Profile a headless run of the four-way stop model.'
+   )
+   parser.add_argument('--n-vehicles', type=int, default=10)
+   parser.add_argument('--width', type=int, default=40)
+   parser.add_argument('--height', type=int, default=None,
+                       help='Defaults to --width')
+   parser.add_argument('--max-velocity', type=int, default=5)
+   parser.add_argument('--no-avoid-deadlocks', dest='avoid_deadlocks', action='store_false')
+   parser.add_argument('--backend', choices=['agents', 'numpy'], default='agents')
+   parser.add_argument('--seed', type=int, default=0)
+   parser.add_argument('--steps', type=int, default=1000)
+   parser.add_argument('--trace', default=None,
+                       help='Chrome trace of the stages to write')
+   parser.add_argument('--speedscope', default=None,
+                       help='Speedscope profile of the stages to write')
+   parser.add_argument('--max-spans', type=int, default=100000,
+                       help='Only export this many of the most recent spans')
+   parser.add_argument('--samples', default=None,
+                       help='Also sample the call stack, and write a speedscope profile, '
+                            'or folded stacks if the name ends with .txt')
+   parser.add_argument('--interval', type=float, default=0.001,
+                       help='Seconds between two samples')
+   return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+   from mas.model import FourWayStop
+
+   args = parse_args(argv)
+   profiler = Profiler(max_spans=args.max_spans if args.trace or args.speedscope else 0)
+   model = FourWayStop(
+      n_vehicles=args.n_vehicles,
+      width=args.width,
+      height=args.height if args.height is not None else args.width,
+      max_velocity=args.max_velocity,
+      avoid_deadlocks=args.avoid_deadlocks,
+      backend=args.backend,
+      seed=args.seed,
+      mirror_grid=False,
+      profiler=profiler
+   )
+
+   sampler = SamplingProfiler(args.interval) if args.samples is not None else None
+   if sampler is not None:
+      sampler.start()
+   try:
+      for _ in range(args.steps):
+         model.step()
+   finally:
+      if sampler is not None:
+         sampler.stop()
+
+   print(profiler.format_summary())
+   if args.trace is not None:
+      profiler.save_chrome_trace(args.trace)
+   if args.speedscope is not None:
+      profiler.save_speedscope(args.speedscope)
+   if sampler is not None:
+      if args.samples.endswith('.txt'):
+         sampler.save_folded(args.samples)
+      else:
+         sampler.save_speedscope(args.samples)
+
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,77 @@
+'''Seeds for independent replicates. Child seeds are spawned from a
+root seed as with NumPy's `SeedSequence`, so that the streams of the
+replicates are independent of each other, and the `i`-th child of a root
+seed is always the same, however many children are spawned. A sweep
+can then be split across processes or machines and still give the same
+results.
+'''
+from typing import TYPE_CHECKING, List, Union
+
+# NumPy is imported by the functions on arrays, so that vehicle agents,
+# which only draw single numbers, do not load it
+if TYPE_CHECKING:
+   import numpy as np
+
+
+_mask = (1 << 64) - 1
+
+
+def spawn_seeds(seed: int, n: int) -> List[int]:
+   '''Returns `n` child seeds of the root `seed`, to be used as the
+   `seed` of `FourWayStop`.
+   '''
+   import numpy as np
+
+   children = np.random.SeedSequence(seed).spawn(n)
+   return [int(c.generate_state(1, dtype=np.uint64)[0]) for c in children]
+
+
+def replicate_seed(seed: int, replicate: int) -> int:
+   '''Returns the child seed of a single replicate, same as
+   `spawn_seeds(seed, replicate + 1)[replicate]`.
+   '''
+   import numpy as np
+
+   child = np.random.SeedSequence(seed, spawn_key=(replicate,))
+   return int(child.generate_state(1, dtype=np.uint64)[0])
+
+
+def _splitmix64(z: Union[int, 'np.ndarray']) -> Union[int, 'np.ndarray']:
+   '''SplitMix64 finalizer, on Python integers or `uint64` arrays.
+   '''
+   if isinstance(z, int):
+      z = (z + 0x9E3779B97F4A7C15) & _mask
+      z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _mask
+      z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _mask
+      return z ^ (z >> 31)
+   import numpy as np
+
+   z = z + np.uint64(0x9E3779B97F4A7C15)
+   z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+   z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+   return z ^ (z >> np.uint64(31))
+
+
+def counter_uniform(key: int, stream: int, counter: int) -> float:
+   '''Counter-based uniform number in [0, 1): the same `key`, `stream`
+   and `counter` always give the same number, whatever the order in
+   which numbers are drawn. Used where draws have to be the same in
+   serial and parallel runs.
+   '''
+   z = _splitmix64(key ^ ((stream << 32) | counter))
+   return (z >> 11) * 2.0 ** -53
+
+
+def counter_uniforms(
+   key:      Union[int, 'np.ndarray'],
+   streams:  'np.ndarray',
+   counters: 'np.ndarray'
+) -> 'np.ndarray':
+   '''Vectorized `counter_uniform`. The `key` is either shared by all
+   draws, or a `uint64` array with one for each.
+   '''
+   import numpy as np
+
+   z = (streams.astype(np.uint64) << np.uint64(32)) | counters.astype(np.uint64)
+   z = _splitmix64(np.uint64(key) ^ z)
+   return (z >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
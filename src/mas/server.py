@@ -1,14 +1,35 @@
-from mesa.visualization.ModularVisualization import ModularServer
+from functools import partial
+
+from mesa import Model
 from mesa.visualization.UserParam import UserSettableParameter
 
-from mas.model import FourWayStop
+from mas.metrics import RecentSink
+from mas.model import FourWayStop, model_reporters
+from vis.background_server import BackgroundModularServer
+from vis.binary_server import BinaryModularServer
 from vis.canvas.grid_visualization import CanvasGridVisualization
 from vis.chart.chart_visualization import ChartVisualization
+from vis.profile_summary import ProfileSummary
 
 
 grid_width = 40
 grid_height = 40
 
+# Steps of metrics kept for the charts
+history = 10000
+
+
+class LiveFourWayStop(FourWayStop):
+   '''Four-way stop model. The vehicles abide to the rules, by giving
+   right of way when necessary.
+   '''
+
+   def __init__(self, **kwargs) -> None:
+      # Only the last metrics are kept, so that the server can run for
+      # hours
+      super().__init__(metrics=RecentSink(model_reporters, history), **kwargs)
+
+
 canvas = CanvasGridVisualization(
    canvas_width=500,
    canvas_height=500,
@@ -17,39 +38,80 @@ canvas = CanvasGridVisualization(
 )
 
 chart = ChartVisualization(
-   chart_title='Average wait time',
+   chart_title='Wait time',
    canvas_width=200,
    canvas_height=50,
-   data_collector_name='datacollector'
+   series={
+      'Average': 'Average wait time',
+      'p95': 'Wait time p95'
+   }
 )
 
-server = ModularServer(
-   model_cls=FourWayStop,
-   visualization_elements=[canvas, chart],
-   name='Four-way stop',
-   model_params={
-      'n_vehicles': UserSettableParameter(
-         param_type='slider',
-         name='Number of vehicles',
-         value=10,
-         min_value=1,
-         max_value=20,
-         step=1
-      ),
-      'width': grid_width,
-      'height': grid_height,
-      'max_velocity': UserSettableParameter(
-         param_type='slider',
-         name='Max velocity',
-         value=5,
-         min_value=1,
-         max_value=10,
-         step=1
-      ),
-      'avoid_deadlocks': UserSettableParameter(
-         param_type='checkbox',
-         name='Avoid deadlocks',
-         value=True
-      )
-   }
+throughput_chart = ChartVisualization(
+   chart_title='Throughput',
+   canvas_width=200,
+   canvas_height=50
 )
+
+
+def stop_wait_time(model: Model, unique_id: int) -> int:
+   return next(s.wait_time for s in model.stops() if s.unique_id == unique_id)
+
+
+# Only sampled once per frame
+stop_chart = ChartVisualization(
+   chart_title='Wait time by stop',
+   canvas_width=200,
+   canvas_height=50,
+   series={f'Stop {i}': partial(stop_wait_time, unique_id=i) for i in range(8)}
+)
+
+model_params = {
+   'n_vehicles': UserSettableParameter(
+      param_type='slider',
+      name='Number of vehicles',
+      value=10,
+      min_value=1,
+      max_value=20,
+      step=1
+   ),
+   'width': grid_width,
+   'height': grid_height,
+   'max_velocity': UserSettableParameter(
+      param_type='slider',
+      name='Max velocity',
+      value=5,
+      min_value=1,
+      max_value=10,
+      step=1
+   ),
+   'avoid_deadlocks': UserSettableParameter(
+      param_type='checkbox',
+      name='Avoid deadlocks',
+      value=True
+   )
+}
+
+
+def make_server(
+   background: bool = False,
+   profile:    bool = False
+) -> BinaryModularServer:
+   '''
+   background:
+      Step the model continuously in a background thread, the browser
+      only samples frames. See `BackgroundModularServer`.
+   profile:
+      Profile the model, and show the time spent in each stage below
+      the charts.
+   '''
+   server_cls = BackgroundModularServer if background else BinaryModularServer
+   elements = [canvas, chart, throughput_chart, stop_chart]
+   if profile:
+      elements.append(ProfileSummary())
+   return server_cls(
+      model_cls=LiveFourWayStop,
+      visualization_elements=elements,
+      name='Four-way stop',
+      model_params=model_params
+   )
@@ -0,0 +1,152 @@
+'''Running statistics of the intersection. They are updated by the stops
+on each status transition, so that reading them costs nothing, however
+many steps or vehicles there are.
+'''
+from typing import Dict, List, Sequence
+
+from mesa import Agent
+
+
+class P2Quantile:
+   '''Streaming estimate of a quantile in constant memory, with the P²
+   algorithm by Jain and Chlamtac.
+   '''
+
+   def __init__(self, p: float) -> None:
+      '''
+      p:
+         Quantile to estimate, between 0 and 1.
+      '''
+      self.p = p
+      self.count = 0
+      self.heights: List[float] = []
+      self.positions = [1, 2, 3, 4, 5]
+      self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+      self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+   def add(self, x: float) -> None:
+      self.count += 1
+      q, n = self.heights, self.positions
+
+      # The first five observations are kept as they are
+      if self.count <= 5:
+         q.append(x)
+         q.sort()
+         return
+
+      # Find the cell of the observation, extending the extremes
+      if x < q[0]:
+         q[0] = x
+         k = 0
+      elif x >= q[4]:
+         q[4] = x
+         k = 3
+      else:
+         k = 0
+         while x >= q[k + 1]:
+            k += 1
+      for i in range(k + 1, 5):
+         n[i] += 1
+      for i in range(5):
+         self.desired[i] += self.increments[i]
+
+      # Adjust the heights of the middle markers
+      for i in range(1, 4):
+         d = self.desired[i] - n[i]
+         if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+            d = 1 if d > 0 else -1
+            height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+               (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+               (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+            )
+            if not q[i - 1] < height < q[i + 1]:
+               height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+            q[i] = height
+            n[i] += d
+
+   def value(self) -> float:
+      if self.count == 0:
+         return 0.0
+      if self.count <= 5:
+         return float(self.heights[round(self.p * (self.count - 1))])
+      return self.heights[2]
+
+
+class StopStatistics:
+   '''Wait times, throughput and vehicles cleared at the stops.
+
+   The wait time of a vehicle is the `wait_time` of its stop when it is
+   given right of way.
+   '''
+
+   def __init__(
+      self,
+      n_stops:   int,
+      quantiles: Sequence[float] = (0.5, 0.95, 0.99)
+   ) -> None:
+      '''
+      n_stops:
+         Number of stops, whose `unique_id`s go from 0 to `n_stops - 1`.
+      quantiles:
+         Quantiles of the wait time to estimate.
+      '''
+      self.total_wait_time = 0     # Sum of the current `wait_time`s
+      self.stops_waiting = 0       # Stops with a positive `wait_time`
+      self.throughput = [0] * n_stops
+      self.cleared = 0
+      self.cleared_this_step = 0
+      self.deadlocks = 0           # Times the rule to avoid deadlocks ran
+      self.quantiles = {p: P2Quantile(p) for p in quantiles}
+
+   def start_step(self) -> None:
+      '''Called by the model at the start of each step.
+      '''
+      self.cleared_this_step = 0
+
+   def waited(self, stop: Agent) -> None:
+      '''The `wait_time` of the stop has been incremented.
+      '''
+      self.total_wait_time += 1
+      if stop.wait_time == 1:
+         self.stops_waiting += 1
+
+   def proceeded(self, stop: Agent) -> None:
+      '''The vehicle waiting at the stop has been given right of way.
+      '''
+      self.throughput[stop.unique_id] += 1
+      for quantile in self.quantiles.values():
+         quantile.add(stop.wait_time)
+
+   def cleared_intersection(self, stop: Agent) -> None:
+      '''The vehicle of the stop has cleared the intersection, and the
+      `wait_time` of the stop is about to be reset.
+      '''
+      self.total_wait_time -= stop.wait_time
+      if stop.wait_time > 0:
+         self.stops_waiting -= 1
+      self.cleared += 1
+      self.cleared_this_step += 1
+
+   def resolved_deadlock(self) -> None:
+      '''The rule to avoid deadlocks let a stop of an intersection
+      proceed.
+      '''
+      self.deadlocks += 1
+
+   def average_wait_time(self) -> float:
+      '''Average `wait_time` of the stops where a vehicle has waited.
+      '''
+      return self.total_wait_time / (self.stops_waiting if self.stops_waiting else 1)
+
+   def wait_time_quantile(self, p: float) -> float:
+      return self.quantiles[p].value()
+
+   def summary(self) -> Dict[str, float]:
+      summary = {
+         'throughput': sum(self.throughput),
+         'cleared': self.cleared,
+         'deadlocks': self.deadlocks
+      }
+      for p, quantile in self.quantiles.items():
+         summary[f'wait_p{round(p * 100)}'] = quantile.value()
+      return summary
@@ -0,0 +1,280 @@
+'''Trajectories of the vehicles, recorded to memory-mapped files for
+offline analysis, such as space-time diagrams and delay distributions.
+
+A `TrajectoryRecorder` attached to a model appends one record for each
+vehicle on the road at every collected step, see `FourWayStop`. Records
+go to a preallocated file mapped in memory, whose size doubles whenever
+it is full, so that recording costs a copy of the vehicle arrays and the
+run never holds the trace in RAM. A small index is saved next to it: the
+offset of the first record of each step, and the first and last steps
+in which each vehicle was seen.
+
+`Trajectories` reads a trace back as a memory map. A time window is a
+slice of the file, and the records of a vehicle are found by binary
+search within each step, where vehicles are sorted by id, so that only
+the pages holding them are read, however large the trace is.
+
+Usage:
+   with TrajectoryRecorder('run.traj') as recorder:
+      model = FourWayStop(..., trajectories=recorder)
+      for _ in range(n_steps):
+         model.step()
+
+   trajectories = Trajectories('run.traj')
+   trajectories.window(100, 200)
+   trajectories.vehicle(42)
+'''
+import json
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+from mesa import Model
+
+from mas.agents.vehicle import Vehicle
+from mas.agents.vehicle_array import VehicleArray
+
+
+trajectory_record = np.dtype([
+   ('step', '<u4'),
+   ('id', '<u4'),
+   ('x', '<u2'),
+   ('y', '<u2'),
+   ('velocity', '<u1'),
+   ('direction', '<u1'),
+   ('intersection_step', '<i1')
+])
+
+
+def index_path(path: str) -> str:
+   return path + '.index.npz'
+
+
+def vehicle_records(model: Model) -> np.ndarray:
+   '''Returns one record for each vehicle on the road, by increasing id,
+   with ids as in `vis.canvas.grid_visualization.vehicle_state`, so that
+   both backends give the same records.
+   '''
+   vehicles = [
+      a for a in model.schedule.agents
+      if isinstance(a, Vehicle) and a.pos is not None
+   ]
+   arrays = [a for a in model.schedule.agents if isinstance(a, VehicleArray)]
+   n = len(vehicles) + sum(len(a.live()) for a in arrays)
+   records = np.empty(n, dtype=trajectory_record)
+   records['step'] = model.schedule.steps
+   if vehicles:
+      k = len(vehicles)
+      records['id'][:k] = [v.unique_id for v in vehicles]
+      records['x'][:k] = [v.pos[0] for v in vehicles]
+      records['y'][:k] = [v.pos[1] for v in vehicles]
+      records['velocity'][:k] = [v.velocity for v in vehicles]
+      records['direction'][:k] = [v.direction.direction for v in vehicles]
+      records['intersection_step'][:k] = [v.intersection_step for v in vehicles]
+   start = len(vehicles)
+   for agent in arrays:
+      live = agent.live()
+      end = start + len(live)
+      records['id'][start:end] = agent.unique_id + live
+      records['x'][start:end] = agent.x[live]
+      records['y'][start:end] = agent.y[live]
+      records['velocity'][start:end] = agent.velocity[live]
+      records['direction'][start:end] = agent.direction[live]
+      records['intersection_step'][start:end] = agent.intersection_step[live]
+      start = end
+   return records
+
+
+class TrajectoryRecorder:
+   '''Appends vehicle records to a growable memory-mapped file. Use it as
+   a context manager, or call `close()` to write the index and trim the
+   file to the records written.
+   '''
+
+   def __init__(
+      self,
+      path:     str,
+      capacity: int = 1 << 16,
+      stride:   int = 1
+   ) -> None:
+      '''
+      path:
+         File of the records. The index is written to
+         `path + '.index.npz'`.
+      capacity:
+         Number of records the file has room for at first.
+      stride:
+         Record every `stride` steps.
+      '''
+      self.path = path
+      self.stride = stride
+      self.count = 0
+      self.capacity = 0
+      self.records: Optional[np.memmap] = None
+      with open(path, 'wb'):
+         pass
+      self.grow(max(capacity, 1))
+
+      # Offset of the first record of each recorded step, and the first
+      # and last step of each vehicle by id, `-1` if never seen
+      self.steps: List[int] = []
+      self.offsets: List[int] = []
+      self.first_step = np.full(0, -1, dtype=np.int64)
+      self.last_step = np.full(0, -1, dtype=np.int64)
+
+   def __enter__(self) -> 'TrajectoryRecorder':
+      return self
+
+   def __exit__(self, *exc_info) -> None:
+      self.close()
+
+   def grow(self, capacity: int) -> None:
+      '''Extends the file to hold at least `capacity` records, at least
+      doubling it so that appends take amortized constant time.
+      '''
+      capacity = max(capacity, 2 * self.capacity)
+      if self.records is not None:
+         self.records.flush()
+         self.records = None
+      with open(self.path, 'r+b') as f:
+         f.truncate(capacity * trajectory_record.itemsize)
+      self.records = np.memmap(self.path, dtype=trajectory_record, mode='r+', shape=(capacity,))
+      self.capacity = capacity
+
+   def append(self, records: np.ndarray) -> None:
+      '''Appends the records of one step, sorted by id.
+      '''
+      end = self.count + len(records)
+      if end > self.capacity:
+         self.grow(end)
+      self.records[self.count:end] = records
+      if len(records):
+         step = int(records['step'][0])
+         self.steps.append(step)
+         self.offsets.append(self.count)
+         ids = records['id']
+         n_ids = int(ids.max()) + 1
+         if n_ids > len(self.first_step):
+            extra = max(n_ids, 2 * len(self.first_step)) - len(self.first_step)
+            self.first_step = np.pad(self.first_step, (0, extra), constant_values=-1)
+            self.last_step = np.pad(self.last_step, (0, extra), constant_values=-1)
+         new = ids[self.first_step[ids] == -1]
+         self.first_step[new] = step
+         self.last_step[ids] = step
+      self.count = end
+
+   def record(self, model: Model) -> None:
+      '''Records the vehicles of the model, every `stride` steps.
+      '''
+      if model.schedule.steps % self.stride == 0:
+         self.append(vehicle_records(model))
+
+   def flush(self) -> None:
+      '''Writes the mapped records and the index to disk, so that the
+      trace can be read while recording goes on.
+      '''
+      self.records.flush()
+      ids = np.flatnonzero(self.first_step != -1)
+      np.savez(
+         index_path(self.path),
+         count=self.count,
+         dtype=json.dumps(trajectory_record.descr),
+         steps=np.array(self.steps, dtype=np.int64),
+         offsets=np.array(self.offsets + [self.count], dtype=np.int64),
+         ids=ids,
+         first_step=self.first_step[ids],
+         last_step=self.last_step[ids]
+      )
+
+   def close(self) -> None:
+      if self.records is None:
+         return
+      self.flush()
+      self.records = None
+      with open(self.path, 'r+b') as f:
+         f.truncate(self.count * trajectory_record.itemsize)
+
+
+class Trajectories:
+   '''Read-only access to a trace written by `TrajectoryRecorder`.
+   Records are only read from disk when accessed.
+   '''
+
+   def __init__(self, path: str) -> None:
+      with np.load(index_path(path)) as index:
+         self.count = int(index['count'])
+         dtype = np.dtype([tuple(field) for field in json.loads(str(index['dtype']))])
+         self.steps = index['steps']
+         self.offsets = index['offsets']
+         self.ids = index['ids']
+         self.first_step = index['first_step']
+         self.last_step = index['last_step']
+      if dtype != trajectory_record:
+         raise ValueError(f'Unsupported trajectory records in {path}')
+      if self.count:
+         self.records = np.memmap(path, dtype=trajectory_record, mode='r', shape=(self.count,))
+      else:
+         self.records = np.empty(0, dtype=trajectory_record)
+
+   def __len__(self) -> int:
+      return self.count
+
+   def window(
+      self,
+      start: Optional[int] = None,
+      stop:  Optional[int] = None
+   ) -> np.ndarray:
+      '''Returns the records of the steps from `start` included to `stop`
+      excluded, as a view of the file.
+      '''
+      first = 0 if start is None else np.searchsorted(self.steps, start)
+      last = len(self.steps) if stop is None else np.searchsorted(self.steps, stop)
+      return self.records[self.offsets[first]:self.offsets[last]]
+
+   def at(self, step: int) -> np.ndarray:
+      '''Returns the records of a single step.
+      '''
+      return self.window(step, step + 1)
+
+   def step_range(self, vehicle_id: int) -> Optional[Tuple[int, int]]:
+      '''Returns the first and last recorded steps of a vehicle, or `None`
+      if it was never recorded.
+      '''
+      k = np.searchsorted(self.ids, vehicle_id)
+      if k == len(self.ids) or self.ids[k] != vehicle_id:
+         return None
+      return int(self.first_step[k]), int(self.last_step[k])
+
+   def vehicle(
+      self,
+      vehicle_id: int,
+      start:      Optional[int] = None,
+      stop:       Optional[int] = None
+   ) -> np.ndarray:
+      '''Returns the records of a vehicle, by increasing step, between
+      `start` included and `stop` excluded. Each step is searched in
+      turn, all at once, so only a few records are read per step.
+      '''
+      steps = self.step_range(vehicle_id)
+      if steps is None:
+         return np.empty(0, dtype=trajectory_record)
+      first = np.searchsorted(self.steps, steps[0] if start is None else max(start, steps[0]))
+      last = np.searchsorted(self.steps, steps[1] + 1 if stop is None else min(stop, steps[1] + 1))
+      lo = self.offsets[first:last].copy()
+      hi = self.offsets[first + 1:last + 1].copy()
+      if len(lo) == 0:
+         return np.empty(0, dtype=trajectory_record)
+
+      # Binary search of the id within each step
+      ids = self.records['id']
+      while True:
+         searching = lo < hi
+         if not searching.any():
+            break
+         mid = (lo + hi) // 2
+         below = searching & (ids[np.minimum(mid, self.count - 1)] < vehicle_id)
+         lo = np.where(below, mid + 1, lo)
+         hi = np.where(searching & ~below, mid, hi)
+      found = lo < self.offsets[first + 1:last + 1]
+      found[found] = ids[lo[found]] == vehicle_id
+      return self.records[lo[found]]
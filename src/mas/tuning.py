@@ -0,0 +1,488 @@
+'''Sensitivity analysis and tuning of the parameters of `FourWayStop`,
+such as the maximum velocity, the number of vehicles, which sets the
+density of the grid, or whether the rule to avoid deadlocks applies.
+
+Parameters are sampled from the unit hypercube, with a Latin hypercube
+or a Sobol sequence, and mapped to their ranges. A design can be run as
+a whole, giving the standardized regression coefficients of each metric
+on the parameters. The search instead runs successive halving: all
+configurations are simulated for a few steps, only the best fraction
+carries on for more steps, and so on, so that clearly bad ones are
+pruned early. The survivors continue from checkpoints of their models,
+so no step is simulated twice.
+
+All configurations are run with the same replicate seeds, so that they
+are compared on the same random numbers. Runs are spread over a pool of
+worker processes.
+
+Usage:
+   python -m mas.tuning design --design lhs --n-points 32 --steps 1000 \
+      --int max_velocity 1 8 --int n_vehicles 5 60 --bool avoid_deadlocks
+   python -m mas.tuning search --n-points 81 --min-steps 100 --max-steps 2700 \
+      --int max_velocity 1 8 --int n_vehicles 5 60 --objective wait_per_throughput
+'''
+import argparse
+import copy
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from mas import checkpoint
+from mas.agents.stop import Status
+from mas.batch import write_table
+from mas.metrics import MetricsSink
+from mas.model import FourWayStop
+from mas.seeding import spawn_seeds
+
+
+# Configuration of the parameters that are not varied
+default_config = {
+   'n_vehicles': 10,
+   'width': 40,
+   'height': 40,
+   'max_velocity': 5,
+   'avoid_deadlocks': True
+}
+
+# Primitive polynomials and initial direction numbers of the Sobol
+# sequence, from Joe and Kuo (2008), for dimensions 2 and up
+sobol_directions = [
+   (1, 0, [1]),
+   (2, 1, [1, 3]),
+   (3, 1, [1, 3, 1]),
+   (3, 2, [1, 1, 1]),
+   (4, 1, [1, 1, 3, 3]),
+   (4, 4, [1, 3, 5, 13]),
+   (5, 2, [1, 1, 5, 5, 17]),
+   (5, 4, [1, 1, 5, 5, 5]),
+   (5, 7, [1, 1, 7, 11, 19])
+]
+
+# Bits of the Sobol points
+sobol_bits = 32
+
+
+class Parameter:
+   '''A parameter of `FourWayStop` to vary, mapped from the unit
+   interval to its range.
+   '''
+
+   def __init__(
+      self,
+      name: str,
+      low:  float = 0,
+      high: float = 1,
+      kind: str   = 'int'
+   ) -> None:
+      '''
+      low, high:
+         Range of the values, both included for integers.
+      kind:
+         Either `'int'`, `'float'` or `'bool'`, which ignores the range.
+      '''
+      if kind not in ('int', 'float', 'bool'):
+         raise ValueError(f'Unknown kind of parameter: {kind}')
+      self.name = name
+      self.low = low
+      self.high = high
+      self.kind = kind
+
+   def value(self, u: float) -> Union[int, float, bool]:
+      '''Returns the value at `u`, between 0 and 1, such that a uniform
+      `u` gives uniform values.
+      '''
+      if self.kind == 'bool':
+         return bool(u >= 0.5)
+      if self.kind == 'int':
+         return int(min(self.low + int(u * (self.high - self.low + 1)), self.high))
+      return self.low + u * (self.high - self.low)
+
+
+def latin_hypercube(
+   n:    int,
+   d:    int,
+   seed: Optional[int] = None
+) -> np.ndarray:
+   '''Returns `n` points in the unit hypercube of dimension `d`, with a
+   single point in each of the `n` slices of each dimension.
+   '''
+   rng = np.random.default_rng(seed)
+   strata = np.stack([rng.permutation(n) for _ in range(d)], axis=1)
+   return (strata + rng.random((n, d))) / n
+
+
+def sobol(
+   n:    int,
+   d:    int,
+   seed: Optional[int] = None
+) -> np.ndarray:
+   '''Returns the first `n` points of the Sobol sequence in dimension
+   `d`, best used with a power of 2. If `seed` is set, the points are
+   randomized by a digital shift, which keeps their balance.
+   '''
+   if d > len(sobol_directions) + 1:
+      raise ValueError(f'Sobol points are available up to dimension {len(sobol_directions) + 1}')
+
+   # Direction numbers of each dimension, the first one being the van
+   # der Corput sequence
+   directions = np.zeros((d, sobol_bits), dtype=np.uint64)
+   directions[0] = [1 << (sobol_bits - 1 - k) for k in range(sobol_bits)]
+   for j in range(1, d):
+      s, a, m = sobol_directions[j - 1]
+      v = [mk << (sobol_bits - 1 - k) for k, mk in enumerate(m)]
+      for k in range(s, sobol_bits):
+         vk = v[k - s] ^ (v[k - s] >> s)
+         for i in range(1, s):
+            if (a >> (s - 1 - i)) & 1:
+               vk ^= v[k - i]
+         v.append(vk)
+      directions[j] = v
+
+   # Gray code order: each point differs from the previous one by the
+   # direction number of the lowest bit set in its index
+   points = np.zeros((n, d), dtype=np.uint64)
+   x = np.zeros(d, dtype=np.uint64)
+   for i in range(1, n):
+      c = (i & -i).bit_length() - 1
+      x ^= directions[:, c]
+      points[i] = x
+   if seed is not None:
+      shift = np.random.default_rng(seed).integers(0, 1 << sobol_bits, d, dtype=np.uint64)
+      points ^= shift
+   return points.astype(np.float64) / float(1 << sobol_bits)
+
+
+designs: Dict[str, Callable[[int, int, Optional[int]], np.ndarray]] = {
+   'lhs': latin_hypercube,
+   'sobol': sobol
+}
+
+
+def make_configs(
+   points:     np.ndarray,
+   parameters: Sequence[Parameter],
+   base:       Optional[dict] = None
+) -> List[dict]:
+   '''Returns the configuration of each point of a design, on top of
+   `base`, `default_config` by default.
+   '''
+   base = default_config if base is None else base
+   return [
+      dict(base, **{p.name: p.value(u) for p, u in zip(parameters, point.tolist())})
+      for point in points
+   ]
+
+
+def measure(model: FourWayStop) -> Dict[str, float]:
+   '''Metrics of a run so far, per step. The vehicles still waiting at
+   a stop count in the wait quantiles with their wait so far, so that a
+   gridlocked run does not look like one where nobody waits.
+   '''
+   steps = max(model.schedule.steps, 1)
+   metrics = {'throughput': sum(model.stats.throughput) / steps}
+   waiting = [stop.wait_time for stop in model.stops() if stop.status == Status.WAITING]
+   for p in (0.5, 0.95):
+      quantile = copy.deepcopy(model.stats.quantiles[p])
+      for wait_time in waiting:
+         quantile.add(wait_time)
+      metrics[f'wait_p{round(p * 100)}'] = quantile.value()
+   metrics['deadlocks'] = model.stats.deadlocks / steps
+   return metrics
+
+
+def advance(
+   task: Tuple[dict, int, Optional[bytes], int, str, bool]
+) -> Tuple[Dict[str, float], Optional[bytes]]:
+   '''Runs a configuration with one seed for more steps, starting anew
+   or from a checkpoint. Returns its metrics, and a checkpoint to
+   continue from if asked for.
+
+   task:
+      Configuration, seed, checkpoint or `None`, number of steps,
+      backend, and whether to return a checkpoint.
+   '''
+   config, seed, data, n_steps, backend, keep = task
+   if data is None:
+      model = FourWayStop(
+         **config,
+         backend=backend,
+         seed=seed,
+         mirror_grid=False,
+         metrics=MetricsSink({})
+      )
+   else:
+      model = checkpoint.loads(data)
+   for _ in range(n_steps):
+      model.step()
+   return measure(model), checkpoint.dumps(model) if keep else None
+
+
+def mean_metrics(metrics: List[Dict[str, float]]) -> Dict[str, float]:
+   return {k: sum(m[k] for m in metrics) / len(metrics) for k in metrics[0]}
+
+
+def wait_p95(metrics: Dict[str, float]) -> float:
+   return metrics['wait_p95']
+
+
+def throughput(metrics: Dict[str, float]) -> float:
+   return -metrics['throughput']
+
+
+def wait_per_throughput(metrics: Dict[str, float]) -> float:
+   return metrics['wait_p95'] / max(metrics['throughput'], 1e-9)
+
+
+# Scores to minimize, by name
+objectives: Dict[str, Callable[[Dict[str, float]], float]] = {
+   'wait_p95': wait_p95,
+   'throughput': throughput,
+   'wait_per_throughput': wait_per_throughput
+}
+
+
+def run_design(
+   configs:     Sequence[dict],
+   n_steps:     int,
+   replicates:  int           = 1,
+   seed:        int           = 0,
+   backend:     str           = 'agents',
+   max_workers: Optional[int] = None
+) -> List[dict]:
+   '''Runs every configuration for `n_steps` steps, and returns one row
+   for each, with the configuration and the metrics averaged over the
+   replicates.
+   '''
+   seeds = spawn_seeds(seed, replicates)
+   tasks = [(c, s, None, n_steps, backend, False) for c in configs for s in seeds]
+   with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      results = [m for m, _ in executor.map(advance, tasks)]
+   return [
+      dict(config, steps=n_steps, **mean_metrics(results[i * replicates:(i + 1) * replicates]))
+      for i, config in enumerate(configs)
+   ]
+
+
+def sensitivity(
+   rows:       List[dict],
+   parameters: Sequence[Parameter],
+   metric:     str
+) -> Tuple[Dict[str, float], float]:
+   '''Standardized regression coefficients of a metric on the
+   parameters, from the rows of a design, and the R² of the regression.
+   A coefficient is the change of the metric, in standard deviations,
+   for a change of one standard deviation of the parameter. They rank
+   the parameters as long as R² is close to 1.
+   '''
+   x = np.array([[float(row[p.name]) for p in parameters] for row in rows])
+   y = np.array([row[metric] for row in rows], dtype=np.float64)
+   x_std, y_std = x.std(axis=0), y.std()
+   varied = x_std > 0
+   if y_std == 0 or not varied.any():
+      return {p.name: 0.0 for p in parameters}, 0.0
+   z = (x[:, varied] - x[:, varied].mean(axis=0)) / x_std[varied]
+   t = (y - y.mean()) / y_std
+   coefficients, *_ = np.linalg.lstsq(z, t, rcond=None)
+   residuals = t - z @ coefficients
+   r2 = 1 - float(residuals @ residuals) / float(t @ t)
+   src = dict.fromkeys((p.name for p in parameters), 0.0)
+   for p, c in zip([p for p, v in zip(parameters, varied) if v], coefficients.tolist()):
+      src[p.name] = c
+   return src, r2
+
+
+def rung_steps(
+   min_steps: int,
+   max_steps: int,
+   eta:       int
+) -> List[int]:
+   '''Total steps of each rung of successive halving, growing by a
+   factor `eta` up to `max_steps`.
+   '''
+   steps = [min_steps]
+   while steps[-1] * eta < max_steps:
+      steps.append(steps[-1] * eta)
+   if steps[-1] < max_steps:
+      steps.append(max_steps)
+   return steps
+
+
+def successive_halving(
+   configs:     Sequence[dict],
+   min_steps:   int,
+   max_steps:   int,
+   eta:         int                             = 3,
+   replicates:  int                             = 1,
+   seed:        int                             = 0,
+   objective:   str                             = 'wait_p95',
+   backend:     str                             = 'agents',
+   max_workers: Optional[int]                   = None,
+   log:         Optional[Callable[[str], None]] = None
+) -> List[dict]:
+   '''Runs all configurations for `min_steps` steps, keeps the best
+   `1 / eta` of them by `objective`, runs those up to `eta` times as
+   many steps, and so on up to `max_steps`.
+
+   Returns one row for each configuration at each rung it reached, with
+   the index of the configuration, the rung, its metrics and its score,
+   the best last.
+   '''
+   score = objectives[objective]
+   seeds = spawn_seeds(seed, replicates)
+   rungs = rung_steps(min_steps, max_steps, eta)
+   alive = list(range(len(configs)))
+   checkpoints: Dict[int, List[Optional[bytes]]] = {i: [None] * replicates for i in alive}
+   done = 0
+   simulated = 0
+   rows = []
+   with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      for rung, steps in enumerate(rungs):
+         last = rung == len(rungs) - 1
+         tasks = [
+            (configs[i], s, checkpoints[i][r], steps - done, backend, not last)
+            for i in alive for r, s in enumerate(seeds)
+         ]
+         results = list(executor.map(advance, tasks))
+         simulated += len(tasks) * (steps - done)
+         done = steps
+
+         scores = {}
+         for k, i in enumerate(alive):
+            replicate_results = results[k * replicates:(k + 1) * replicates]
+            checkpoints[i] = [data for _, data in replicate_results]
+            metrics = mean_metrics([m for m, _ in replicate_results])
+            scores[i] = score(metrics)
+            rows.append(dict(configs[i], config=i, rung=rung, steps=steps, **metrics, score=scores[i]))
+         if log is not None:
+            best = min(alive, key=lambda i: scores[i])
+            log(f'rung {rung}: {len(alive)} configurations at {steps} steps, '
+                f'best {best} with {objective} {scores[best]:.4g}')
+
+         # Keep the best configurations, the first ones on ties
+         n_kept = 1 if last else max(1, len(alive) // eta)
+         kept = sorted(alive, key=lambda i: (scores[i], i))[:n_kept]
+         for i in alive:
+            if i not in kept:
+               del checkpoints[i]
+         alive = sorted(kept)
+
+   if log is not None:
+      full = len(configs) * replicates * max_steps
+      log(f'simulated {simulated} steps, {simulated / full:.1%} of running all '
+          f'configurations for {max_steps} steps')
+   rows.sort(key=lambda row: (row['rung'], -row['score']))
+   return rows
+
+
+def pareto_front(rows: List[dict]) -> List[dict]:
+   '''Rows for which no other row has both a lower p95 wait and a higher
+   throughput.
+   '''
+   return [
+      row for row in rows
+      if not any(
+         other['wait_p95'] <= row['wait_p95'] and other['throughput'] >= row['throughput'] and
+         (other['wait_p95'] < row['wait_p95'] or other['throughput'] > row['throughput'])
+         for other in rows
+      )
+   ]
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+   parser = argparse.ArgumentParser(
+      prog='python -m mas.tuning',
+      description='Sensitivity analysis and tuning of the four-way stop model.'
+   )
+   commands = parser.add_subparsers(dest='command', required=True)
+   design = commands.add_parser('design', help='Run a design and rank the parameters')
+   search = commands.add_parser('search', help='Search for the best configuration')
+   for command in (design, search):
+      command.add_argument('--int', nargs=3, action='append', default=[],
+                           metavar=('NAME', 'LOW', 'HIGH'),
+                           help='Vary an integer parameter, bounds included')
+      command.add_argument('--float', nargs=3, action='append', default=[],
+                           metavar=('NAME', 'LOW', 'HIGH'),
+                           help='Vary a real parameter')
+      command.add_argument('--bool', action='append', default=[], metavar='NAME',
+                           help='Vary a boolean parameter')
+      command.add_argument('--n-vehicles', type=int, default=default_config['n_vehicles'])
+      command.add_argument('--width', type=int, default=default_config['width'])
+      command.add_argument('--height', type=int, default=None,
+                           help='Defaults to --width')
+      command.add_argument('--max-velocity', type=int, default=default_config['max_velocity'])
+      command.add_argument('--no-avoid-deadlocks', dest='avoid_deadlocks', action='store_false')
+      command.add_argument('--design', choices=list(designs), default='sobol')
+      command.add_argument('--n-points', type=int, default=32,
+                           help='Number of configurations')
+      command.add_argument('--replicates', type=int, default=1)
+      command.add_argument('--seed', type=int, default=0)
+      command.add_argument('--backend', choices=['agents', 'numpy'], default='agents')
+      command.add_argument('--workers', type=int, default=None,
+                           help='Number of worker processes, all cores by default')
+      command.add_argument('--output', default=None,
+                           help='CSV file to write, standard output by default')
+   design.add_argument('--steps', type=int, default=1000)
+   search.add_argument('--min-steps', type=int, default=100)
+   search.add_argument('--max-steps', type=int, default=2700)
+   search.add_argument('--eta', type=int, default=3,
+                       help='Keep one configuration out of this many at each rung')
+   search.add_argument('--objective', choices=list(objectives), default='wait_p95')
+   return parser.parse_args(argv)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+   args = parse_args(argv)
+   parameters = [Parameter(name, int(low), int(high), 'int') for name, low, high in args.int]
+   parameters += [Parameter(name, float(low), float(high), 'float') for name, low, high in args.float]
+   parameters += [Parameter(name, kind='bool') for name in args.bool]
+   if not parameters:
+      sys.exit('No parameter to vary, see --int, --float and --bool')
+   base = {
+      'n_vehicles': args.n_vehicles,
+      'width': args.width,
+      'height': args.height if args.height is not None else args.width,
+      'max_velocity': args.max_velocity,
+      'avoid_deadlocks': args.avoid_deadlocks
+   }
+   points = designs[args.design](args.n_points, len(parameters), args.seed)
+   configs = make_configs(points, parameters, base)
+
+   def log(message: str) -> None:
+      print(message, file=sys.stderr)
+
+   if args.command == 'design':
+      rows = run_design(configs, args.steps, args.replicates, args.seed, args.backend, args.workers)
+      for metric in ('wait_p95', 'throughput'):
+         src, r2 = sensitivity(rows, parameters, metric)
+         coefficients = ', '.join(f'{name} {c:+.2f}' for name, c in src.items())
+         log(f'{metric}: {coefficients} (R² {r2:.2f})')
+      for row in pareto_front(rows):
+         values = ', '.join(f'{p.name}={row[p.name]}' for p in parameters)
+         log(f'pareto: {values}, wait_p95 {row["wait_p95"]:.3g}, throughput {row["throughput"]:.3g}')
+   else:
+      rows = successive_halving(
+         configs,
+         args.min_steps,
+         args.max_steps,
+         args.eta,
+         args.replicates,
+         args.seed,
+         args.objective,
+         args.backend,
+         args.workers,
+         log
+      )
+      best = rows[-1]
+      log('best: ' + ', '.join(f'{p.name}={best[p.name]}' for p in parameters))
+
+   if args.output is None:
+      write_table(rows, sys.stdout)
+   else:
+      with open(args.output, 'w', newline='') as f:
+         write_table(rows, f)
+
+
+if __name__ == '__main__':
+   main()
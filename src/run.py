@@ -1,3 +1,13 @@
-from mas.server import server
+import argparse
 
-server.launch()
+from mas.server import make_server
+
+
+parser = argparse.ArgumentParser(description='Start the visualization server.')
+parser.add_argument('--background', action='store_true',
+                    help='Step the model continuously, the browser only samples frames')
+parser.add_argument('--profile', action='store_true',
+                    help='Show the time spent in each stage of the model')
+args = parser.parse_args()
+
+make_server(args.background, args.profile).launch()
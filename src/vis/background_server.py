@@ -0,0 +1,97 @@
+'''Server mode where the model steps continuously in a background thread,
+instead of one step for each frame the browser asks for. Frames are
+snapshots of the model at the time they are requested, at the frame rate
+set in the browser, so steps in between are skipped and long runs go at
+the speed of the engine.
+'''
+import threading
+import time
+
+import tornado.escape
+
+from vis.binary_server import BinaryModularServer, BinarySocketHandler
+
+
+class Stepper(threading.Thread):
+   '''Steps the model of the server for as long as the browser keeps
+   asking for frames, so that it pauses shortly after the run is
+   stopped.
+   '''
+
+   def __init__(self, server: 'BackgroundModularServer', lease: float) -> None:
+      '''
+      lease:
+         Seconds the model keeps stepping after the last request for a
+         frame.
+      '''
+      super().__init__(daemon=True)
+      self.server = server
+      self.lease = lease
+      self.deadline = 0.0
+      self.condition = threading.Condition()
+
+   def renew(self) -> None:
+      with self.condition:
+         self.deadline = time.monotonic() + self.lease
+         self.condition.notify()
+
+   def active(self) -> bool:
+      return time.monotonic() < self.deadline and self.server.model.running
+
+   def run(self) -> None:
+      while True:
+         with self.condition:
+            while not self.active():
+               self.condition.wait()
+         with self.server.lock:
+            if self.server.model.running:
+               self.server.model.step()
+
+
+class BackgroundSocketHandler(BinarySocketHandler):
+   '''Requests for a step only render the current state of the model,
+   which is stepped by the `Stepper`.
+   '''
+
+   @property
+   def viz_state_message(self) -> dict:
+      with self.application.lock:
+         return super().viz_state_message
+
+   def on_message(self, message: str) -> None:
+      msg = tornado.escape.json_decode(message)
+      if msg['type'] == 'get_step':
+         self.application.stepper.renew()
+         if not self.application.model.running:
+            self.write_message({'type': 'end'})
+         else:
+            self.write_message(self.viz_state_message)
+      else:
+         with self.application.lock:
+            super().on_message(message)
+
+
+class BackgroundModularServer(BinaryModularServer):
+   '''`BinaryModularServer` stepping the model in the background.
+   '''
+   socket_handler = (r'/ws', BackgroundSocketHandler)
+   handlers = [
+      BinaryModularServer.page_handler,
+      socket_handler,
+      BinaryModularServer.static_handler,
+      BinaryModularServer.local_handler
+   ]
+
+   # Seconds the model keeps stepping after the last request for a frame
+   lease = 1.0
+
+   def __init__(self, *args, **kwargs) -> None:
+      # The model is created by the parent constructor
+      self.lock = threading.RLock()
+      super().__init__(*args, **kwargs)
+      self.stepper = Stepper(self, self.lease)
+      self.stepper.start()
+
+   def reset_model(self) -> None:
+      with self.lock:
+         super().reset_model()
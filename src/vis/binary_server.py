@@ -0,0 +1,69 @@
+from abc import ABC, abstractmethod
+from typing import Any, Tuple
+
+from mesa import Model
+from mesa.visualization.ModularVisualization import (
+   ModularServer,
+   SocketHandler,
+   VisualizationElement
+)
+
+
+class ConnectionElement(VisualizationElement, ABC):
+   '''Element whose state depends on what was already sent to each
+   browser, such as a delta against the previous frame. The socket
+   handler of each connection keeps what it was sent, and passes it to
+   `render_for`.
+   '''
+
+   @abstractmethod
+   def render_for(self, model: Model, sent: Any) -> Tuple[Any, Any]:
+      '''Returns the state of the element for a connection that was
+      already sent `sent`, `None` for a new connection, along with what
+      it is sent now.
+      '''
+
+   def render(self, model: Model) -> Any:
+      # As for a new connection
+      return self.render_for(model, None)[0]
+
+
+class BinarySocketHandler(SocketHandler):
+   '''Sends the states that visualization elements render as `bytes` in
+   binary messages, right before the JSON message with the state of all
+   elements, where they are replaced by `null`. The JavaScript side of
+   these elements queues binary messages until they render.
+   '''
+
+   def open(self) -> None:
+      # What each `ConnectionElement` sent to this connection, by index
+      self.sent = {}
+      super().open()
+
+   @property
+   def viz_state_message(self) -> dict:
+      model = self.application.model
+      state = []
+      for i, element in enumerate(self.application.visualization_elements):
+         if isinstance(element, ConnectionElement):
+            element_state, self.sent[i] = element.render_for(model, self.sent.get(i))
+         else:
+            element_state = element.render(model)
+         if isinstance(element_state, bytes):
+            self.write_message(element_state, binary=True)
+            element_state = None
+         state.append(element_state)
+      return {'type': 'viz_state', 'data': state}
+
+
+class BinaryModularServer(ModularServer):
+   '''`ModularServer` whose elements can render binary states, or states
+   that depend on the connection.
+   '''
+   socket_handler = (r'/ws', BinarySocketHandler)
+   handlers = [
+      ModularServer.page_handler,
+      socket_handler,
+      ModularServer.static_handler,
+      ModularServer.local_handler
+   ]
@@ -1,31 +1,68 @@
-from typing import List
+'''Canvas of the road and the vehicles.
 
-from mesa.visualization.ModularVisualization import VisualizationElement
+The state of the vehicles is sent to the browser as a binary frame,
+instead of JSON. A frame is a header followed by one record for each
+vehicle, all little-endian and unaligned:
+
+   header:  kind (uint8), number of records (uint32)
+   record:  id (uint32), x (uint16), y (uint16), direction (uint8)
+
+A keyframe holds all vehicles, a delta only those that have moved or
+turned since the previous frame sent to the same browser. The direction
+is the integer used by `Direction`, the color of a vehicle only depends
+on its id.
+'''
+from typing import Optional, Tuple
+
+import numpy as np
 from mesa import Model
 
 from mas.agents.vehicle import Vehicle
+from mas.agents.vehicle_array import VehicleArray
+from vis.binary_server import ConnectionElement
+
+
+# Kinds of frame
+keyframe = 0
+delta = 1
+
+frame_header = np.dtype([('kind', '<u1'), ('count', '<u4')])
+vehicle_record = np.dtype([
+   ('id', '<u4'),
+   ('x', '<u2'),
+   ('y', '<u2'),
+   ('direction', '<u1')
+])
 
 
-# Colors used for the vehicles
-html_color_names = [
-   '#2f4f4f',  # dark slate gray
-   '#191970',  # midnight blue
-   '#4682b4',  # steel blue
-   '#98fb98',  # pale green
-   '#2e8b57',  # sea green
-   '#9acd32',  # yellow green
-   '#4b0082',  # indigo
-   '#dc143c',  # crimson
-   '#ff8c00',  # dark orange
-   '#ff69b4'   # deep pink
-]
+def vehicle_state(model: Model) -> Tuple[np.ndarray, ...]:
+   '''Returns the ids, coordinates and directions of all the vehicles.
+   Ids follow the order of the schedule, so that vehicles get the same
+   color with either backend. Vehicles that have left an open grid are
+   left out.
+   '''
+   vehicles = [
+      a for a in model.schedule.agents
+      if isinstance(a, Vehicle) and a.pos is not None
+   ]
+   ids = [np.array([v.unique_id for v in vehicles], dtype=np.intp)]
+   x = [np.array([v.pos[0] for v in vehicles], dtype=np.intp)]
+   y = [np.array([v.pos[1] for v in vehicles], dtype=np.intp)]
+   direction = [np.array([v.direction.direction for v in vehicles], dtype=np.intp)]
+   for agent in model.schedule.agents:
+      if isinstance(agent, VehicleArray):
+         live = agent.live()
+         ids.append(agent.unique_id + live)
+         x.append(agent.x[live])
+         y.append(agent.y[live])
+         direction.append(agent.direction[live])
+   return tuple(np.concatenate(a) for a in (ids, x, y, direction))
 
 
-class CanvasGridVisualization(VisualizationElement):
-   '''For each vehicle, it generates a portrayal, which is a dictionary
-   containing all relevant details about what shape to draw and where.
-   It then passes this information to the JavaScript code that will
-   render it on the web server.
+class CanvasGridVisualization(ConnectionElement):
+   '''Renders the vehicles as binary frames, see the module
+   documentation, which are drawn by the JavaScript code on top of a
+   cached road layer. Requires `BinaryModularServer`.
    '''
    local_includes = ['vis/canvas/traffic_canvas.js', 'vis/canvas/module.js']
 
@@ -34,39 +71,51 @@ class CanvasGridVisualization(VisualizationElement):
       canvas_width:  int,
       canvas_height: int,
       grid_width:    int,
-      grid_height:   int
+      grid_height:   int,
+      blocks:        Tuple[int, int] = (1, 1)
    ) -> None:
       '''
       canvas_width, canvas_height:
          Size of the grid in pixels.
       grid_width, grid_height:
          Size of the grid in number of cells.
+      blocks:
+         Number of blocks along `x` and `y`, each with an intersection
+         at its center, as in `RoadNetwork`.
       '''
-      new_element = ('new CanvasModule({}, {}, {}, {})'.format(
+      new_element = ('new CanvasModule({}, {}, {}, {}, {}, {})'.format(
          canvas_width,
          canvas_height,
          grid_width,
          grid_height,
+         blocks[0],
+         blocks[1]
       ))
       self.js_code = 'elements.push(' + new_element + ');'
 
-   def render(self, model: Model) -> List[dict]:
-      '''Build visualization data from a model object.
+   def render_for(
+      self,
+      model: Model,
+      sent:  Optional[Tuple[Model, Tuple[np.ndarray, ...]]]
+   ) -> Tuple[bytes, Tuple[Model, Tuple[np.ndarray, ...]]]:
+      '''Build a frame from a model object: a keyframe for a new
+      connection or a new model, a delta against the model and state
+      last sent to the connection otherwise.
       '''
-      world_state = []
-
-      for i, agent in enumerate(model.schedule.agents):
-
-         # No need to print the stops
-         if isinstance(agent, Vehicle):
-            portrayal = {}
-
-            x, y = agent.pos
-            portrayal['x'] = x
-            portrayal['y'] = y
-            portrayal['angle'] = agent.direction.to_angle()
-            portrayal['color'] = html_color_names[i % len(html_color_names)]
-
-            world_state.append(portrayal)
+      ids, x, y, direction = state = vehicle_state(model)
+      if sent is None or model is not sent[0] or len(ids) != len(sent[1][0]) or \
+         (ids != sent[1][0]).any():
+         kind = keyframe
+         changed = slice(None)
+      else:
+         kind = delta
+         last = sent[1]
+         changed = (x != last[1]) | (y != last[2]) | (direction != last[3])
 
-      return world_state
+      records = np.empty(len(ids[changed]), dtype=vehicle_record)
+      records['id'] = ids[changed]
+      records['x'] = x[changed]
+      records['y'] = y[changed]
+      records['direction'] = direction[changed]
+      header = np.array([(kind, len(records))], dtype=frame_header)
+      return header.tobytes() + records.tobytes(), (model, state)
@@ -1,4 +1,4 @@
-const CanvasModule = function(canvasWidth, canvasHeight, gridWidth, gridHeight) {
+const CanvasModule = function(canvasWidth, canvasHeight, gridWidth, gridHeight, blocksX = 1, blocksY = 1) {
 
    // Create HTML tags
    const canvas_tag =
@@ -19,14 +19,28 @@ const CanvasModule = function(canvasWidth, canvasHeight, gridWidth, gridHeight)
    $('#elements').append(parent_elem);
    parent_elem.append(canvas_elem);
 
+   // Binary frames arrive right before the JSON state, queue them until
+   // the elements render
+   if (window.binaryFrames === undefined) {
+      window.binaryFrames = [];
+      ws.binaryType = 'arraybuffer';
+      const onmessage = ws.onmessage;
+      ws.onmessage = (message) => {
+         if (message.data instanceof ArrayBuffer) {
+            binaryFrames.push(message.data);
+         } else {
+            onmessage(message);
+         }
+      };
+   }
+
    // Create the context and the drawing controller
    const ctx = canvas_elem.getContext('2d');
-   const canvas = new TrafficCanvas(canvasWidth, canvasHeight, gridHeight, gridWidth, ctx);
+   const canvas = new TrafficCanvas(canvasWidth, canvasHeight, gridWidth, gridHeight, ctx, blocksX, blocksY);
 
    this.render = function(data) {
-      canvas.resetCanvas();
-      canvas.drawRoad();
-      canvas.drawAgents(data);
+      canvas.applyFrame(binaryFrames.shift());
+      canvas.draw();
    };
 
    this.reset = function() {
@@ -1,4 +1,4 @@
-const TrafficCanvas = function(canvasWidth, canvasHeight, gridWidth, gridHeight, ctx) {
+const TrafficCanvas = function(canvasWidth, canvasHeight, gridWidth, gridHeight, ctx, blocksX = 1, blocksY = 1) {
 
    const cellWidth = Math.floor(canvasWidth / gridWidth)
    const cellHeight = Math.floor(canvasHeight / gridHeight)
@@ -7,40 +7,75 @@ const TrafficCanvas = function(canvasWidth, canvasHeight, gridWidth, gridHeight,
    const maxR = Math.min(cellHeight, cellWidth) / 2 - 1;
    const arrowR = 0.7 * maxR
 
+   // Colors used for the vehicles, by id
+   const colors = [
+      '#2f4f4f',  // dark slate gray
+      '#191970',  // midnight blue
+      '#4682b4',  // steel blue
+      '#98fb98',  // pale green
+      '#2e8b57',  // sea green
+      '#9acd32',  // yellow green
+      '#4b0082',  // indigo
+      '#dc143c',  // crimson
+      '#ff8c00',  // dark orange
+      '#ff69b4'   // deep pink
+   ];
+
+   // Number of directions, as in `Direction`
+   const nDirections = 8;
+
+   // Size of the binary frames, see `grid_visualization.py`
+   const keyframe = 0;
+   const headerSize = 5;
+   const recordSize = 9;
+
+   // State of the vehicles by id, a direction of -1 if there is none
+   let xs = new Uint16Array(0);
+   let ys = new Uint16Array(0);
+   let directions = new Int8Array(0);
+
+   const createLayer = (width, height) => {
+      const layer = document.createElement('canvas');
+      layer.width = width;
+      layer.height = height;
+      return layer;
+   };
+
    /*
    Draws a rectangle in the specified location.
       x, y : grid coordinates
       w, h : width and height in number of cells
       color : fill color
    */
-   this.drawRectangle = (x, y, w, h, color) => {
+   this.drawRectangle = (x, y, w, h, color, context = ctx) => {
       x = x * cellWidth;
       y = y * cellHeight;
       w = w * cellWidth;
       h = h * cellHeight;
 
-      ctx.beginPath();
-      ctx.fillStyle = color;
-      ctx.fillRect(x, y, w, h);
+      context.beginPath();
+      context.fillStyle = color;
+      context.fillRect(x, y, w, h);
    };
 
-   this.drawRoad = () => {
+   this.drawRoad = (context = ctx) => {
       // Background
-      this.drawRectangle(0, 0, gridWidth, gridHeight, '#262626');
+      this.drawRectangle(0, 0, gridWidth, gridHeight, '#262626', context);
+
+      // One road along each axis for each block, crossing at the center
+      // of the block
+      const blockWidth = Math.floor(gridWidth / blocksX);
+      const blockHeight = Math.floor(gridHeight / blocksY);
+      const centersX = [...Array(blocksX).keys()].map((i) => i * blockWidth + Math.floor(blockWidth / 2));
+      const centersY = [...Array(blocksY).keys()].map((i) => i * blockHeight + Math.floor(blockHeight / 2));
 
       // Boardwalks
-      this.drawRectangle(Math.floor(gridWidth / 2) - 2, 0, 5, gridHeight, '#666666');
-      this.drawRectangle(0, Math.floor(gridHeight / 2) - 2, gridWidth, 5, '#666666');
+      centersX.forEach((cx) => this.drawRectangle(cx - 2, 0, 5, gridHeight, '#666666', context));
+      centersY.forEach((cy) => this.drawRectangle(0, cy - 2, gridWidth, 5, '#666666', context));
 
       // Roads
-      this.drawRectangle(Math.floor(gridWidth / 2) - 1, 0, 3, gridHeight, '#ebebeb');
-      this.drawRectangle(0, Math.floor(gridHeight / 2) - 1, gridWidth, 3, '#ebebeb');
-   };
-
-   this.drawAgents = (objects) => {
-      objects.forEach((p) => {
-         this.drawVehicle(p.x, p.y, p.angle, p.color);
-      });
+      centersX.forEach((cx) => this.drawRectangle(cx - 1, 0, 3, gridHeight, '#ebebeb', context));
+      centersY.forEach((cy) => this.drawRectangle(0, cy - 1, gridWidth, 3, '#ebebeb', context));
    };
 
    /*
@@ -51,45 +86,109 @@ const TrafficCanvas = function(canvasWidth, canvasHeight, gridWidth, gridHeight,
       - center inwards tip
       - bottom right tip
    */
-   this.drawArrowHead = () => {
+   this.drawArrowHead = (context = ctx) => {
       const out_coef = 0.3  // how much out the inwards tip is
 
-      ctx.beginPath();
-      ctx.moveTo(0, -arrowR);
-      ctx.lineTo(-arrowR, arrowR);
-      ctx.lineTo(0, out_coef * arrowR);
-      ctx.lineTo(arrowR, arrowR);
-      ctx.closePath();
-
-      ctx.lineWidth = 2
-      ctx.strokeStyle = 'black'
-      ctx.stroke()
+      context.beginPath();
+      context.moveTo(0, -arrowR);
+      context.lineTo(-arrowR, arrowR);
+      context.lineTo(0, out_coef * arrowR);
+      context.lineTo(arrowR, arrowR);
+      context.closePath();
+
+      context.lineWidth = 2
+      context.strokeStyle = 'black'
+      context.stroke()
    };
 
    /*
    Draws a vehicle as an arrowhead with the angle appropriate to its
    direction.
    */
-   this.drawVehicle = (x, y, angle, color) => {
+   this.drawVehicle = (x, y, angle, color, context = ctx) => {
       const cx = (x + 0.5) * cellWidth;
       const cy = (y + 0.5) * cellHeight;
 
       // Save default state
-      ctx.save();
+      context.save();
 
       // Draw vehicle with its rotation
-      ctx.translate(cx, cy);
-      ctx.rotate(angle)
-      this.drawArrowHead()
-      ctx.fillStyle = color;
-      ctx.fill();
+      context.translate(cx, cy);
+      context.rotate(angle)
+      this.drawArrowHead(context)
+      context.fillStyle = color;
+      context.fill();
 
       // Restore default state
-      ctx.restore();
+      context.restore();
    }
 
+   // The road never changes, so it is only drawn once
+   const roadLayer = createLayer(canvasWidth, canvasHeight);
+   this.drawRoad(roadLayer.getContext('2d'));
+
+   // One sprite of a cell for each color and direction, copied instead
+   // of drawing the path of every vehicle
+   const sprites = colors.map((color) =>
+      [...Array(nDirections).keys()].map((direction) => {
+         const sprite = createLayer(cellWidth, cellHeight);
+         const angle = 2 * Math.PI * direction / nDirections;
+         this.drawVehicle(0, 0, angle, color, sprite.getContext('2d'));
+         return sprite;
+      })
+   );
+
+   const grow = (array, length) => {
+      const grown = new array.constructor(length);
+      grown.set(array);
+      return grown;
+   };
+
+   /*
+   Updates the state of the vehicles with a binary frame.
+   */
+   this.applyFrame = (buffer) => {
+      const view = new DataView(buffer);
+      const kind = view.getUint8(0);
+      const count = view.getUint32(1, true);
+
+      if (kind === keyframe) {
+         directions.fill(-1);
+      }
+      for (let i = 0, offset = headerSize; i < count; i++, offset += recordSize) {
+         const id = view.getUint32(offset, true);
+         if (id >= directions.length) {
+            const previous = directions.length;
+            const length = Math.max(id + 1, 2 * previous);
+            xs = grow(xs, length);
+            ys = grow(ys, length);
+            directions = grow(directions, length);
+            directions.fill(-1, previous);
+         }
+         xs[id] = view.getUint16(offset + 4, true);
+         ys[id] = view.getUint16(offset + 6, true);
+         directions[id] = view.getUint8(offset + 8);
+      }
+   };
+
+   this.drawAgents = () => {
+      for (let id = 0; id < directions.length; id++) {
+         const direction = directions[id];
+         if (direction !== -1) {
+            const sprite = sprites[id % colors.length][direction];
+            ctx.drawImage(sprite, xs[id] * cellWidth, ys[id] * cellHeight);
+         }
+      }
+   };
+
+   this.draw = () => {
+      ctx.drawImage(roadLayer, 0, 0);
+      this.drawAgents();
+   };
+
    this.resetCanvas = () => {
       ctx.clearRect(0, 0, canvasWidth, canvasHeight);
       ctx.beginPath();
+      directions.fill(-1);
    };
 };
@@ -1,11 +1,58 @@
 import json
-from typing import List
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
 
-from mesa.visualization.ModularVisualization import VisualizationElement
 from mesa import Model
 
+from vis.binary_server import ConnectionElement
 
-class ChartVisualization(VisualizationElement):
+
+Point = Tuple[float, float]
+
+
+def triangle_area(a: Point, b: Point, c: Point) -> float:
+   return abs((a[0] - c[0]) * (b[1] - a[1]) - (a[0] - b[0]) * (c[1] - a[1])) / 2
+
+
+def downsample(points: Sequence[Point], n_out: int) -> List[Point]:
+   '''Reduces the points to about `n_out`, with the Largest Triangle
+   Three Buckets algorithm by Steinarsson. The points are split in
+   buckets, each keeping the point forming the largest triangle with
+   the one kept in the previous bucket and the average of the next.
+   Buckets also keep their lowest and highest points, so that spikes
+   are never lost. Same as `downsample` in `module.js`.
+   '''
+   n_buckets = max(n_out // 3, 1)
+   if len(points) <= max(n_out, 3):
+      return list(points)
+
+   # The first and last points are always kept
+   size = (len(points) - 2) / n_buckets
+   kept = [points[0]]
+   previous = points[0]
+   for b in range(n_buckets):
+      start = int(b * size) + 1
+      end = int((b + 1) * size) + 1
+      bucket = points[start:end]
+      next_bucket = points[end:int((b + 2) * size) + 1] or [points[-1]]
+      average = (
+         sum(p[0] for p in next_bucket) / len(next_bucket),
+         sum(p[1] for p in next_bucket) / len(next_bucket)
+      )
+      largest = max(range(len(bucket)), key=lambda i: triangle_area(previous, bucket[i], average))
+      lowest = min(range(len(bucket)), key=lambda i: bucket[i][1])
+      highest = max(range(len(bucket)), key=lambda i: bucket[i][1])
+      kept += [bucket[i] for i in sorted({largest, lowest, highest})]
+      previous = bucket[largest]
+   kept.append(points[-1])
+   return kept
+
+
+class ChartVisualization(ConnectionElement):
+   '''Line chart of one or more series. Each frame sends the points since
+   the previous frame sent to the same browser, downsampled if there are
+   too many, and the browser keeps a bounded, downsampled history of each
+   series. The model only keeps the last values, in a `RecentSink`.
+   '''
    local_includes = ['vis/chart/Chart.min.js', 'vis/chart/module.js']
 
    def __init__(
@@ -13,37 +60,71 @@ class ChartVisualization(VisualizationElement):
       chart_title,
       canvas_width:  int,
       canvas_height: int,
-      data_collector_name='datacollector'
+      sink_name:     str = 'metrics',
+      series:        Optional[Dict[str, Union[str, Callable[[Model], float]]]] = None,
+      max_points:    int = 1000
    ) -> None:
       '''
       chart_title:
          Title of the chart.
       canvas_width, canvas_height:
          Size of the chart in pixels.
-      data_collector_name:
-         Name of the `DataCollector` to use.
+      sink_name:
+         Name of the `RecentSink` of the model to use.
+      series:
+         Label and source of each series: either the name of a reporter
+         of the sink, collected every step, or a
+         function of the model, only sampled once per frame. By default,
+         the variable named as the chart.
+      max_points:
+         Number of points each series is downsampled to, in each frame
+         and in the browser.
       '''
       self.chart_title = chart_title
-      self.data_collector_name = data_collector_name
+      self.sink_name = sink_name
+      self.series = series if series is not None else {chart_title: chart_title}
+      self.max_points = max_points
 
-      new_element = 'new ChartModule({}, {}, {})'
+      new_element = 'new ChartModule({}, {}, {}, {}, {})'
       new_element = new_element.format(
          '"' + self.chart_title + '"',
          canvas_width,
-         canvas_height
+         canvas_height,
+         json.dumps(list(self.series)),
+         max_points
       )
       self.js_code = 'elements.push(' + new_element + ');'
 
-   def render(self, model: Model) -> List[dict]:
-      '''Add new data point.
+   def render_for(
+      self,
+      model: Model,
+      sent:  Optional[Tuple[Model, Optional[int], int]]
+   ) -> Tuple[List[List[Point]], Tuple[Model, Optional[int], int]]:
+      '''Points `[step, value]` of each series since the last frame sent
+      to the connection, which can be many when the model steps in the
+      background. What was sent is the model, the step of the last
+      record of the sink and the step of the last frame.
       '''
-      current_values = []
-      data_collector = getattr(model, self.data_collector_name)
+      last_record, last_step = None, None
+      if sent is not None and sent[0] is model:
+         _, last_record, last_step = sent
+      step = model.schedule.steps
 
-      try:
-         val = data_collector.model_vars[self.chart_title][-1]  # latest value
-      except (IndexError, KeyError):
-         val = 0
-      current_values.append(val)
+      # Records collected since the last frame, from the most recent
+      records = []
+      for record in reversed(getattr(model, self.sink_name).records):
+         if last_record is not None and record['step'] <= last_record:
+            break
+         records.append(record)
+      records.reverse()
+      if records:
+         last_record = records[-1]['step']
 
-      return current_values
+      batches = []
+      for source in self.series.values():
+         if callable(source):
+            batch = [(step, source(model))] if step != last_step else []
+         else:
+            batch = [(record['step'], record[source]) for record in records]
+         batches.append(downsample(batch, self.max_points))
+      return batches, (model, last_record, step)
@@ -1,4 +1,54 @@
-const ChartModule = function(chartTitle, canvasWidth, canvasHeight) {
+/*
+Largest Triangle Three Buckets downsampling, keeping the lowest and
+highest point of each bucket. Same as `downsample` in
+`chart_visualization.py`.
+   points : array of {x, y}
+   nOut : approximate number of points to keep
+*/
+const downsample = function(points, nOut) {
+   const nBuckets = Math.max(Math.floor(nOut / 3), 1);
+   if (points.length <= Math.max(nOut, 3)) {
+      return points;
+   }
+
+   const area = (a, b, c) => Math.abs((a.x - c.x) * (b.y - a.y) - (a.x - b.x) * (c.y - a.y)) / 2;
+
+   // The first and last points are always kept
+   const size = (points.length - 2) / nBuckets;
+   const kept = [points[0]];
+   let previous = points[0];
+   for (let b = 0; b < nBuckets; b++) {
+      const start = Math.floor(b * size) + 1;
+      const end = Math.floor((b + 1) * size) + 1;
+      let next = points.slice(end, Math.floor((b + 2) * size) + 1);
+      if (next.length === 0) {
+         next = [points[points.length - 1]];
+      }
+      const average = {
+         x: next.reduce((sum, p) => sum + p.x, 0) / next.length,
+         y: next.reduce((sum, p) => sum + p.y, 0) / next.length
+      };
+
+      let largest = start, lowest = start, highest = start;
+      for (let i = start; i < end; i++) {
+         if (area(previous, points[i], average) > area(previous, points[largest], average)) {
+            largest = i;
+         }
+         if (points[i].y < points[lowest].y) {
+            lowest = i;
+         }
+         if (points[i].y > points[highest].y) {
+            highest = i;
+         }
+      }
+      [...new Set([largest, lowest, highest])].sort((i, j) => i - j).forEach((i) => kept.push(points[i]));
+      previous = points[largest];
+   }
+   kept.push(points[points.length - 1]);
+   return kept;
+};
+
+const ChartModule = function(chartTitle, canvasWidth, canvasHeight, seriesLabels = [chartTitle], maxPoints = 1000) {
 
    // Create HTML tag
    const canvas_tag =
@@ -16,20 +66,33 @@ const ChartModule = function(chartTitle, canvasWidth, canvasHeight) {
    // Create the context and the drawing controller
    const ctx = canvas_elem.getContext('2d');
 
-   // Prepare the chart properties
-   const dataset = {
-      borderColor: 'rgb(0, 0, 0, 0.4)',
-      backgroundColor: 'rgb(0, 0, 0, 0.6)',
+   // Prepare the chart properties, with one dataset for each series
+   const colors = [
+      'rgb(0, 0, 0, 0.6)',
+      'rgb(220, 20, 60, 0.6)',
+      'rgb(70, 130, 180, 0.6)',
+      'rgb(46, 139, 87, 0.6)',
+      'rgb(255, 140, 0, 0.6)',
+      'rgb(75, 0, 130, 0.6)',
+      'rgb(255, 105, 180, 0.6)',
+      'rgb(154, 205, 50, 0.6)'
+   ];
+   const datasets = seriesLabels.map((label, i) => ({
+      label: label,
+      borderColor: colors[i % colors.length],
+      backgroundColor: colors[i % colors.length],
+      pointRadius: 0,
       data: []
-   }
+   }));
 
    const chartData = {
-      labels: [],
-      datasets: [dataset]
+      datasets: datasets
    };
 
    const chartOptions = {
       responsive: true,
+      animation: false,
+      parsing: false,
       tooltips: {
          enabled: false
       },
@@ -39,7 +102,7 @@ const ChartModule = function(chartTitle, canvasWidth, canvasHeight) {
       },
       plugins: {
          legend: {
-            display: false
+            display: seriesLabels.length > 1
          },
          title: {
             display: true,
@@ -48,6 +111,7 @@ const ChartModule = function(chartTitle, canvasWidth, canvasHeight) {
       },
       scales: {
          x: {
+            type: 'linear',
             min: 0,
             display: true,
             title: {
@@ -74,20 +138,23 @@ const ChartModule = function(chartTitle, canvasWidth, canvasHeight) {
    });
 
    this.render = (data) => {
-      chart.data.labels.push(control.tick);
-      chart.data.datasets[0].data.push(data[0])
+      // All the points of each series since the last frame, keeping
+      // the history bounded
+      data.forEach((points, i) => {
+         const dataset = chart.data.datasets[i];
+         points.forEach(([step, value]) => dataset.data.push({x: step, y: value}));
+         if (dataset.data.length > 2 * maxPoints) {
+            dataset.data = downsample(dataset.data, maxPoints);
+         }
+      });
       chart.update();
    }
 
    this.reset = () => {
-      while (chart.data.labels.length) {
-         chart.data.labels.pop();
-      }
-      var dataset = chart.data.datasets[0].data
-      while (dataset.length) {
-         dataset.data.pop();
-      }
+      chart.data.datasets.forEach((dataset) => {
+         dataset.data = [];
+      });
       chart.update();
    }
 
-}
+}
\ No newline at end of file
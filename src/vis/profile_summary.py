@@ -0,0 +1,38 @@
+from mesa import Model
+from mesa.visualization.modules import TextElement
+
+from mas.profiling import Profiler
+
+
+class ProfileSummary(TextElement):
+   '''Table of the time spent in each stage since the model was reset,
+   updated live. Attaches a `Profiler` to the models it renders, so
+   that the server only pays for profiling when this element is shown.
+   '''
+
+   def __init__(self, max_spans: int = 0) -> None:
+      '''
+      max_spans:
+         Spans kept by the profiler for the exports, none by default.
+      '''
+      self.max_spans = max_spans
+
+   def render(self, model: Model) -> str:
+      if model.profiler is None:
+         model.set_profiler(Profiler(self.max_spans))
+      rows = ''.join(
+         '<tr><td>{name}</td><td>{calls}</td><td>{mean:.3f}</td>'
+         '<td>{share:.1%}</td><td>{agents:.0f}</td></tr>'.format(
+            name=row['name'],
+            calls=row['calls'],
+            mean=1000 * row['mean'],
+            share=row['share'],
+            agents=row['agents']
+         )
+         for row in model.profiler.summary()
+      )
+      return (
+         '<table class="table table-condensed">'
+         '<tr><th>Span</th><th>Calls</th><th>Mean (ms)</th><th>Share of step</th><th>Agents</th></tr>'
+         + rows + '</table>'
+      )
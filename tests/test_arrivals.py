@@ -0,0 +1,31 @@
+import random
+import statistics
+
+import pytest
+
+from mas.arrivals import PoissonArrivals, poisson
+from mas.model import FourWayStop
+from mas.profiling import Profiler
+
+
+@pytest.mark.parametrize('rate', [0.05, 3, 10, 250, 1000, 1e5])
+def test_poisson_mean_and_variance(rate):
+   rng = random.Random(0)
+   draws = [poisson(rate, rng) for _ in range(20000)]
+   assert min(draws) >= 0
+   assert statistics.mean(draws) == pytest.approx(rate, rel=0.05, abs=0.01)
+   assert statistics.variance(draws) == pytest.approx(rate, rel=0.1, abs=0.01)
+
+
+@pytest.mark.parametrize('backend', ['agents', 'numpy'])
+def test_profiled_step_counts_live_vehicles(backend):
+   model = FourWayStop(
+      5, 40, 40, 5, True, backend=backend, seed=0, mirror_grid=False,
+      arrivals=PoissonArrivals(0.1), profiler=Profiler()
+   )
+   counts = []
+   for _ in range(200):
+      counts.append(model.n_live_vehicles())
+      model.step()
+   assert len(set(counts)) > 1
+   assert model.profiler.agents['step'] == sum(counts)
@@ -0,0 +1,42 @@
+import pytest
+
+from mas.agents.vehicle import Vehicle
+from mas.model import FourWayStop
+
+
+def vehicle_state(model):
+   if model.vehicles is not None:
+      v = model.vehicles
+      return v.positions(), v.direction[:v.n].tolist(), v.velocity[:v.n].tolist()
+   vehicles = [a for a in model.schedule.agents if isinstance(a, Vehicle)]
+   return (
+      [tuple(a.pos) for a in vehicles],
+      [a.direction.direction for a in vehicles],
+      [a.velocity for a in vehicles]
+   )
+
+
+def stop_state(model):
+   return [(s.unique_id, s.status, s.wait_time) for s in model.stops()]
+
+
+@pytest.mark.parametrize('n_vehicles, size, max_velocity, avoid_deadlocks', [
+   (10, 40, 5, True),
+   (20, 40, 3, False),
+   (60, 30, 5, True),
+   (40, 21, 4, True)
+])
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_numpy_backend_matches_agents(n_vehicles, size, max_velocity, avoid_deadlocks, seed):
+   models = [
+      FourWayStop(n_vehicles, size, size, max_velocity, avoid_deadlocks, backend=backend, seed=seed)
+      for backend in ('agents', 'numpy')
+   ]
+   for _ in range(300):
+      for model in models:
+         model.step()
+      agents, numpy = models
+      assert vehicle_state(agents) == vehicle_state(numpy)
+      assert stop_state(agents) == stop_state(numpy)
+   assert agents.stats.summary() == numpy.stats.summary()
+   assert agents.datacollector.model_vars == numpy.datacollector.model_vars
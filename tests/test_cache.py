@@ -0,0 +1,54 @@
+import os
+
+from mas.batch import run_scenario
+from mas.cache import ResultCache
+
+
+config = dict(n_vehicles=10, width=40, height=40, max_velocity=5, avoid_deadlocks=True, seed=0)
+
+
+def test_eviction_keeps_the_cache_bounded(tmp_path):
+   cache = ResultCache(str(tmp_path), max_bytes=20000)
+   for i in range(500):
+      cache.put(cache.key({'i': i}), {'row': {'value': 'x' * 100}})
+   assert cache.size() <= 20000
+   assert cache.get(cache.key({'i': 499})) is not None
+   assert cache.get(cache.key({'i': 0})) is None
+
+
+def test_cached_scenario_restores_metrics(tmp_path):
+   cache = ResultCache(str(tmp_path / 'cache'))
+   rows = []
+   for name in ('first', 'second'):
+      metrics_dir = tmp_path / name
+      metrics_dir.mkdir()
+      rows.append(run_scenario(config, 200, metrics_dir=str(metrics_dir), cache=cache))
+   assert rows[0] == rows[1]
+   first, second = (
+      (tmp_path / name / os.listdir(tmp_path / name)[0]).read_text()
+      for name in ('first', 'second')
+   )
+   assert first == second
+   assert len(first.splitlines()) == 201
+
+
+def test_eviction_spares_metrics_being_written(tmp_path):
+   cache = ResultCache(str(tmp_path), max_bytes=None)
+   cache.put(cache.key({'i': 0}), {'row': {}})
+
+   # Metrics of an entry still being written, and of one whose eviction
+   # was interrupted long ago
+   series = tmp_path / 'series.csv'
+   series.write_text('step,value\n' * 100)
+   fresh, stale = cache.key({'i': 1}), cache.key({'i': 2})
+   for key in (fresh, stale):
+      os.makedirs(os.path.dirname(cache.series_path(key)), exist_ok=True)
+      with open(series, 'rb') as f:
+         cache.replace(cache.series_path(key), f)
+   old = os.path.getmtime(cache.series_path(stale)) - 3600
+   os.utime(cache.series_path(stale), (old, old))
+
+   cache.evict(0)
+   assert os.path.exists(cache.series_path(fresh))
+   assert not os.path.exists(cache.series_path(stale))
+   assert cache.get(cache.key({'i': 0})) is None
@@ -0,0 +1,49 @@
+import pytest
+
+from mas import checkpoint
+from mas.agents.vehicle import Vehicle
+from mas.metrics import MetricsSink
+from mas.model import FourWayStop, model_reporters
+from mas.network import RoadNetwork
+
+
+def state(model):
+   if model.vehicles is not None:
+      v = model.vehicles
+      vehicles = v.positions(), v.direction[:v.n].tolist(), v.turn[:v.n].tolist()
+   else:
+      agents = [a for a in model.schedule.agents if isinstance(a, Vehicle)]
+      vehicles = [a.pos for a in agents], [a.direction.direction for a in agents], [a.turn for a in agents]
+   metrics = model.datacollector.model_vars if model.datacollector else model.metrics.summary()
+   return (
+      vehicles,
+      [(s.unique_id, s.status, s.wait_time) for s in model.stops()],
+      model.stats.summary(),
+      model.stats.average_wait_time(),
+      model.random.random(),
+      metrics
+   )
+
+
+@pytest.mark.parametrize('make', [
+   lambda: FourWayStop(10, 40, 40, 5, True, seed=1),
+   lambda: FourWayStop(12, 40, 40, 4, True, seed=3, backend='numpy'),
+   lambda: RoadNetwork(
+      n_vehicles=50, n_columns=2, n_rows=2, block_width=20, block_height=20,
+      max_velocity=3, avoid_deadlocks=True, seed=2
+   ),
+   lambda: RoadNetwork(
+      n_vehicles=50, n_columns=2, n_rows=2, block_width=20, block_height=20,
+      max_velocity=3, avoid_deadlocks=True, seed=2, backend='numpy',
+      metrics=MetricsSink(model_reporters)
+   )
+], ids=['agents', 'numpy', 'network', 'network-sink'])
+def test_restore_continues_exactly(make):
+   model = make()
+   for _ in range(100):
+      model.step()
+   restored = checkpoint.loads(checkpoint.dumps(model))
+   for _ in range(200):
+      model.step()
+      restored.step()
+   assert state(model) == state(restored)
@@ -0,0 +1,36 @@
+from mas.convergence import ConvergenceMonitor
+from mas.model import FourWayStop
+
+
+def run(monitor, n_steps):
+   for _ in range(n_steps):
+      if monitor.update(None):
+         break
+   return monitor
+
+
+def test_series_stuck_at_zero_does_not_converge():
+   monitor = run(ConvergenceMonitor({'zero': lambda model: 0.0}), 5000)
+   assert not monitor.converged
+   assert monitor.estimates['zero'] == (0.0, 0.0)
+
+   # Unless an absolute tolerance accepts it
+   monitor = run(ConvergenceMonitor({'zero': lambda model: 0.0}, tolerance=0.1), 5000)
+   assert monitor.converged
+
+
+def test_series_stays_bounded():
+   monitor = run(ConvergenceMonitor({'one': lambda model: 1.0}, precision=0, tolerance=0), 100000)
+   assert len(monitor.series['one']) < monitor.max_batches
+   assert monitor.batch_size * len(monitor.series['one']) == monitor.steps - monitor.steps % monitor.batch_size
+
+
+def test_model_stops_at_steady_state():
+   model = FourWayStop(10, 40, 40, 5, True, seed=0, convergence=ConvergenceMonitor(precision=0.1))
+   for _ in range(20000):
+      if not model.running:
+         break
+      model.step()
+   assert not model.running
+   estimate, half_width = model.convergence.estimates['cleared']
+   assert 0 < half_width <= 0.1 * estimate
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from mas.ensemble import Ensemble
+from mas.metrics import MetricsSink
+from mas.model import FourWayStop, model_reporters
+
+
+@pytest.mark.parametrize('config', [
+   dict(n_vehicles=10, width=40, height=40, max_velocity=5, avoid_deadlocks=True),
+   dict(n_vehicles=40, width=40, height=40, max_velocity=3, avoid_deadlocks=False),
+   dict(n_vehicles=60, width=60, height=60, max_velocity=5, avoid_deadlocks=True,
+        blocks=(2, 2), turn_probability=0.3)
+])
+def test_ensemble_matches_single_runs(config):
+   seeds = list(range(6))
+   ensemble = Ensemble(seeds, **config)
+   ensemble.run(300)
+   for r, seed in enumerate(seeds):
+      sink = MetricsSink(model_reporters)
+      model = FourWayStop(backend='numpy', seed=seed, mirror_grid=False, metrics=sink, **config)
+      for _ in range(300):
+         model.step()
+      stops = model.stops()
+      assert model.vehicles.positions() == ensemble.positions(r)
+      assert np.array_equal(model.vehicles.velocity[:model.vehicles.n], ensemble.velocity[r])
+      assert [s.status.value for s in stops] == ensemble.status[r].tolist()
+      assert [s.wait_time for s in stops] == ensemble.wait_time[r].tolist()
+      assert model.stats.summary() == ensemble.summary(r)
+      summary = sink.summary()
+      for k, v in ensemble.wait_time_summary(r).items():
+         assert summary[k] == v
+
+
+def test_initial_state_matches_single_models():
+   config = dict(n_vehicles=80, width=40, height=40, max_velocity=5, avoid_deadlocks=True,
+                 blocks=(2, 2), turn_probability=0.3)
+   seeds = list(range(6))
+   ensemble = Ensemble(seeds, **config)
+   for r, seed in enumerate(seeds):
+      model = FourWayStop(backend='numpy', seed=seed, mirror_grid=False,
+                          metrics=MetricsSink({}), **config)
+      vehicles = model.vehicles
+      for name in ['x', 'y', 'new_x', 'new_y', 'direction', 'turn', 'velocity',
+                   'intersection_step', 'blocks_entered']:
+         assert np.array_equal(getattr(vehicles, name)[:vehicles.n], getattr(ensemble, name)[r])
+      assert np.array_equal(vehicles.occupancy, ensemble.occupancy[r])
+      assert model.route_key == ensemble.route_key[r]
@@ -0,0 +1,10 @@
+import pytest
+
+from mas.benchmark import check_imports, headless_modules
+
+
+@pytest.mark.parametrize('module', headless_modules)
+def test_headless_import(module):
+   # Best of a few imports in fresh interpreters, within the budget and
+   # without loading NumPy, pandas nor the web server stack
+   assert check_imports([module]) == []
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from mas.network import RoadNetwork
+from mas.parallel import ParallelRoadNetwork
+
+
+network = dict(
+   n_vehicles=60,
+   n_columns=3,
+   n_rows=4,
+   block_width=12,
+   block_height=10,
+   max_velocity=3,
+   avoid_deadlocks=True,
+   seed=5
+)
+
+
+@pytest.mark.parametrize('block_height', [7, 10])
+@pytest.mark.parametrize('n_workers', [1, 2, 4])
+def test_parallel_matches_serial(n_workers, block_height):
+   config = dict(network, block_height=block_height)
+   serial = RoadNetwork(backend='numpy', mirror_grid=False, **config)
+   with ParallelRoadNetwork(n_workers, **config) as parallel:
+      for _ in range(5):
+         for _ in range(20):
+            serial.step()
+         parallel.run(20)
+
+         n = serial.vehicles.n
+         for name in ('x', 'y', 'direction', 'velocity', 'intersection_step', 'turn'):
+            assert np.array_equal(getattr(serial.vehicles, name)[:n], getattr(parallel.vehicles, name)[:n])
+         assert np.array_equal(serial.vehicles.occupancy, parallel.vehicles.occupancy)
+         assert (
+            [(s.status, s.wait_time) for s in serial.stops()] ==
+            [(s.status, s.wait_time) for s in parallel.model.stops()]
+         )
+         assert serial.stats.summary() == parallel.stats.summary()
+         assert serial.stats.average_wait_time() == parallel.stats.average_wait_time()
+
+
+@pytest.mark.parametrize('block_height', [5, 6])
+def test_short_blocks_are_rejected(block_height):
+   with pytest.raises(ValueError):
+      ParallelRoadNetwork(2, **dict(network, block_height=block_height))
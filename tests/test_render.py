@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from mas.benchmark import bench_render, make_model
+from vis.canvas.grid_visualization import (
+   CanvasGridVisualization,
+   delta,
+   frame_header,
+   keyframe,
+   vehicle_record
+)
+
+
+def header(frame):
+   return np.frombuffer(frame[:frame_header.itemsize], dtype=frame_header)[0]
+
+
+@pytest.mark.parametrize('backend', ['agents', 'numpy'])
+def test_deltas_are_smaller_than_the_keyframe(backend):
+   model = make_model(40, 40, backend)
+   canvas = CanvasGridVisualization(500, 500, 40, 40)
+   first, sent = canvas.render_for(model, None)
+   assert header(first)['kind'] == keyframe
+   for _ in range(100):
+      model.step()
+      frame, sent = canvas.render_for(model, sent)
+      assert header(frame)['kind'] == delta
+      assert len(frame) < len(first)
+
+
+def test_connections_get_their_own_deltas():
+   model = make_model(40, 40, 'numpy')
+   canvas = CanvasGridVisualization(500, 500, 40, 40)
+   _, first = canvas.render_for(model, None)
+   model.step()
+   _, first = canvas.render_for(model, first)
+   model.step()
+
+   # A new connection starts from a keyframe, the first one gets a delta
+   late, _ = canvas.render_for(model, None)
+   frame, _ = canvas.render_for(model, first)
+   assert header(late)['kind'] == keyframe
+   assert header(frame)['kind'] == delta
+
+
+def test_bench_render_measures_deltas():
+   keyframe_bytes = frame_header.itemsize + 40 * vehicle_record.itemsize
+   assert bench_render(40, 40, 'numpy', 50, 1)['bytes_per_frame'] < keyframe_bytes
@@ -0,0 +1,19 @@
+import pytest
+
+from mas.model import FourWayStop
+
+
+@pytest.mark.parametrize('backend', ['agents', 'numpy'])
+def test_cleared_reporter_matches_cleared_vehicles(backend):
+   model = FourWayStop(20, 40, 40, 5, True, backend=backend, seed=1)
+   cleared = []
+   for _ in range(300):
+      before = model.stats.cleared
+      model.step()
+      cleared.append(model.stats.cleared - before)
+
+   # Each row is collected at the start of a step, so it reports the
+   # vehicles cleared during the previous one
+   reported = model.datacollector.model_vars['Cleared']
+   assert sum(cleared) > 0
+   assert reported == [0] + cleared[:-1]
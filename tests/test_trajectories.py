@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from mas.arrivals import PoissonArrivals
+from mas.model import FourWayStop
+from mas.trajectories import TrajectoryRecorder, Trajectories, vehicle_records
+
+
+@pytest.fixture
+def recorded(tmp_path):
+   '''Records an open-boundary run with both backends, starting from a
+   tiny file so that it grows several times, along with the records
+   expected at each step.
+   '''
+   traces = {}
+   for backend in ('agents', 'numpy'):
+      path = str(tmp_path / (backend + '.traj'))
+      expected = []
+      with TrajectoryRecorder(path, capacity=7) as recorder:
+         model = FourWayStop(
+            20, 40, 40, 5, True, backend=backend, seed=3, mirror_grid=False,
+            trajectories=recorder, arrivals=PoissonArrivals(0.05)
+         )
+         for _ in range(300):
+            expected.append(vehicle_records(model))
+            model.step()
+      traces[backend] = Trajectories(path), np.concatenate(expected)
+   return traces
+
+
+def test_round_trip(recorded):
+   for trajectories, expected in recorded.values():
+      assert len(trajectories) == len(expected)
+      assert np.array_equal(np.asarray(trajectories.records), expected)
+      window = expected[(expected['step'] >= 100) & (expected['step'] < 110)]
+      assert np.array_equal(trajectories.window(100, 110), window)
+      assert np.array_equal(trajectories.at(5), expected[expected['step'] == 5])
+
+
+def test_backends_record_the_same(recorded):
+   agents, numpy = (np.asarray(recorded[backend][0].records) for backend in ('agents', 'numpy'))
+   assert np.array_equal(agents, numpy)
+
+
+def test_vehicle_queries(recorded):
+   trajectories, expected = recorded['numpy']
+   for vehicle_id in [8, 20, 30, int(trajectories.ids[-1])]:
+      records = expected[expected['id'] == vehicle_id]
+      assert np.array_equal(trajectories.vehicle(vehicle_id), records)
+      assert trajectories.step_range(vehicle_id) == (records['step'][0], records['step'][-1])
+      between = records[(records['step'] >= 50) & (records['step'] < 120)]
+      assert np.array_equal(trajectories.vehicle(vehicle_id, 50, 120), between)
+   assert trajectories.step_range(9999) is None
+   assert len(trajectories.vehicle(9999)) == 0
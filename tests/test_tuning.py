@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from mas.tuning import advance, default_config, pareto_front, sobol, sobol_directions
+
+
+@pytest.mark.parametrize('seed', [None, 3])
+def test_sobol_points_are_balanced(seed):
+   d = len(sobol_directions) + 1
+   points = sobol(1 << 10, d, seed)
+   assert ((points >= 0) & (points < 1)).all()
+   for k in range(11):
+      n = 1 << k
+      slices = np.floor(points[:n] * n).astype(int)
+      for j in range(d):
+         assert sorted(slices[:, j]) == list(range(n))
+
+
+@pytest.mark.parametrize('backend', ['agents', 'numpy'])
+@pytest.mark.parametrize('config', [
+   default_config,
+   dict(default_config, n_vehicles=30, width=60, height=60, blocks=(2, 2), turn_probability=0.3)
+])
+def test_rungs_continue_from_checkpoints(config, backend):
+   _, data = advance((config, 7, None, 20, backend, True))
+   resumed, _ = advance((config, 7, data, 40, backend, False))
+   direct, _ = advance((config, 7, None, 60, backend, False))
+   assert resumed == direct
+
+
+def test_pareto_front():
+   rows = [
+      {'name': 'fast', 'wait_p95': 1.0, 'throughput': 10},
+      {'name': 'busy', 'wait_p95': 5.0, 'throughput': 50},
+      {'name': 'middle', 'wait_p95': 3.0, 'throughput': 30},
+      {'name': 'dominated', 'wait_p95': 4.0, 'throughput': 20},
+      {'name': 'slower', 'wait_p95': 1.0, 'throughput': 5},
+      {'name': 'tie', 'wait_p95': 3.0, 'throughput': 30}
+   ]
+   assert [row['name'] for row in pareto_front(rows)] == ['fast', 'busy', 'middle', 'tie']
+   assert pareto_front([]) == []
+   assert pareto_front(rows[:1]) == rows[:1]